@@ -12,6 +12,8 @@ class ModeType(str, Enum):
 
 RETURN_CODE_OK = [0]
 
+DPKG_STATUS_PATH = "/var/lib/dpkg/status"
+
 
 def list_of_strings(arg):
     return arg.split(",") if arg else []
@@ -28,6 +30,50 @@ def get_package_list_using_command(run_command="apt list --installed"):
     return [output_line.split("/")[0] for output_line in result if "/" in output_line]
 
 
+def get_dpkg_status_data(status_path=DPKG_STATUS_PATH):
+    """
+    Parses the dpkg status file in a single pass, instead of running `dpkg -s` for each package. The file
+    consists of one stanza per package, separated by empty lines:
+        Package: xxd
+        Status: install ok installed
+        Version: 2:8.1.2269-1ubuntu5.7
+        Source: vim (2:8.1.2269-1ubuntu5.7)
+        Description: tool to make (or reverse) a hex dump
+         xxd creates a hex dump of a given file or standard input.
+    The Source field is only present when the source package differs from the package, and can contain the
+    version of the source package.
+
+    :param status_path: str, path of the dpkg status file
+    :return: dict[str, dict], Dict with (keys=package names) and (values={"source": source package name or "",
+                              "version": package version})
+    """
+    status_data = {}
+    try:
+        with open(status_path, "r", encoding="utf-8", errors="replace") as status_file:
+            content = status_file.read()
+    except FileNotFoundError:
+        return status_data
+    for stanza in content.split("\n\n"):
+        fields = {}
+        for line in stanza.splitlines():
+            # Continuation lines of multi-line fields start with a space
+            if line and not line[0].isspace() and ":" in line:
+                key, value = line.split(":", 1)
+                fields[key] = value.strip()
+        if "Package" not in fields:
+            continue
+        # A package installed for multiple architectures has a stanza per architecture; `dpkg -s` shows
+        # the first one
+        status_data.setdefault(
+            fields["Package"],
+            {
+                "source": fields["Source"].split()[0] if fields.get("Source") else "",
+                "version": fields.get("Version", ""),
+            },
+        )
+    return status_data
+
+
 def get_installed_version_for_packages(package_list=[]):
     """
     Finds the currently installed version of the packages.
@@ -38,12 +84,13 @@ def get_installed_version_for_packages(package_list=[]):
     run_command = "apt list --installed"
     run_output = subprocess.run(run_command, shell=True, capture_output=True, text=True, check=True)
     result = run_output.stdout.strip().split("\n")
+    package_set = set(package_list)
     package_dict = {}
     for output_line in result:
         if "/" not in output_line:
             continue
         package_name = output_line.split("/")[0]
-        if package_name not in package_list:
+        if package_name not in package_set:
             continue
         if package_name in package_dict:
             raise ValueError(f"Package {package_name} already exists in {package_dict}")
@@ -61,8 +108,8 @@ def is_package_or_its_source_is_impacted_and_the_package_is_upgradable(
 
     :param package: str, package name
     :param source_package: str, source_package name
-    :param impacted_packages: list, List of all the impacted apt packages (or source apt packages)
-    :param upgradable_packages: list, List of all the upgradable apt packages
+    :param impacted_packages: set, Set of all the impacted apt packages (or source apt packages)
+    :param upgradable_packages: set, Set of all the upgradable apt packages
     :return: boolean
     """
     return (
@@ -77,6 +124,7 @@ def update_patch_package_list_and_upgradable_packages_data(
     upgradable_packages,
     patch_package_list,
     upgradable_packages_data_for_impacted_packages,
+    dpkg_status_data=None,
 ):
     """
     This method iterates through the apt packages to figure out packages that are impacted and upgradable and updates
@@ -112,21 +160,17 @@ def update_patch_package_list_and_upgradable_packages_data(
                                      method is to add data to this list.
     :param upgradable_packages_data_for_impacted_packages: dict[List], Dict of all the impacted source apt packages as keys and a list of their upgradable binaries as value.
                                                                        One of the core functionalities of this method is to add data to this dict.
+    :param dpkg_status_data: dict[str, dict], data returned by get_dpkg_status_data, it is read from the dpkg status file
+                                              if not provided.
     :return patch_package_list: list, the same input parameter that is modified by this function
     :return upgradable_packages_data_for_impacted_packages: dict[list], the same input parameter that is modified by this function
     """
+    if dpkg_status_data is None:
+        dpkg_status_data = get_dpkg_status_data()
+    impacted_packages = set(impacted_packages)
+    upgradable_packages = set(upgradable_packages)
     for package in installed_packages:
-        source_package = ""
-        # dpkg -s <package> gives the output in the following format:
-        #     Package: xxd
-        #     Status: install ok installed
-        #     Source: vim
-        # We extract the source package from the command output
-        source_extraction_cmd_output = subprocess.run(
-            f"dpkg -s {package} | grep ^Source", shell=True, capture_output=True, text=True
-        )
-        if source_extraction_cmd_output.returncode in RETURN_CODE_OK:
-            source_package = source_extraction_cmd_output.stdout.strip().split()[1]
+        source_package = dpkg_status_data.get(package, {}).get("source", "")
 
         if is_package_or_its_source_is_impacted_and_the_package_is_upgradable(
             package=package,
@@ -0,0 +1,221 @@
+"""
+Copyright 2019-2020 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+
+Licensed under the Apache License, Version 2.0 (the "License"). You
+may not use this file except in compliance with the License. A copy of
+the License is located at
+
+    http://aws.amazon.com/apache2.0/
+
+or in the "license" file accompanying this file. This file is
+distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF
+ANY KIND, either express or implied. See the License for the specific
+language governing permissions and limitations under the License.
+"""
+
+import concurrent.futures
+import hashlib
+import json
+import logging
+import os
+import re
+import threading
+import urllib.error
+import urllib.request
+
+import boto3
+
+import constants
+
+LOGGER = logging.getLogger(__name__)
+LOGGER.setLevel(logging.INFO)
+
+S3_URI_PATTERN = re.compile(r"s3:\/\/(.+?)\/(.+)")
+
+CHUNK_SIZE = 1024 * 1024
+
+
+def _file_sha256(path):
+    sha256 = hashlib.sha256()
+    with open(path, "rb") as artifact_file:
+        for chunk in iter(lambda: artifact_file.read(CHUNK_SIZE), b""):
+            sha256.update(chunk)
+    return sha256.hexdigest()
+
+
+class ArtifactCache(object):
+    """
+    On-disk cache of the artifacts downloaded for the builds (download_artifacts of the
+    buildspec), shared by all images:
+    - index/<key>.json maps the URI and ETag of an artifact to the sha256 of its content
+    - blobs/<sha256> holds the content, so identical artifacts are stored once
+    - partial/<key>.part holds interrupted downloads, which are resumed with range requests
+    An artifact is downloaded again when its ETag changes. Artifacts without an ETag are always
+    downloaded, but still stored by content.
+    """
+
+    def __init__(
+        self,
+        cache_dir=constants.ARTIFACT_CACHE_DIR,
+        max_workers=constants.MAX_WORKER_COUNT_FOR_DOWNLOADING_ARTIFACTS,
+    ):
+        """
+        :param cache_dir: str, directory of the cache
+        :param max_workers: int, number of concurrent downloads
+        """
+        self.cache_dir = cache_dir
+        self.max_workers = max_workers
+        self._lock = threading.Lock()
+        self._s3_client = None
+        self.hits = 0
+        self.downloads = 0
+        self.downloaded_bytes = 0
+        self.resumed_bytes = 0
+
+    def prefetch(self, artifacts):
+        """
+        Downloads artifacts concurrently, each URI once.
+
+        :param artifacts: iterable of tuple(str, str), URI and link type ("s3" or another
+                          type for http) of each artifact
+        :return: dict, URI -> local path of the artifact
+        """
+        link_types = dict(artifacts)
+        paths, errors = {}, []
+        if not link_types:
+            return paths
+        with concurrent.futures.ThreadPoolExecutor(
+            max_workers=min(self.max_workers, len(link_types))
+        ) as executor:
+            futures = {
+                executor.submit(self.fetch, uri, link_type): uri
+                for uri, link_type in link_types.items()
+            }
+            for future in concurrent.futures.as_completed(futures):
+                uri = futures[future]
+                try:
+                    paths[uri] = future.result()
+                except Exception as e:
+                    errors.append(f"{uri}: {type(e).__name__}: {e}")
+        if errors:
+            raise Exception("Artifact download failed:\n" + "\n".join(errors))
+        return paths
+
+    def fetch(self, uri, link_type):
+        """
+        Returns the local path of an artifact, downloading it unless it is in the cache.
+
+        :param uri: str, s3:// or http(s) URI
+        :param link_type: str, "s3" or another type for http
+        :return: str, path of the artifact in the cache
+        """
+        is_s3 = link_type == "s3" and uri.startswith("s3://")
+        if is_s3 and not S3_URI_PATTERN.match(uri):
+            raise ValueError(f"Regex matching on s3 URI failed: {uri}")
+
+        etag = self._get_s3_etag(uri) if is_s3 else self._get_http_etag(uri)
+        key = hashlib.sha256(f"{uri}\0{etag}".encode("utf-8")).hexdigest()
+        index_path = os.path.join(self.cache_dir, "index", f"{key}.json")
+        if etag and os.path.exists(index_path):
+            with open(index_path, "r") as index_file:
+                entry = json.load(index_file)
+            blob_path = os.path.join(self.cache_dir, "blobs", entry["sha256"])
+            if os.path.exists(blob_path) and os.path.getsize(blob_path) == entry["size"]:
+                with self._lock:
+                    self.hits += 1
+                LOGGER.info(f"Using cached {uri}")
+                return blob_path
+
+        partial_path = os.path.join(self.cache_dir, "partial", f"{key}.part")
+        os.makedirs(os.path.dirname(partial_path), exist_ok=True)
+        # Without an ETag, the partial content may belong to another version of the artifact
+        if not etag and os.path.exists(partial_path):
+            os.remove(partial_path)
+        offset = os.path.getsize(partial_path) if os.path.exists(partial_path) else 0
+        LOGGER.info(f"Downloading {uri}" + (f", resuming at byte {offset}" if offset else ""))
+        if is_s3:
+            self._download_s3(uri, etag, partial_path, offset)
+        else:
+            self._download_http(uri, etag, partial_path, offset)
+
+        sha256 = _file_sha256(partial_path)
+        size = os.path.getsize(partial_path)
+        blob_path = os.path.join(self.cache_dir, "blobs", sha256)
+        os.makedirs(os.path.dirname(blob_path), exist_ok=True)
+        os.replace(partial_path, blob_path)
+        if etag:
+            os.makedirs(os.path.dirname(index_path), exist_ok=True)
+            temporary_path = f"{index_path}.{os.getpid()}.{threading.get_ident()}"
+            with open(temporary_path, "w") as index_file:
+                json.dump({"uri": uri, "etag": etag, "sha256": sha256, "size": size}, index_file)
+            os.replace(temporary_path, index_path)
+        with self._lock:
+            self.downloads += 1
+        return blob_path
+
+    def _get_s3_client(self):
+        # boto3 clients are thread safe, but creating them is not
+        with self._lock:
+            if self._s3_client is None:
+                self._s3_client = boto3.Session().client("s3")
+            return self._s3_client
+
+    def _get_s3_etag(self, uri):
+        bucket_name, bucket_key = S3_URI_PATTERN.match(uri).groups()
+        return self._get_s3_client().head_object(Bucket=bucket_name, Key=bucket_key)["ETag"]
+
+    def _get_http_etag(self, uri):
+        try:
+            request = urllib.request.Request(uri, method="HEAD")
+            with urllib.request.urlopen(request, timeout=60) as response:
+                return response.headers.get("ETag")
+        except (urllib.error.URLError, OSError) as e:
+            LOGGER.info(f"Could not get the ETag of {uri}, it will not be cached: {e}")
+            return None
+
+    def _download_s3(self, uri, etag, partial_path, offset):
+        bucket_name, bucket_key = S3_URI_PATTERN.match(uri).groups()
+        request = {"Bucket": bucket_name, "Key": bucket_key, "IfMatch": etag}
+        if offset:
+            request["Range"] = f"bytes={offset}-"
+        response = self._get_s3_client().get_object(**request)
+        self._write(response["Body"].iter_chunks(CHUNK_SIZE), partial_path, offset)
+
+    def _download_http(self, uri, etag, partial_path, offset):
+        request = urllib.request.Request(uri)
+        if offset:
+            request.add_header("Range", f"bytes={offset}-")
+            # The server sends the whole artifact instead if it changed since the partial download
+            request.add_header("If-Range", etag)
+        with urllib.request.urlopen(request, timeout=600) as response:
+            if response.status != 206:
+                offset = 0
+            content_length = response.headers.get("Content-Length")
+            self._write(iter(lambda: response.read(CHUNK_SIZE), b""), partial_path, offset)
+        # A dropped connection ends the response early without an error
+        if content_length is not None:
+            size = os.path.getsize(partial_path)
+            if size != offset + int(content_length):
+                raise IOError(
+                    f"Download of {uri} ended after {size} of {offset + int(content_length)} "
+                    f"bytes, it will be resumed on the next attempt"
+                )
+
+    def _write(self, chunks, partial_path, offset):
+        with open(partial_path, "ab" if offset else "wb") as partial_file:
+            for chunk in chunks:
+                partial_file.write(chunk)
+                with self._lock:
+                    self.downloaded_bytes += len(chunk)
+        if offset:
+            with self._lock:
+                self.resumed_bytes += offset
+
+    def report(self):
+        """
+        :return: str, downloads and cache hits
+        """
+        return (
+            f"Downloaded {self.downloads} artifacts ({self.downloaded_bytes / (1024 * 1024):.1f} "
+            f"MB, {self.resumed_bytes / (1024 * 1024):.1f} MB resumed), {self.hits} from cache"
+        )
@@ -0,0 +1,117 @@
+"""
+Copyright 2019-2020 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+
+Licensed under the Apache License, Version 2.0 (the "License"). You
+may not use this file except in compliance with the License. A copy of
+the License is located at
+
+    http://aws.amazon.com/apache2.0/
+
+or in the "license" file accompanying this file. This file is
+distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF
+ANY KIND, either express or implied. See the License for the specific
+language governing permissions and limitations under the License.
+"""
+
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+
+import constants
+
+# Label values embedding the build date, e.g. datetime tags, differ on every run
+DATETIME_PATTERN = re.compile(r"\d{4}-\d{2}-\d{2}")
+
+_INDEX = None
+_INDEX_LOCK = threading.Lock()
+
+
+def compute_fingerprint(dockerfile, build_args, labels, target, context_digest):
+    """
+    Computes a deterministic fingerprint of everything that goes into an image build.
+
+    :param dockerfile: str, path of the Dockerfile
+    :param build_args: dict, resolved build args, image references replaced by image ids
+    :param labels: dict, image labels
+    :param target: str, build target stage
+    :param context_digest: str, content hash of the build context
+    :return: str, sha256 hex digest
+    """
+    with open(dockerfile, "rb") as dockerfile_handle:
+        dockerfile_digest = hashlib.sha256(dockerfile_handle.read()).hexdigest()
+    stable_labels = {
+        label: str(value)
+        for label, value in labels.items()
+        if label != constants.BUILD_FINGERPRINT_LABEL and not DATETIME_PATTERN.search(str(value))
+    }
+    fingerprint_input = {
+        "dockerfile": dockerfile_digest,
+        "build_args": {arg: str(value) for arg, value in build_args.items()},
+        "labels": stable_labels,
+        "target": target,
+        "context": context_digest,
+    }
+    return hashlib.sha256(json.dumps(fingerprint_input, sort_keys=True).encode("utf-8")).hexdigest()
+
+
+class LocalFingerprintIndex:
+    """
+    Fingerprint index stored in a local JSON file, mapping build fingerprints to the URI of an
+    image built with that fingerprint. Entries older than max_age_days are ignored so that
+    images still pick up upstream base image updates regularly.
+    """
+
+    def __init__(self, path, max_age_days=constants.BUILD_FINGERPRINT_MAX_AGE_DAYS):
+        self.path = path
+        self.max_age_seconds = max_age_days * 24 * 60 * 60
+        self._lock = threading.Lock()
+
+    def _load(self):
+        if not os.path.exists(self.path):
+            return {}
+        with open(self.path, "r") as index_file:
+            return json.load(index_file)
+
+    def lookup(self, fingerprint):
+        """
+        :param fingerprint: str, build fingerprint
+        :return: str, URI of an image built with this fingerprint, None if there is none
+        """
+        with self._lock:
+            entry = self._load().get(fingerprint)
+        if not entry or time.time() - entry["created"] > self.max_age_seconds:
+            return None
+        return entry["image_uri"]
+
+    def record(self, fingerprint, image_uri):
+        """
+        :param fingerprint: str, build fingerprint
+        :param image_uri: str, URI of the image built with this fingerprint
+        """
+        with self._lock:
+            index = self._load()
+            index[fingerprint] = {"image_uri": image_uri, "created": time.time()}
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            temporary_path = f"{self.path}.{os.getpid()}"
+            with open(temporary_path, "w") as index_file:
+                json.dump(index, index_file, indent=4)
+            os.replace(temporary_path, self.path)
+
+
+def get_fingerprint_index():
+    """
+    Returns the fingerprint index configured through BUILD_FINGERPRINT_INDEX, None if
+    fingerprint lookups are disabled.
+    """
+    global _INDEX
+    if not constants.BUILD_FINGERPRINT_INDEX:
+        return None
+    with _INDEX_LOCK:
+        if _INDEX is None:
+            _INDEX = LocalFingerprintIndex(constants.BUILD_FINGERPRINT_INDEX)
+    return _INDEX
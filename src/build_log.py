@@ -0,0 +1,193 @@
+"""
+Copyright 2019-2020 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+
+Licensed under the Apache License, Version 2.0 (the "License"). You
+may not use this file except in compliance with the License. A copy of
+the License is located at
+
+    http://aws.amazon.com/apache2.0/
+
+or in the "license" file accompanying this file. This file is
+distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF
+ANY KIND, either express or implied. See the License for the specific
+language governing permissions and limitations under the License.
+"""
+
+import json
+import os
+import re
+import threading
+import time
+
+from collections import deque
+
+import constants
+
+# Line printed by the docker builder when it starts a Dockerfile instruction
+STEP_PATTERN = re.compile(r"^Step (?P<number>\d+)/(?P<total>\d+) : (?P<instruction>.*)$")
+# Line printed by the docker builder when a step reuses a layer from the build cache
+CACHE_HIT_LINE = "---> Using cache"
+
+
+class BuildStep(object):
+    """
+    A Dockerfile instruction executed by a docker build.
+    """
+
+    def __init__(self, number, total, instruction, start_time):
+        self.number = number
+        self.total = total
+        self.instruction = instruction
+        self.start_time = start_time
+        self.end_time = None
+        self.cached = False
+
+    @property
+    def seconds(self):
+        if self.end_time is None:
+            return 0
+        return self.end_time - self.start_time
+
+
+class BuildLog(object):
+    """
+    Streaming log sink of an image. Every line is written as a JSON record with its time and
+    Dockerfile step to an NDJSON file, rotated once it reaches max_bytes. Only the last
+    tail_size lines are kept in memory, for the error reports.
+    """
+
+    def __init__(
+        self,
+        path,
+        tail_size=constants.BUILD_LOG_TAIL_LINES,
+        max_bytes=constants.BUILD_LOG_MAX_BYTES,
+        backup_count=constants.BUILD_LOG_BACKUP_COUNT,
+    ):
+        """
+        :param path: str, path of the NDJSON log file, created on the first write
+        :param tail_size: int, number of lines kept in memory
+        :param max_bytes: int, size at which the log file is rotated
+        :param backup_count: int, number of rotated log files kept
+        """
+        self.path = path
+        self.max_bytes = max_bytes
+        self.backup_count = backup_count
+        self.steps = []
+        self._tail = deque(maxlen=tail_size)
+        self._lock = threading.Lock()
+        self._file = None
+        self._size = 0
+        self._is_started = False
+
+    def append(self, lines):
+        """
+        Writes a list of lines, e.g. the response of a build phase.
+
+        :param lines: list[str]
+        """
+        for line in lines:
+            self.write(line)
+
+    def write(self, text):
+        """
+        Writes text, split into lines. A docker "Step N/M" line ends the current step and
+        starts a new one.
+
+        :param text: str
+        """
+        now = time.time()
+        with self._lock:
+            for line in str(text).splitlines():
+                if not line.strip():
+                    continue
+                match = STEP_PATTERN.match(line.strip())
+                if match:
+                    self._end_step(now)
+                    self.steps.append(
+                        BuildStep(
+                            int(match.group("number")),
+                            int(match.group("total")),
+                            match.group("instruction"),
+                            now,
+                        )
+                    )
+                current_step = (
+                    self.steps[-1] if self.steps and self.steps[-1].end_time is None else None
+                )
+                if current_step and line.strip() == CACHE_HIT_LINE:
+                    current_step.cached = True
+                record = {
+                    "time": round(now, 3),
+                    "step": f"{current_step.number}/{current_step.total}" if current_step else None,
+                    "line": line,
+                }
+                self._write_record(json.dumps(record) + "\n")
+                self._tail.append(line)
+
+    def end_step(self):
+        """
+        Ends the current Dockerfile step, once the build is done or failed.
+        """
+        with self._lock:
+            self._end_step(time.time())
+
+    def _end_step(self, end_time):
+        if self.steps and self.steps[-1].end_time is None:
+            self.steps[-1].end_time = end_time
+
+    def _write_record(self, record):
+        if self._file is None:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            # Logs of a previous run are overwritten, a closed log is reopened for appending
+            if not self._is_started:
+                for index in range(1, self.backup_count + 1):
+                    if os.path.exists(f"{self.path}.{index}"):
+                        os.remove(f"{self.path}.{index}")
+            self._file = open(self.path, "a" if self._is_started else "w")
+            self._size = self._file.tell()
+            self._is_started = True
+        elif self._size + len(record) > self.max_bytes:
+            self._rotate()
+        self._file.write(record)
+        self._file.flush()
+        self._size += len(record)
+
+    def _rotate(self):
+        self._file.close()
+        for index in range(self.backup_count - 1, 0, -1):
+            if os.path.exists(f"{self.path}.{index}"):
+                os.replace(f"{self.path}.{index}", f"{self.path}.{index + 1}")
+        if self.backup_count > 0:
+            os.replace(self.path, f"{self.path}.1")
+        self._file = open(self.path, "w")
+        self._size = 0
+
+    def tail(self, number_of_lines=10):
+        """
+        :param number_of_lines: int, at most tail_size
+        :return: list[str], last lines written
+        """
+        with self._lock:
+            return list(self._tail)[-number_of_lines:]
+
+    def records(self):
+        """
+        Reads back the records of the rotated and current log files, oldest first.
+
+        :return: generator of dict
+        """
+        paths = [f"{self.path}.{index}" for index in range(self.backup_count, 0, -1)]
+        for path in paths + [self.path]:
+            if not os.path.exists(path):
+                continue
+            with open(path, "r") as log_file:
+                for record in log_file:
+                    yield json.loads(record)
+
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
@@ -0,0 +1,240 @@
+"""
+Copyright 2019-2020 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+
+Licensed under the Apache License, Version 2.0 (the "License"). You
+may not use this file except in compliance with the License. A copy of
+the License is located at
+
+    http://aws.amazon.com/apache2.0/
+
+or in the "license" file accompanying this file. This file is
+distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF
+ANY KIND, either express or implied. See the License for the specific
+language governing permissions and limitations under the License.
+"""
+
+import json
+import os
+import time
+
+from collections import defaultdict, deque
+
+import constants
+
+# A step or layer regressed if it grew by more than both thresholds, smaller changes are noise
+MIN_STEP_REGRESSION_SECONDS = 30
+MIN_STEP_REGRESSION_RATIO = 0.2
+MIN_LAYER_REGRESSION_BYTES = 10 * 1024 * 1024
+MIN_LAYER_REGRESSION_RATIO = 0.1
+
+# Length at which instructions are cut in the regression messages
+MAX_INSTRUCTION_LENGTH = 100
+
+
+def get_layers(client, image_uri):
+    """
+    :param client: docker.APIClient
+    :param image_uri: str, local image
+    :return: list[dict], instruction and size in bytes of each entry of the image history,
+             oldest first
+    """
+    return [
+        {"created_by": entry.get("CreatedBy") or "", "size": entry.get("Size") or 0}
+        for entry in reversed(client.history(image_uri))
+    ]
+
+
+def attribute_layers_to_steps(steps, layers):
+    """
+    Sets the step number of the layers created by the build. Every instruction of the last build
+    stage but FROM adds an entry to the image history, so the last entries of the history belong
+    to the steps following the last FROM. Layers are left unattributed if the counts do not match.
+
+    :param steps: list[dict], profiled steps
+    :param layers: list[dict], layers returned by get_layers
+    """
+    from_indexes = [
+        index for index, step in enumerate(steps) if step["instruction"].upper().startswith("FROM ")
+    ]
+    last_stage_steps = steps[from_indexes[-1] + 1 :] if from_indexes else steps
+    if not last_stage_steps or len(last_stage_steps) > len(layers):
+        return
+    for step, layer in zip(last_stage_steps, layers[-len(last_stage_steps) :]):
+        layer["step"] = step["number"]
+
+
+def _shorten(instruction):
+    instruction = " ".join(instruction.split())
+    if len(instruction) > MAX_INSTRUCTION_LENGTH:
+        return instruction[: MAX_INSTRUCTION_LENGTH - 3] + "..."
+    return instruction
+
+
+def _is_regression(previous, current, min_delta, min_ratio):
+    return current - previous >= min_delta and current - previous >= previous * min_ratio
+
+
+class BuildProfiler(object):
+    """
+    Records the duration and build cache hits of each Dockerfile step and the size of each layer
+    of every image build, as a time series per image. Each new profile is compared with the
+    previous build of the same image, to point at the steps and layers responsible for build time
+    and image size regressions.
+    """
+
+    def __init__(
+        self,
+        profile_dir=constants.BUILD_PROFILE_DIR,
+        history_size=constants.BUILD_PROFILE_HISTORY_SIZE,
+    ):
+        """
+        :param profile_dir: str, directory of the time series files
+        :param history_size: int, number of profiles kept per image
+        """
+        self.profile_dir = profile_dir
+        self.history_size = history_size
+
+    def get_path(self, image):
+        repository_name = image.repository.split("/")[-1]
+        return os.path.join(
+            self.profile_dir, f"{repository_name}-{image.name}-{image.stage}.ndjson"
+        )
+
+    def profile(self, image):
+        """
+        :param image: DockerImage, built image
+        :return: dict, profile of the build
+        """
+        steps = [
+            {
+                "number": step.number,
+                "instruction": step.instruction,
+                "seconds": round(step.seconds, 2),
+                "cached": step.cached,
+            }
+            for step in image.log.steps
+        ]
+        layers = get_layers(image.client, image.ecr_url)
+        attribute_layers_to_steps(steps, layers)
+        return {
+            "time": round(time.time(), 3),
+            "image_uri": image.ecr_url,
+            "image_size": image.summary.get("image_size"),
+            "build_seconds": round(sum(step["seconds"] for step in steps), 2),
+            "cache_hits": sum(step["cached"] for step in steps),
+            "steps": steps,
+            "layers": layers,
+        }
+
+    def load(self, image):
+        """
+        :param image: DockerImage
+        :return: list[dict], recorded profiles of the image, oldest first
+        """
+        path = self.get_path(image)
+        if not os.path.exists(path):
+            return []
+        with open(path, "r") as profile_file:
+            return [json.loads(line) for line in profile_file if line.strip()]
+
+    def record(self, image):
+        """
+        Profiles the build of an image and appends the profile to its time series.
+
+        :param image: DockerImage, built image
+        :return: tuple(dict, list[str]), profile and regressions since the previous build
+        """
+        profiles = self.load(image)
+        profile = self.profile(image)
+        regressions = self.diff(profiles[-1], profile) if profiles else []
+
+        path = self.get_path(image)
+        os.makedirs(self.profile_dir, exist_ok=True)
+        with open(f"{path}.tmp", "w") as profile_file:
+            for recorded_profile in (profiles + [profile])[-self.history_size :]:
+                profile_file.write(json.dumps(recorded_profile) + "\n")
+        os.replace(f"{path}.tmp", path)
+        return profile, regressions
+
+    @staticmethod
+    def diff(previous, current):
+        """
+        Compares two profiles of an image. Steps and layers are matched by instruction, since
+        adding an instruction changes the numbers of the following steps.
+
+        :param previous: dict, profile of the previous build
+        :param current: dict, profile of the current build
+        :return: list[str], slower steps first, then bigger layers, largest regressions first
+        """
+        step_regressions = []
+        previous_steps = defaultdict(deque)
+        for step in previous["steps"]:
+            previous_steps[step["instruction"]].append(step)
+        for step in current["steps"]:
+            name = f"Step {step['number']} ({_shorten(step['instruction'])})"
+            previous_step = (
+                previous_steps[step["instruction"]].popleft()
+                if previous_steps[step["instruction"]]
+                else None
+            )
+            if previous_step is None:
+                if step["seconds"] >= MIN_STEP_REGRESSION_SECONDS:
+                    step_regressions.append(
+                        (step["seconds"], f"{name} is new and took {step['seconds']:.0f}s")
+                    )
+                continue
+            if _is_regression(
+                previous_step["seconds"],
+                step["seconds"],
+                MIN_STEP_REGRESSION_SECONDS,
+                MIN_STEP_REGRESSION_RATIO,
+            ):
+                cache_miss = (
+                    ", it no longer hits the build cache"
+                    if previous_step["cached"] and not step["cached"]
+                    else ""
+                )
+                step_regressions.append(
+                    (
+                        step["seconds"] - previous_step["seconds"],
+                        f"{name} took {step['seconds']:.0f}s instead of "
+                        f"{previous_step['seconds']:.0f}s{cache_miss}",
+                    )
+                )
+
+        layer_regressions = []
+        previous_layers = defaultdict(deque)
+        for layer in previous["layers"]:
+            previous_layers[layer["created_by"]].append(layer)
+        for layer in current["layers"]:
+            step = f" of step {layer['step']}" if layer.get("step") else ""
+            name = f"Layer{step} ({_shorten(layer['created_by'])})"
+            size_mb = layer["size"] / (1024 * 1024)
+            previous_layer = (
+                previous_layers[layer["created_by"]].popleft()
+                if previous_layers[layer["created_by"]]
+                else None
+            )
+            if previous_layer is None:
+                if layer["size"] >= MIN_LAYER_REGRESSION_BYTES:
+                    layer_regressions.append((layer["size"], f"{name} is new, {size_mb:.1f} MB"))
+                continue
+            if _is_regression(
+                previous_layer["size"],
+                layer["size"],
+                MIN_LAYER_REGRESSION_BYTES,
+                MIN_LAYER_REGRESSION_RATIO,
+            ):
+                previous_size_mb = previous_layer["size"] / (1024 * 1024)
+                layer_regressions.append(
+                    (
+                        layer["size"] - previous_layer["size"],
+                        f"{name} grew from {previous_size_mb:.1f} MB to {size_mb:.1f} MB",
+                    )
+                )
+
+        return [
+            message
+            for regressions in (step_regressions, layer_regressions)
+            for _, message in sorted(regressions, key=lambda regression: -regression[0])
+        ]
@@ -0,0 +1,180 @@
+"""
+Copyright 2019-2020 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+
+Licensed under the Apache License, Version 2.0 (the "License"). You
+may not use this file except in compliance with the License. A copy of
+the License is located at
+
+    http://aws.amazon.com/apache2.0/
+
+or in the "license" file accompanying this file. This file is
+distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF
+ANY KIND, either express or implied. See the License for the specific
+language governing permissions and limitations under the License.
+"""
+
+import concurrent.futures
+import time
+
+from collections import deque
+
+import constants
+
+
+class BuildTask(object):
+    """
+    A node of the build graph: one step (build, push, retag, ...) of one image.
+    """
+
+    def __init__(self, name, function, resource, dependencies):
+        self.name = name
+        self.function = function
+        self.resource = resource
+        self.dependencies = list(dependencies)
+        self.status = None
+        self.error = None
+        self.skipped_by = None
+        self.ready_time = None
+        self.start_time = None
+        self.end_time = None
+
+    @property
+    def failed(self):
+        return (
+            self.error is not None or self.skipped_by is not None or self.status == constants.FAIL
+        )
+
+    @property
+    def duration(self):
+        if self.start_time is None or self.end_time is None:
+            return 0
+        return self.end_time - self.start_time
+
+
+class BuildScheduler(object):
+    """
+    Runs build tasks as soon as all of their dependencies have finished, with at most
+    resource_limits[resource] tasks of each resource running at the same time.
+
+    Tasks whose dependencies failed are skipped. Once all tasks are done, the critical path,
+    i.e. the chain of tasks that determined the total build time, can be retrieved.
+    """
+
+    def __init__(self, resource_limits):
+        """
+        :param resource_limits: dict, maximum number of concurrent tasks per resource
+        """
+        self.resource_limits = dict(resource_limits)
+        self.tasks = {}
+        self.start_time = None
+        self.end_time = None
+
+    def add_task(self, name, function, resource, dependencies=()):
+        """
+        Add a task to the graph. Dependencies must have been added before.
+
+        :param name: str, unique name of the task
+        :param function: callable without arguments, returns a build status
+        :param resource: str, key of resource_limits the task consumes a slot of
+        :param dependencies: list[str], names of the tasks that must finish first
+        :return: str, name of the task
+        """
+        if name in self.tasks:
+            raise ValueError(f"Task {name} was already added to the build graph")
+        if resource not in self.resource_limits:
+            raise ValueError(f"Unknown resource {resource} for task {name}")
+        for dependency in dependencies:
+            if dependency not in self.tasks:
+                raise ValueError(f"Task {name} depends on unknown task {dependency}")
+        self.tasks[name] = BuildTask(name, function, resource, dependencies)
+        return name
+
+    def run(self, on_task_done=None):
+        """
+        Execute all tasks and return them once they are all done.
+
+        :param on_task_done: callable, invoked with each BuildTask when it completes or is skipped
+        :return: dict, task name -> BuildTask
+        """
+        self.start_time = time.time()
+        remaining_dependencies = {name: len(task.dependencies) for name, task in self.tasks.items()}
+        dependents = {name: [] for name in self.tasks}
+        for task in self.tasks.values():
+            for dependency in task.dependencies:
+                dependents[dependency].append(task.name)
+
+        ready = {resource: deque() for resource in self.resource_limits}
+        running = {resource: 0 for resource in self.resource_limits}
+        for name, count in remaining_dependencies.items():
+            if count == 0:
+                self.tasks[name].ready_time = self.start_time
+                ready[self.tasks[name].resource].append(name)
+
+        futures = {}
+        max_workers = max(1, sum(self.resource_limits.values()))
+        with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+            while True:
+                for resource, queue in ready.items():
+                    while queue and running[resource] < self.resource_limits[resource]:
+                        task = self.tasks[queue.popleft()]
+                        running[resource] += 1
+                        futures[executor.submit(self._execute, task)] = task
+                if not futures:
+                    break
+
+                done, _ = concurrent.futures.wait(
+                    futures, return_when=concurrent.futures.FIRST_COMPLETED
+                )
+                for future in done:
+                    task = futures.pop(future)
+                    running[task.resource] -= 1
+                    finished = [task]
+                    # a failed task skips everything that depends on it, transitively
+                    while finished:
+                        current = finished.pop()
+                        if on_task_done:
+                            on_task_done(current)
+                        for name in dependents[current.name]:
+                            dependent = self.tasks[name]
+                            if current.failed and dependent.skipped_by is None:
+                                dependent.skipped_by = current.name
+                            remaining_dependencies[name] -= 1
+                            if remaining_dependencies[name] == 0:
+                                dependent.ready_time = time.time()
+                                if dependent.skipped_by is not None:
+                                    finished.append(dependent)
+                                else:
+                                    ready[dependent.resource].append(name)
+        self.end_time = time.time()
+        return self.tasks
+
+    def _execute(self, task):
+        task.start_time = time.time()
+        try:
+            task.status = task.function()
+        except Exception as e:
+            task.error = f"{type(e).__name__}: {e}"
+        task.end_time = time.time()
+        return task
+
+    def critical_path(self):
+        """
+        Walk back from the task that finished last, each time through the dependency that
+        finished last, which is the one that held the task back.
+
+        :return: list[BuildTask], from the first to the last task of the critical path
+        """
+        executed = [task for task in self.tasks.values() if task.end_time is not None]
+        if not executed:
+            return []
+        path = [max(executed, key=lambda task: task.end_time)]
+        while True:
+            dependencies = [
+                self.tasks[name]
+                for name in path[-1].dependencies
+                if self.tasks[name].end_time is not None
+            ]
+            if not dependencies:
+                break
+            path.append(max(dependencies, key=lambda task: task.end_time))
+        return list(reversed(path))
@@ -13,11 +13,131 @@ ANY KIND, either express or implied. See the License for the specific
 language governing permissions and limitations under the License.
 """
 
+import copy
 import os
+import threading
 import warnings
 
 import ruamel.yaml
 
+from ruamel.yaml.constructor import SafeConstructor
+
+# Tags of the anchored values that environment variables override, as in Buildspec.override
+OVERRIDABLE_TAGS = (
+    "tag:yaml.org,2002:str",
+    "tag:yaml.org,2002:float",
+    "tag:yaml.org,2002:bool",
+    "!join",
+)
+
+_BUILDSPEC_CACHE = {}
+_BUILDSPEC_CACHE_LOCK = threading.Lock()
+
+
+class FrozenDict(dict):
+    """
+    Read-only dict of a resolved buildspec. Lookups are plain dict lookups, copies made with
+    copy.copy or copy.deepcopy are regular, mutable dicts.
+    """
+
+    def _read_only(self, *args, **kwargs):
+        raise TypeError("Resolved buildspecs are read-only, copy them to make changes")
+
+    __setitem__ = __delitem__ = __ior__ = _read_only
+    clear = pop = popitem = setdefault = update = _read_only
+
+    def __copy__(self):
+        return dict(self)
+
+    def __deepcopy__(self, memo):
+        return {key: copy.deepcopy(value, memo) for key, value in self.items()}
+
+    def __reduce__(self):
+        return FrozenDict, (dict(self),)
+
+
+class _BuildspecConstructor(SafeConstructor):
+    """
+    Safe constructor resolving !join tags and the environment overrides of anchored values while
+    the buildspec is parsed, instead of walking the round-trip tree afterwards.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.environment_names = set()
+
+    def construct_object(self, node, deep=False):
+        value = super().construct_object(node, deep=deep)
+        if node.anchor is not None and node.tag in OVERRIDABLE_TAGS:
+            self.environment_names.add(node.anchor)
+            return os.environ.get(node.anchor, value)
+        return value
+
+    def construct_join(self, node):
+        return "".join(str(value) for value in self.construct_sequence(node, deep=True))
+
+
+_BuildspecConstructor.add_constructor("!join", _BuildspecConstructor.construct_join)
+
+
+def _freeze(value):
+    if isinstance(value, dict):
+        return FrozenDict((key, _freeze(item)) for key, item in value.items())
+    if isinstance(value, list):
+        return tuple(_freeze(item) for item in value)
+    return value
+
+
+def load_buildspec(path):
+    """
+    Loads a buildspec, following buildspec pointers, with its !join tags and environment
+    overrides resolved. Each buildspec is parsed once per file version and values of the
+    environment variables it refers to; later loads return the same read-only view.
+
+    Parameters:
+        path: str
+
+    Returns:
+        FrozenDict
+
+    """
+    stat = os.stat(path)
+    key = (os.path.realpath(path), stat.st_mtime_ns, stat.st_size)
+    with _BUILDSPEC_CACHE_LOCK:
+        cached = _BUILDSPEC_CACHE.get(key)
+    if cached is not None:
+        environment, pointer, buildspec = cached
+        if all(os.environ.get(name) == value for name, value in environment.items()):
+            if pointer:
+                return load_buildspec(pointer)
+            return buildspec
+
+    yaml = ruamel.yaml.YAML(typ="safe", pure=True)
+    yaml.Constructor = _BuildspecConstructor
+    yaml.allow_duplicate_keys = True
+    with open(path, "r") as buildspec_file:
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore")
+            buildspec = _freeze(yaml.load(buildspec_file))
+    environment = {name: os.environ.get(name) for name in yaml.constructor.environment_names}
+
+    pointer = buildspec.get("buildspec_pointer")
+    if pointer:
+        if os.getenv("BUILD_CONTEXT") != "PR":
+            raise RuntimeError(
+                f"Detected pointer in buildspec: {path} - this is only supported in PRs"
+            )
+        print(f"Buildspec {path} points to another buildspec file {pointer}")
+        pointer = os.path.join(os.path.dirname(path), pointer)
+        print(f"Inferring buildspec path to be {pointer}")
+        environment["BUILD_CONTEXT"] = "PR"
+
+    with _BUILDSPEC_CACHE_LOCK:
+        _BUILDSPEC_CACHE[key] = (environment, pointer, buildspec)
+    if pointer:
+        return load_buildspec(pointer)
+    return buildspec
+
 
 class Buildspec:
     """
@@ -26,7 +146,14 @@ class Buildspec:
     special constructors and load yaml files.
     """
 
-    def __init__(self):
+    def __init__(self, round_trip=False):
+        """
+        Parameters:
+            round_trip: bool - load the buildspec as a ruamel round-trip tree, parsed on every
+                        load, instead of the cached read-only view of load_buildspec
+
+        """
+        self.round_trip = round_trip
         self.yaml = ruamel.yaml.YAML()
         self.yaml.allow_duplicate_keys = True
         self.yaml.Constructor.add_constructor("!join", self.join)
@@ -45,6 +172,10 @@ class Buildspec:
             None
 
         """
+        if not self.round_trip:
+            self._buildspec = load_buildspec(path)
+            return
+
         # Check to see if buildspec file is a pointer
         with open(path, "r") as bf:
             with warnings.catch_warnings():
@@ -15,6 +15,10 @@ language governing permissions and limitations under the License.
 
 import os
 
+# Root of the repository. Caches shared by the build, run from the root, and by the tests, run
+# from test/dlc_tests, are resolved against it.
+REPOSITORY_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
 # Environment settings
 FRAMEWORKS = {
     "mxnet",
@@ -97,9 +101,59 @@ ALL_TESTS = ["sagemaker", "ec2", "eks", "ecs"]
 
 # Timeout in seconds for Docker API client.
 API_CLIENT_TIMEOUT = 600
+MAX_WORKER_COUNT_FOR_BUILDING_IMAGES = 10
 MAX_WORKER_COUNT_FOR_PUSHING_IMAGES = 3
+# Estimated bytes of layers uploaded at the same time by concurrent pushes
+MAX_PUSH_BYTES_IN_FLIGHT = int(os.environ.get("MAX_PUSH_GIGABYTES_IN_FLIGHT", "16")) * 1024**3
+
+# Build context cache. The context is sent to the local docker daemon, so it is not compressed
+# by default. Set BUILD_CONTEXT_COMPRESSION to "gzip" for a fast (level 1) gzip compression.
+BUILD_CONTEXT_CACHE_DIR = os.path.join("build", "context-cache")
+BUILD_CONTEXT_COMPRESSION = os.environ.get("BUILD_CONTEXT_COMPRESSION", "none")
+
+# Cache of the download_artifacts of the buildspecs, downloaded concurrently before the builds
+ARTIFACT_CACHE_DIR = os.environ.get("ARTIFACT_CACHE_DIR", os.path.join("build", "artifact-cache"))
+MAX_WORKER_COUNT_FOR_DOWNLOADING_ARTIFACTS = 8
+
+# Build fingerprinting. Every image is labelled with the fingerprint of its build inputs. If
+# BUILD_FINGERPRINT_INDEX points to an index file, images whose fingerprint is in the index are
+# re-tagged from the indexed image instead of being rebuilt.
+BUILD_FINGERPRINT_LABEL = "com.amazonaws.ml.dlc.build-fingerprint"
+BUILD_FINGERPRINT_INDEX = os.environ.get("BUILD_FINGERPRINT_INDEX")
+BUILD_FINGERPRINT_MAX_AGE_DAYS = int(os.environ.get("BUILD_FINGERPRINT_MAX_AGE_DAYS", "7"))
+# Build args referencing images, fingerprinted by image id since their tags change every build
+IMAGE_REFERENCE_BUILD_ARGS = ("BASE_IMAGE", "PRE_PUSH_IMAGE")
+
+# Build logs, written per image as NDJSON files rotated once they reach BUILD_LOG_MAX_BYTES
+BUILD_LOG_DIR = "logs"
+BUILD_LOG_TAIL_LINES = 200
+BUILD_LOG_MAX_BYTES = 20 * 1024 * 1024
+BUILD_LOG_BACKUP_COUNT = 5
+
+# Build profiles: per image time series of step durations, cache hits and layer sizes
+BUILD_PROFILE_DIR = os.environ.get("BUILD_PROFILE_DIR", os.path.join("build", "profiles"))
+BUILD_PROFILE_HISTORY_SIZE = 50
 
 PATCHING_INFO_PATH_WITHIN_DLC = "/opt/aws/dlc/patching-info"
+# Packages installed in the images, collected once per image id by package_introspection
+PACKAGE_INFORMATION_CACHE_DIR = os.path.join(REPOSITORY_ROOT, "build", "package-information")
+
+# Local snapshots of the safety vulnerability database, refreshed from SAFETY_DB_MIRROR (a URL or
+# a directory) once they are older than SAFETY_DB_MAX_AGE_HOURS, and mounted read-only into the
+# containers that run safety.
+SAFETY_DB_MIRROR = os.environ.get("SAFETY_DB_MIRROR", "https://pyup.io/aws/safety/free/")
+SAFETY_DB_SNAPSHOT_DIR = os.path.join(
+    REPOSITORY_ROOT, os.environ.get("SAFETY_DB_SNAPSHOT_DIR", os.path.join("build", "safety-db"))
+)
+SAFETY_DB_MAX_AGE_HOURS = float(os.environ.get("SAFETY_DB_MAX_AGE_HOURS", "24"))
+SAFETY_DB_SNAPSHOT_HISTORY = 3
+SAFETY_DB_PATH_WITHIN_CONTAINER = "/opt/aws/dlc/safety-db"
+# PyPI metadata of python packages, revalidated once older than PYPI_METADATA_TTL_HOURS
+PYPI_METADATA_CACHE_DIR = os.path.join(
+    REPOSITORY_ROOT,
+    os.environ.get("PYPI_METADATA_CACHE_DIR", os.path.join("build", "pypi-metadata")),
+)
+PYPI_METADATA_TTL_HOURS = float(os.environ.get("PYPI_METADATA_TTL_HOURS", "6"))
 
 ## TODO: Make this account specific: pr-creation-data-helper-<12_digit_account_id>
 PR_CREATION_DATA_HELPER_BUCKET = "pr-creation-data-helper"
@@ -13,24 +13,54 @@ ANY KIND, either express or implied. See the License for the specific
 language governing permissions and limitations under the License.
 """
 
+import gzip
+import hashlib
+import io
 import os
+import shutil
+import stat
 import tarfile
+import threading
+import time
+
+import constants
+
+COMPRESSIONS = ("none", "gzip")
+
+# A tar archive ends with two zero blocks
+END_OF_ARCHIVE = b"\0" * 2 * tarfile.BLOCKSIZE
+
+READ_CHUNK_SIZE = 1024 * 1024
 
 
 class Context:
     """
     The context class encapsulates all required functions for
     preparing, managing and removing the docker build context
+
+    Each artifact is archived once into a tar fragment stored in a content-addressed cache,
+    keyed by the hash of its file tree. The build context is the concatenation of the fragments
+    of its artifacts, so artifacts shared by several images (e.g. the buildspec "context") are
+    only archived once, and identical contexts of different images reuse the same fragments.
     """
 
-    def __init__(self, artifacts=None, context_path="context.tar.gz", artifact_root="./"):
+    def __init__(
+        self,
+        artifacts=None,
+        context_path="context.tar.gz",
+        artifact_root="./",
+        compression=None,
+        cache_dir=None,
+    ):
         """
         The constructor for the Context class
 
         Parameters:
             artifacts: array of (source, destination) tuples
-            context_path: path for the resulting tar.gz file
+            context_path: path of the tar file written by write()
             artifact_root: root directory for all artifacts
+            compression: "none" or "gzip", defaults to constants.BUILD_CONTEXT_COMPRESSION
+            cache_dir: directory of the tar fragment cache
 
         Returns:
             None
@@ -39,6 +69,15 @@ class Context:
         self.artifacts = {}
         self.context_path = context_path
         self.artifact_root = artifact_root
+        self.compression = compression or constants.BUILD_CONTEXT_COMPRESSION
+        if self.compression not in COMPRESSIONS:
+            raise ValueError(
+                f"Unknown build context compression {self.compression}, must be one of {COMPRESSIONS}"
+            )
+        self.cache_dir = cache_dir or constants.BUILD_CONTEXT_CACHE_DIR
+        self.fragments = {}
+        self.sources = {}
+        self.stats = {"bytes": 0, "bytes_reused": 0, "seconds": 0.0, "seconds_saved": 0.0}
 
         # Check if the context path is just a filename,
         # or includes a directory. If path includes a
@@ -46,32 +85,102 @@ class Context:
         directory = os.path.dirname(context_path)
         if directory != "" and not os.path.isdir(directory):
             os.mkdir(directory)
+        os.makedirs(self.cache_dir, exist_ok=True)
 
         if artifacts is not None:
             self.add(artifacts)
 
     def add(self, artifacts):
         """
-        Adds artifacts to the build context
+        Adds artifacts to the build context. Only the artifacts that are not in the cache
+        already are archived.
+
         Parameters:
             artifacts: array of (source, destination) tuples
         """
         self.artifacts.update(artifacts)
 
         # TODO: Use glob to expand
-        # TODO: Add logic to untar and retar
-        with tarfile.open(self.context_path, "w:gz") as tar:
-            for artifact_name in artifacts:
-                artifact = artifacts[artifact_name]
-                if "source" not in artifact or "target" not in artifact:
-                    continue
-                source = os.path.join(self.artifact_root, artifact["source"])
-                target = artifact["target"]
-                tar.add(source, arcname=target)
+        start = time.time()
+        for artifact_name in artifacts:
+            artifact = artifacts[artifact_name]
+            if "source" not in artifact or "target" not in artifact:
+                continue
+            source = os.path.join(self.artifact_root, artifact["source"])
+            fragment = FRAGMENT_CACHE.get(
+                source, artifact["target"], self.compression, self.cache_dir
+            )
+            self.fragments[artifact_name] = fragment
+            self.sources[artifact_name] = (source, artifact["target"])
+            self.stats["bytes"] += fragment.size
+            if fragment.reused:
+                self.stats["bytes_reused"] += fragment.size
+                self.stats["seconds_saved"] += fragment.seconds
+        self.stats["seconds"] += time.time() - start
+
+    @property
+    def digest(self):
+        """
+        Content hash of the build context, equal for identical contexts.
+        """
+        digest = hashlib.sha256(self.compression.encode("utf-8"))
+        for fragment in self.fragments.values():
+            digest.update(fragment.digest.encode("utf-8"))
+        return digest.hexdigest()
+
+    @property
+    def content_digest(self):
+        """
+        Hash of the files of the build context: their paths, modes and contents. Unlike digest,
+        it does not depend on the file owners and mtimes, which differ between checkouts, nor
+        on the compression of the context.
+        """
+        digest = hashlib.sha256()
+        for source, target in self.sources.values():
+            digest.update(FRAGMENT_CACHE.content_digest(source, target).encode("utf-8"))
+        return digest.hexdigest()
+
+    def open(self):
+        """
+        Opens the build context as a stream of its fragments, without writing it to a file.
+
+        Returns:
+            ContextStream, a readable file-like object with a length
+        """
+        if self.compression == "gzip":
+            trailer = gzip.compress(END_OF_ARCHIVE, compresslevel=1, mtime=0)
+        else:
+            trailer = END_OF_ARCHIVE
+        return ContextStream([fragment.path for fragment in self.fragments.values()] + [trailer])
+
+    def write(self):
+        """
+        Writes the build context to context_path
+
+        Returns:
+            str, context_path
+        """
+        with self.open() as context_stream, open(self.context_path, "wb") as context_file:
+            shutil.copyfileobj(context_stream, context_file, READ_CHUNK_SIZE)
+        return self.context_path
+
+    def report(self):
+        """
+        Returns:
+            str, the bytes and seconds saved by reusing cached fragments
+        """
+        return (
+            f"Build context {self.digest[:12]} ({self.compression}): "
+            f"reused {self.stats['bytes_reused'] / (1024 * 1024):.1f} of "
+            f"{self.stats['bytes'] / (1024 * 1024):.1f} MB, "
+            f"prepared in {self.stats['seconds']:.2f}s, "
+            f"saved {self.stats['seconds_saved']:.2f}s"
+        )
 
     def remove(self):
         """
-        Removes the context tar file
+        Removes the context tar file if it was written. Cached fragments are kept for the
+        other images.
 
         Parameters:
             None
@@ -79,4 +188,171 @@ class Context:
         Returns:
             None
         """
-        os.remove(self.context_path)
+        if os.path.exists(self.context_path):
+            os.remove(self.context_path)
+
+
+class ContextStream:
+    """
+    Readable file-like object concatenating files and byte strings. It has a length, so that
+    the docker client sends it with a Content-Length instead of reading it in memory.
+    """
+
+    def __init__(self, parts):
+        self._parts = list(parts)
+        self._size = sum(
+            len(part) if isinstance(part, bytes) else os.path.getsize(part) for part in self._parts
+        )
+        self._current = None
+
+    def __len__(self):
+        return self._size
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def __iter__(self):
+        while True:
+            chunk = self.read(READ_CHUNK_SIZE)
+            if not chunk:
+                return
+            yield chunk
+
+    def read(self, size=-1):
+        data = bytearray()
+        while size is None or size < 0 or len(data) < size:
+            if self._current is None:
+                if not self._parts:
+                    break
+                part = self._parts.pop(0)
+                self._current = io.BytesIO(part) if isinstance(part, bytes) else open(part, "rb")
+            chunk = self._current.read(-1 if size is None or size < 0 else size - len(data))
+            if not chunk:
+                self._current.close()
+                self._current = None
+                continue
+            data += chunk
+        return bytes(data)
+
+    def close(self):
+        if self._current is not None:
+            self._current.close()
+            self._current = None
+        self._parts = []
+
+
+class Fragment:
+    """
+    The tar members of one artifact, without the end of archive blocks.
+    """
+
+    def __init__(self, digest, path, seconds, reused):
+        self.digest = digest
+        self.path = path
+        self.size = os.path.getsize(path)
+        self.seconds = seconds
+        self.reused = reused
+
+
+class FragmentCache:
+    """
+    Content-addressed cache of artifact tar fragments, shared by all the contexts of a build.
+    File hashes are memoized by inode, size and mtime, so unchanged files are only read once.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._file_digests = {}
+        self._seconds = {}
+
+    def get(self, source, target, compression, cache_dir):
+        """
+        Returns the fragment archiving source as target, creating it if it is not cached yet.
+        """
+        start = time.time()
+        digest = self.tree_digest(source, target)
+        extension = ".tar.gz" if compression == "gzip" else ".tar"
+        path = os.path.join(cache_dir, digest + extension)
+        if os.path.exists(path):
+            with self._lock:
+                seconds = self._seconds.get(path, 0.0)
+            return Fragment(digest, path, seconds, reused=True)
+
+        # Concurrent contexts may create the same fragment, the last rename wins
+        temporary_path = f"{path}.{os.getpid()}.{threading.get_ident()}"
+        with open(temporary_path, "wb") as fragment_file:
+            with tarfile.open(fileobj=fragment_file, mode="w") as tar:
+                tar.add(source, arcname=target)
+                end = tar.offset
+            fragment_file.truncate(end)
+        if compression == "gzip":
+            with open(temporary_path, "rb") as tar_file, gzip.GzipFile(
+                temporary_path + ".gz", "wb", compresslevel=1, mtime=0
+            ) as gzip_file:
+                shutil.copyfileobj(tar_file, gzip_file, READ_CHUNK_SIZE)
+            os.replace(temporary_path + ".gz", temporary_path)
+        os.replace(temporary_path, path)
+
+        seconds = time.time() - start
+        with self._lock:
+            self._seconds[path] = seconds
+        return Fragment(digest, path, seconds, reused=False)
+
+    def tree_digest(self, source, target, content_only=False):
+        """
+        Hashes the target name and, for every file under source in the order tarfile adds them,
+        its relative path, metadata and content. With content_only, the metadata is limited to
+        the mode, leaving out the owner and mtime archived in the fragment.
+        """
+        digest = hashlib.sha256(target.encode("utf-8"))
+        pending = [source]
+        while pending:
+            path = pending.pop(0)
+            status = os.lstat(path)
+            relative_path = os.path.relpath(path, source)
+            if content_only:
+                digest.update(f"{relative_path}\0{status.st_mode}\0".encode("utf-8"))
+            else:
+                digest.update(
+                    f"{relative_path}\0{status.st_mode}\0{status.st_uid}\0{status.st_gid}\0"
+                    f"{int(status.st_mtime)}\0".encode("utf-8")
+                )
+            if stat.S_ISREG(status.st_mode):
+                digest.update(self.file_digest(path, status).encode("utf-8"))
+            elif stat.S_ISLNK(status.st_mode):
+                digest.update(os.readlink(path).encode("utf-8"))
+            elif stat.S_ISDIR(status.st_mode):
+                pending[0:0] = [os.path.join(path, name) for name in sorted(os.listdir(path))]
+        return digest.hexdigest()
+
+    def content_digest(self, source, target):
+        """
+        Hashes the target name and the relative path, mode and content of every file under
+        source, to tell whether an image built from them would change.
+        """
+        return self.tree_digest(source, target, content_only=True)
+
+    def file_digest(self, path, status):
+        key = (
+            os.path.abspath(path),
+            status.st_dev,
+            status.st_ino,
+            status.st_size,
+            status.st_mtime_ns,
+        )
+        with self._lock:
+            if key in self._file_digests:
+                return self._file_digests[key]
+        digest = hashlib.sha256()
+        with open(path, "rb") as source_file:
+            for chunk in iter(lambda: source_file.read(READ_CHUNK_SIZE), b""):
+                digest.update(chunk)
+        with self._lock:
+            self._file_digests[key] = digest.hexdigest()
+        return self._file_digests[key]
+
+
+FRAGMENT_CACHE = FragmentCache()
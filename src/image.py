@@ -12,12 +12,21 @@ distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF
 ANY KIND, either express or implied. See the License for the specific
 language governing permissions and limitations under the License.
 """
+
+import os
+
 from datetime import datetime
 
 from docker import APIClient
-from docker import DockerClient
+from docker.errors import APIError, ImageNotFound
+from docker.utils import parse_repository_tag
 
+import build_fingerprint
+import build_profiler
 import constants
+import package_introspection
+
+from build_log import BuildLog
 import logging
 import json
 
@@ -68,9 +77,13 @@ class DockerImage:
         self.to_build = to_build
         self.build_status = None
         self.client = APIClient(base_url=constants.DOCKER_URL, timeout=constants.API_CLIENT_TIMEOUT)
-        self.log = []
+        self.log = BuildLog(
+            os.path.join(constants.BUILD_LOG_DIR, f"{info.get('name', tag)}-{stage}.ndjson")
+        )
         self._corresponding_common_stage_image = None
         self.target = target
+        self.fingerprint = None
+        self.pushed_bytes = 0
 
     def __getattr__(self, name):
         return self.info[name]
@@ -106,21 +119,13 @@ class DockerImage:
 
     def collect_installed_packages_information(self):
         """
-        Returns an array with outcomes of the commands listed in the 'commands' array
+        Returns an array with outcomes of the package_introspection.PACKAGE_COMMANDS
         """
-        docker_client = DockerClient(base_url=constants.DOCKER_URL)
+        package_information = package_introspection.get_package_information(self.ecr_url)
         command_responses = []
-        commands = [
-            "pip list",
-            "dpkg-query -Wf '${Installed-Size}\\t${Package}\\n'",
-            "apt list --installed",
-        ]
-        for command in commands:
+        for command in package_introspection.PACKAGE_COMMANDS:
             command_responses.append(f"\n{command}")
-            command_responses.append(
-                bytes.decode(docker_client.containers.run(self.ecr_url, command))
-            )
-        docker_client.containers.prune()
+            command_responses.append(package_information["commands"][command]["output"])
         return command_responses
 
     def get_tail_logs_in_pretty_format(self, number_of_lines=10):
@@ -130,7 +135,7 @@ class DockerImage:
         :param number_of_lines: int, number of ending lines to be printed
         :return: str, last number_of_lines of the logs concatenated with a new line
         """
-        return "\n".join(self.log[-1][-number_of_lines:])
+        return "\n".join(self.log.tail(number_of_lines))
 
     def update_pre_build_configuration(self):
         """
@@ -163,10 +168,22 @@ class DockerImage:
         # Conduct some preprocessing before building the image
         self.update_pre_build_configuration()
 
-        # Start building the image
-        with open(self.context.context_path, "rb") as context_file:
-            self.docker_build(fileobj=context_file, custom_context=True)
-            self.context.remove()
+        self.fingerprint = self.get_build_fingerprint()
+        if self.fingerprint:
+            self.labels[constants.BUILD_FINGERPRINT_LABEL] = self.fingerprint
+        fingerprint_index = build_fingerprint.get_fingerprint_index() if self.fingerprint else None
+
+        is_reused = False
+        if fingerprint_index and self.reuse_fingerprinted_image(fingerprint_index):
+            # Nothing was built, so there is nothing new to record in the index
+            fingerprint_index = None
+            is_reused = True
+        else:
+            # Start building the image, streaming the cached context fragments to the daemon
+            LOGGER.info(self.context.report())
+            with self.context.open() as context_file:
+                self.docker_build(fileobj=context_file, custom_context=True)
+                self.context.remove()
 
         if self.build_status != constants.SUCCESS:
             LOGGER.info(f"Exiting with image build status {self.build_status} without image check.")
@@ -180,9 +197,92 @@ class DockerImage:
         # check the size after image is built.
         self.image_size_check()
 
+        if fingerprint_index and self.build_status == constants.SUCCESS:
+            fingerprint_index.record(self.fingerprint, self.ecr_url)
+
+        if not is_reused:
+            self.profile_build()
+
         # This return is necessary. Otherwise FORMATTER fails while displaying the status.
         return self.build_status
 
+    def get_build_fingerprint(self):
+        """
+        Computes the fingerprint of the build inputs: Dockerfile, build args, labels, target and
+        build context. Images referenced by build args are identified by their image id.
+
+        :return: str, fingerprint, None if the Dockerfile or a referenced image is not available
+        """
+        dockerfile = os.path.join(self.info.get("root", ""), self.dockerfile)
+        if not os.path.isfile(dockerfile):
+            return None
+        build_args = dict(self.build_args)
+        for build_arg in constants.IMAGE_REFERENCE_BUILD_ARGS:
+            if build_arg in build_args:
+                try:
+                    build_args[build_arg] = self.client.inspect_image(build_args[build_arg])["Id"]
+                except APIError:
+                    return None
+        return build_fingerprint.compute_fingerprint(
+            dockerfile, build_args, self.labels, self.target, self.context.content_digest
+        )
+
+    def reuse_fingerprinted_image(self, fingerprint_index):
+        """
+        Tags the image recorded in the index for the build fingerprint, pulling it if it is not
+        available locally, instead of building the image again.
+
+        :param fingerprint_index: index mapping build fingerprints to image URIs
+        :return: bool, True if an image was reused
+        """
+        image_uri = fingerprint_index.lookup(self.fingerprint)
+        if not image_uri:
+            return False
+
+        response = [f"Found {image_uri} with build fingerprint {self.fingerprint}"]
+        try:
+            try:
+                image_labels = self.client.inspect_image(image_uri)["Config"]["Labels"]
+            except ImageNotFound:
+                repository, tag = parse_repository_tag(image_uri)
+                self.client.pull(repository, tag)
+                image_labels = self.client.inspect_image(image_uri)["Config"]["Labels"]
+            # The tag may have been moved to an image built from other inputs since
+            if (image_labels or {}).get(constants.BUILD_FINGERPRINT_LABEL) != self.fingerprint:
+                response.append(f"{image_uri} no longer has this fingerprint, building instead")
+                self.log.append(response)
+                return False
+            self.client.tag(image_uri, self.repository, self.tag)
+        except APIError as e:
+            response.append(f"Could not reuse {image_uri}, building instead: {e}")
+            self.log.append(response)
+            return False
+
+        response.append(f"Tagged {image_uri} as {self.ecr_url} instead of building it")
+        self.log.append(response)
+        LOGGER.info(f"{self.get_tail_logs_in_pretty_format()}")
+
+        self.summary["reused_image"] = image_uri
+        self.build_status = constants.SUCCESS
+        return True
+
+    def profile_build(self):
+        """
+        Records the duration and cache hits of each Dockerfile step and the size of each layer of
+        the build, and logs the steps and layers that regressed since the previous build.
+        """
+        try:
+            _, regressions = build_profiler.BuildProfiler().record(self)
+        except (APIError, OSError, ValueError) as e:
+            LOGGER.warning(f"Could not profile the build of {self.ecr_url}: {e}")
+            return
+        if regressions:
+            self.summary["regressions"] = regressions
+            self.log.append(
+                [f"Regressions since the previous build of {self.repository}:"] + regressions
+            )
+            LOGGER.info(f"{self.get_tail_logs_in_pretty_format(len(regressions) + 1)}")
+
     def docker_build(self, fileobj=None, custom_context=False):
         """
         Uses low level Docker API Client to actually start the process of building the image.
@@ -191,7 +291,7 @@ class DockerImage:
         :param custom_context: bool
         :return: int, Build Status
         """
-        response = [f"Starting the Build Process for {self.repository}:{self.tag}"]
+        self.log.write(f"Starting the Build Process for {self.repository}:{self.tag}")
 
         for line in self.client.build(
             fileobj=fileobj,
@@ -205,8 +305,8 @@ class DockerImage:
             target=self.target,
         ):
             if line.get("error") is not None:
-                response.append(line["error"])
-                self.log.append(response)
+                self.log.write(line["error"])
+                self.log.end_step()
                 self.build_status = constants.FAIL
                 self.summary["status"] = constants.STATUS_MESSAGE[self.build_status]
                 self.summary["end_time"] = datetime.now()
@@ -220,13 +320,13 @@ class DockerImage:
                 return self.build_status
 
             if line.get("stream") is not None:
-                response.append(line["stream"])
+                self.log.write(line["stream"])
             elif line.get("status") is not None:
-                response.append(line["status"])
+                self.log.write(line["status"])
             else:
-                response.append(str(line))
+                self.log.write(str(line))
 
-        self.log.append(response)
+        self.log.end_step()
 
         LOGGER.info(f"DOCKER BUILD LOGS: \n{self.get_tail_logs_in_pretty_format()}")
         LOGGER.info(f"Completed Build for {self.repository}:{self.tag}")
@@ -273,11 +373,13 @@ class DockerImage:
         if tag_value is None:
             tag = self.tag
 
-        response = [f"Starting image Push for {self.repository}:{tag}"]
+        self.log.write(f"Starting image Push for {self.repository}:{tag}")
+        # bytes of the layers uploaded by this push, layers already in the registry are skipped
+        self.pushed_bytes = 0
+        layer_bytes = {}
         for line in self.client.push(self.repository, tag, stream=True, decode=True):
             if line.get("error") is not None:
-                response.append(line["error"])
-                self.log.append(response)
+                self.log.write(line["error"])
                 self.build_status = constants.FAIL
                 self.summary["status"] = constants.STATUS_MESSAGE[self.build_status]
                 self.summary["end_time"] = datetime.now()
@@ -289,11 +391,29 @@ class DockerImage:
                 )
 
                 return self.build_status
+            if line.get("id") and (line.get("progressDetail") or {}).get("total"):
+                layer_bytes[line["id"]] = line["progressDetail"]["total"]
+                # upload progress updates are not logged, only the layer status changes
+                continue
+            if line.get("status") == "Pushed":
+                self.pushed_bytes += layer_bytes.get(line.get("id"), 0)
             if line.get("stream") is not None:
-                response.append(line["stream"])
+                self.log.write(line["stream"])
             else:
-                response.append(str(line))
+                self.log.write(str(line))
 
+        return self.record_pushed_tag(tag, [])
+
+    def record_pushed_tag(self, tag, response):
+        """
+        Records in the summary and logs that the image is available in the registry with a tag.
+
+        :param tag: str, tag of the image in the registry
+        :param response: list[str] or str, logs of the push
+        :return: int, Build Status
+        """
+        if isinstance(response, str):
+            response = [response]
         self.summary["status"] = constants.STATUS_MESSAGE[self.build_status]
         self.summary["end_time"] = datetime.now()
         self.summary["ecr_url"] = self.ecr_url
@@ -306,10 +426,12 @@ class DockerImage:
         LOGGER.info(f"DOCKER PUSH LOGS: \n {self.get_tail_logs_in_pretty_format(2)}")
         return self.build_status
 
-    def push_image_with_additional_tags(self):
+    def push_image_with_additional_tags(self, push_engine=None):
         """
         Pushes an already built Docker image by applying additional tags to it.
 
+        :param push_engine: PushEngine, if given the tags are added to the pushed manifest
+                            instead of pushing the image once per tag
         :return: int, states if the Push was successful or not
         """
         self.log.append([f"Started Tagging for {self.ecr_url}"])
@@ -329,7 +451,10 @@ class DockerImage:
             )
             self.log.append(response)
 
-            self.build_status = self.push_image(tag_value=additional_tag)
+            if push_engine is not None:
+                self.build_status = push_engine.push_tag(self, additional_tag)
+            else:
+                self.build_status = self.push_image(tag_value=additional_tag)
             if self.build_status != constants.SUCCESS:
                 return self.build_status
 
@@ -13,8 +13,8 @@ ANY KIND, either express or implied. See the License for the specific
 language governing permissions and limitations under the License.
 """
 
-import concurrent.futures
 import datetime
+import itertools
 import os
 import re
 import tempfile
@@ -23,20 +23,21 @@ from copy import deepcopy
 
 import constants
 import utils
-import itertools
 import patch_helper
 
 from codebuild_environment import get_codebuild_project_name, get_cloned_folder_path
 from config import is_build_enabled, is_autopatch_build_enabled
 from context import Context
 from metrics import Metrics
+from artifact_cache import ArtifactCache
+from build_scheduler import BuildScheduler
 from image import DockerImage
+from push_engine import PushEngine
 from common_stage_image import CommonStageImage
 from buildspec import Buildspec
 from output import OutputFormatter
 from utils import get_dummy_boto_client
 
-
 FORMATTER = OutputFormatter(constants.PADDING)
 build_context = os.getenv("BUILD_CONTEXT")
 
@@ -51,6 +52,29 @@ def is_nightly_build_context():
     )
 
 
+def _is_image_selected(BUILDSPEC, image_config, image_types, device_types):
+    """
+    Check whether an image of the buildspec is built with the image and device type filters
+    :param BUILDSPEC: <Buildspec>
+    :param image_config: <dict> image entry of the buildspec
+    :param image_types: <list> list of image types, empty for all image types
+    :param device_types: <list> list of device types, empty for all device types
+    :return: <bool>
+    """
+    # filter by image type if type is specified
+    if image_types and not image_config["image_type"] in image_types:
+        return False
+
+    # filter by device type if type is specified
+    if device_types and not image_config["device_type"] in device_types:
+        return False
+
+    if image_config.get("version") is not None:
+        if BUILDSPEC["version"] != image_config.get("version"):
+            return False
+    return True
+
+
 def _find_image_object(images_list, image_name):
     """
     Find and return an image object from images_list with a name that matches image_name
@@ -94,13 +118,18 @@ def image_builder(buildspec, image_types=[], device_types=[]):
             "aws ecr get-login-password --region us-west-2 | docker login --username AWS --password-stdin 763104351884.dkr.ecr.us-west-2.amazonaws.com"
         )
 
-    for image_name, image_config in BUILDSPEC["images"].items():
-        # filter by image type if type is specified
-        if image_types and not image_config["image_type"] in image_types:
-            continue
+    # Artifacts are downloaded once for all images, before the images are set up
+    artifact_cache = ArtifactCache()
+    artifact_paths = artifact_cache.prefetch(
+        (artifact["URI"], artifact["type"])
+        for image_config in BUILDSPEC["images"].values()
+        if _is_image_selected(BUILDSPEC, image_config, image_types, device_types)
+        for artifact in (image_config.get("download_artifacts") or {}).values()
+    )
+    FORMATTER.print(artifact_cache.report())
 
-        # filter by device type if type is specified
-        if device_types and not image_config["device_type"] in device_types:
+    for image_name, image_config in BUILDSPEC["images"].items():
+        if not _is_image_selected(BUILDSPEC, image_config, image_types, device_types):
             continue
 
         ARTIFACTS = deepcopy(BUILDSPEC["context"]) if BUILDSPEC.get("context") else {}
@@ -119,10 +148,6 @@ def image_builder(buildspec, image_types=[], device_types=[]):
                 f"""[PROD_URI for {image_config["repository"]}:{image_config["tag"]}] {prod_repo_uri}"""
             )
 
-        if image_config.get("version") is not None:
-            if BUILDSPEC["version"] != image_config.get("version"):
-                continue
-
         if image_config.get("context") is not None:
             ARTIFACTS.update(image_config["context"])
         image_tag = (
@@ -163,19 +188,14 @@ def image_builder(buildspec, image_types=[], device_types=[]):
 
         if image_config.get("download_artifacts") is not None:
             for artifact_name, artifact in image_config.get("download_artifacts").items():
-                type = artifact["type"]
                 uri = artifact["URI"]
                 var = artifact["VAR_IN_DOCKERFILE"]
-
-                try:
-                    file_name = utils.download_file(uri, type).strip()
-                except ValueError:
-                    FORMATTER.print(f"Artifact download failed: {uri} of type {type}.")
+                file_name = os.path.basename(uri).strip()
 
                 ARTIFACTS.update(
                     {
                         f"{artifact_name}": {
-                            "source": f"{os.path.join(os.sep, os.path.abspath(os.getcwd()), file_name)}",
+                            "source": os.path.abspath(artifact_paths[uri]),
                             "target": file_name,
                         }
                     }
@@ -381,16 +401,10 @@ def image_builder(buildspec, image_types=[], device_types=[]):
 
     FORMATTER.banner("DLC")
 
-    # Parent images do not inherit from any containers built in this job
-    # Child images use one of the parent images as their base image
-    parent_images = [image for image in PRE_PUSH_STAGE_IMAGES if not image.is_child_image]
-    child_images = [image for image in PRE_PUSH_STAGE_IMAGES if image.is_child_image]
     ALL_IMAGES = PRE_PUSH_STAGE_IMAGES + COMMON_STAGE_IMAGES
     IMAGES_TO_PUSH = [image for image in ALL_IMAGES if image.to_push and image.to_build]
 
-    pushed_images = []
-    pushed_images += process_images(parent_images, "Parent/Independent", buildspec_path=buildspec)
-    pushed_images += process_images(child_images, "Child/Dependent", buildspec_path=buildspec)
+    pushed_images = process_images(PRE_PUSH_STAGE_IMAGES, buildspec_path=buildspec)
 
     assert all(
         image in pushed_images for image in IMAGES_TO_PUSH
@@ -428,48 +442,131 @@ def image_builder(buildspec, image_types=[], device_types=[]):
         )
 
 
-def process_images(pre_push_image_list, pre_push_image_type="Pre-push", buildspec_path=""):
+def process_images(pre_push_image_list, buildspec_path=""):
     """
-    Handles all the tasks related to a particular type of Pre Push images. It takes in the list of
-    pre push images and then builds it. After the pre-push images have been built, it extracts the
-    corresponding common stage images for the pre-push images and builds those common stage images.
-    After the common stage images have been built, it finds outs the docker images that need to be
-    pushed and pushes them accordingly.
-
-    Note that the common stage images should always be built after the pre-push images of a
-    particular kind. This is because the Common stage images use are built on respective
-    Standard and Example images.
-
-    :param pre_push_image_list: list[DockerImage], list of pre-push images
-    :param pre_push_image_type: str, used to display the message on the logs
+    Handles all the tasks related to the Pre Push images as a dependency graph. Every pre-push
+    image build, common stage image build, push and retag is a task that starts as soon as the
+    tasks it depends on are done:
+    - a child image build waits for the build of its parent (base_image_name) pre-push image
+    - a common stage image build waits for its pre-push image build, as the Common stage images
+      are built on respective Standard and Example images
+    - a push waits for the build of the image, and the retag waits for the push
+    Builds and pushes are limited to MAX_WORKER_COUNT_FOR_BUILDING_IMAGES and
+    MAX_WORKER_COUNT_FOR_PUSHING_IMAGES concurrent tasks. Tasks depending on a failed task are
+    skipped. The critical path of the build is displayed at the end.
+
+    :param pre_push_image_list: list[DockerImage], list of pre-push images, parents first
+    :param buildspec_path: str, path of the buildspec the images come from
     :return: list[DockerImage], images that were supposed to be pushed.
     """
-    FORMATTER.banner(f"{pre_push_image_type} Build")
-    build_images(pre_push_image_list)
+    scheduler = BuildScheduler(
+        {
+            "build": constants.MAX_WORKER_COUNT_FOR_BUILDING_IMAGES,
+            "push": constants.MAX_WORKER_COUNT_FOR_PUSHING_IMAGES,
+        }
+    )
+    push_engine = PushEngine()
+    is_autopatch_enabled = is_autopatch_build_enabled(buildspec_path=buildspec_path)
+    build_task_by_uri = {}
+    images_to_push = []
+    image_by_push_task = {}
+    for image in pre_push_image_list:
+        parent_build_task = build_task_by_uri.get(image.info.get("base_image_uri"))
+        build_task = scheduler.add_task(
+            _task_name(image, "build"),
+            image.build,
+            "build",
+            [parent_build_task] if parent_build_task else [],
+        )
+        build_task_by_uri[image.ecr_url] = build_task
+
+        stage_images = [(image, build_task)]
+        common_stage_image = image.corresponding_common_stage_image
+        if common_stage_image is not None:
+            common_build_task = scheduler.add_task(
+                _task_name(common_stage_image, "build"),
+                common_stage_image.build,
+                "build",
+                [build_task],
+            )
+            stage_images.append((common_stage_image, common_build_task))
 
-    FORMATTER.banner(f"{pre_push_image_type} Common Build")
-    common_stage_image_list = [
-        image.corresponding_common_stage_image
-        for image in pre_push_image_list
-        if image.corresponding_common_stage_image is not None
-    ]
-    build_images(common_stage_image_list, make_dummy_boto_client=True)
+        for stage_image, stage_build_task in stage_images:
+            if not (stage_image.to_push and stage_image.to_build):
+                continue
+            images_to_push.append(stage_image)
+            push_task = scheduler.add_task(
+                _task_name(stage_image, "push"),
+                lambda stage_image=stage_image: _push_image(
+                    stage_image, is_autopatch_enabled, push_engine
+                ),
+                "push",
+                [stage_build_task],
+            )
+            image_by_push_task[push_task] = stage_image
+            scheduler.add_task(
+                _task_name(stage_image, "retag"),
+                lambda stage_image=stage_image: stage_image.push_image_with_additional_tags(
+                    push_engine=push_engine
+                ),
+                "push",
+                [push_task],
+            )
 
-    FORMATTER.banner(f"{pre_push_image_type} Push Images")
-    all_images = pre_push_image_list + common_stage_image_list
-    images_to_push = [image for image in all_images if image.to_push and image.to_build]
+    FORMATTER.banner("Build Graph")
+    #### TODO: Remove this line when get_dummy_boto_client is removed ####
+    get_dummy_boto_client()
+    done_count = itertools.count(1)
+    tasks = scheduler.run(
+        on_task_done=lambda task: _print_task_status(
+            task, next(done_count), len(scheduler.tasks), image_by_push_task.get(task.name)
+        )
+    )
 
-    if is_autopatch_build_enabled(buildspec_path=buildspec_path):
-        for image in images_to_push:
-            patch_helper.retrive_autopatched_image_history_and_upload_to_s3(image_uri=image.ecr_url)
+    FORMATTER.banner("Critical Path")
+    for task in scheduler.critical_path():
+        FORMATTER.print(
+            f"{task.name}: {task.duration:.1f}s "
+            f"(waited {task.start_time - task.ready_time:.1f}s for a free slot)"
+        )
+    FORMATTER.print(f"Total: {scheduler.end_time - scheduler.start_time:.1f}s")
 
-    push_images(images_to_push)
+    FORMATTER.banner("Push Transfer")
+    FORMATTER.print(push_engine.report())
 
-    FORMATTER.banner(f"{pre_push_image_type} Retagging")
-    retag_and_push_images(images_to_push)
+    errors = [f"{task.name}: {task.error}" for task in tasks.values() if task.error]
+    if errors:
+        raise Exception("Build tasks raised errors:\n" + "\n".join(errors))
     return images_to_push
 
 
+def _task_name(image, step):
+    return f"{image.name}-{image.stage}-{step}"
+
+
+def _push_image(image, is_autopatch_enabled, push_engine):
+    if is_autopatch_enabled:
+        patch_helper.retrive_autopatched_image_history_and_upload_to_s3(image_uri=image.ecr_url)
+    return push_engine.push(image)
+
+
+def _print_task_status(task, done, total, pushed_image=None):
+    if task.skipped_by:
+        status = f"Skipped, {task.skipped_by} failed"
+    elif task.error:
+        status = "Error"
+    else:
+        status = constants.STATUS_MESSAGE.get(task.status, str(task.status))
+    FORMATTER.task_event(
+        task.name,
+        status,
+        task.duration,
+        transferred_bytes=pushed_image.pushed_bytes if pushed_image else None,
+        done=done,
+        total=total,
+    )
+
+
 def generate_common_stage_image_object(pre_push_stage_image_object, image_tag):
     """
     Creates a common stage image object for a pre_push stage image. If for a pre_push stage image we create a common
@@ -506,22 +603,18 @@ def show_build_info(images):
     :param images: list[DockerImage]
     """
 
-    if not os.path.isdir("logs"):
-        os.makedirs("logs")
-
     for image in images:
         image_description = f"{image.name}-{image.stage}"
         FORMATTER.title(image_description)
         FORMATTER.table(image.info.items())
 
-        flattened_logs = list(itertools.chain(*image.log))
-        with open(f"logs/{image_description}", "w") as fp:
-            fp.write("/n".join(flattened_logs))
-            image.summary["log"] = f"logs/{image_description}"
+        # The logs were streamed to disk during the build
+        image.log.close()
+        image.summary["log"] = image.log.path
         FORMATTER.table(image.summary.items())
 
         FORMATTER.title(f"Ending Logs for {image_description}")
-        FORMATTER.print_lines(image.log[-1][-2:])
+        FORMATTER.print_lines(image.log.tail(2))
 
 
 def show_build_errors(images):
@@ -537,7 +630,7 @@ def show_build_errors(images):
     for image in images:
         if image.build_status == constants.FAIL:
             FORMATTER.title(image.name)
-            FORMATTER.print_lines(image.log[-1][-10:])
+            FORMATTER.print_lines(image.log.tail(10))
             is_any_build_failed = True
         else:
             if image.build_status == constants.FAIL_IMAGE_SIZE_LIMIT:
@@ -566,14 +659,16 @@ def upload_metrics(images, BUILDSPEC, is_any_build_failed, is_any_build_failed_s
         region=BUILDSPEC["region"],
         namespace=constants.METRICS_NAMESPACE,
     )
-    for image in images:
-        try:
+    try:
+        for image in images:
             metrics.push_image_metrics(image)
-        except Exception as e:
-            if is_any_build_failed or is_any_build_failed_size_limit:
-                raise Exception(f"Build failed.{e}")
-            else:
-                raise Exception(f"Build passed. {e}")
+        # The metrics of all the images are published together, in as few requests as possible
+        metrics.flush()
+    except Exception as e:
+        if is_any_build_failed or is_any_build_failed_size_limit:
+            raise Exception(f"Build failed.{e}")
+        else:
+            raise Exception(f"Build passed. {e}")
 
     if is_any_build_failed_size_limit:
         raise Exception("Build failed because of file limit")
@@ -581,58 +676,6 @@ def upload_metrics(images, BUILDSPEC, is_any_build_failed, is_any_build_failed_s
     FORMATTER.print("Metrics Uploaded")
 
 
-def build_images(images, make_dummy_boto_client=False):
-    """
-    Takes a list of images and executes their build process concurrently.
-
-    :param images: list[DockerImage]
-    :param make_dummy_boto_client: bool, specifies if a dummy client should be declared or not.
-
-    TODO: The parameter make_dummy_boto_client should be removed when get_dummy_boto_client method is removed.
-    """
-    THREADS = {}
-    # In the context of the ThreadPoolExecutor each instance of image.build submitted
-    # to it is executed concurrently in a separate thread.
-    with concurrent.futures.ThreadPoolExecutor(max_workers=10) as executor:
-        #### TODO: Remove this entire if block when get_dummy_boto_client is removed ####
-        if make_dummy_boto_client:
-            get_dummy_boto_client()
-        for image in images:
-            THREADS[image.name] = executor.submit(image.build)
-    # the FORMATTER.progress(THREADS) function call also waits until all threads have completed
-    FORMATTER.progress(THREADS)
-
-
-def push_images(images):
-    """
-    Takes a list of images and PUSHES them to ECR concurrently.
-
-    :param images: list[DockerImage]
-    """
-    THREADS = {}
-    with concurrent.futures.ThreadPoolExecutor(
-        max_workers=constants.MAX_WORKER_COUNT_FOR_PUSHING_IMAGES
-    ) as executor:
-        for image in images:
-            THREADS[image.name] = executor.submit(image.push_image)
-    FORMATTER.progress(THREADS)
-
-
-def retag_and_push_images(images):
-    """
-    Takes a list of images, retags them and pushes to the repository
-
-    :param images: list[DockerImage]
-    """
-    THREADS = {}
-    with concurrent.futures.ThreadPoolExecutor(
-        max_workers=constants.MAX_WORKER_COUNT_FOR_PUSHING_IMAGES
-    ) as executor:
-        for image in images:
-            THREADS[image.name] = executor.submit(image.push_image_with_additional_tags)
-    FORMATTER.progress(THREADS)
-
-
 def tag_image_with_pr_number(image_tag):
     pr_number = os.getenv("PR_NUMBER")
     return f"{image_tag}-pr-{pr_number}"
@@ -1,36 +1,194 @@
+import concurrent.futures
+import json
+import time
+
 import boto3
 import constants
 import random
 
+from botocore.exceptions import ClientError, ConnectionError
+
+# CloudWatch PutMetricData limits
+MAX_METRIC_DATA_PER_REQUEST = 1000
+MAX_REQUEST_PAYLOAD_BYTES = 1024 * 1024
+
+RETRYABLE_ERROR_CODES = {
+    "Throttling",
+    "ThrottlingException",
+    "ServiceUnavailable",
+    "InternalServiceError",
+    "InternalFailure",
+}
+
+
+class MetricsPublisher(object):
+    """
+    Buffers CloudWatch metric data and publishes it with as few PutMetricData calls as possible.
+
+    Entries are flushed in batches of at most MAX_METRIC_DATA_PER_REQUEST entries and
+    MAX_REQUEST_PAYLOAD_BYTES, sent concurrently, and retried with exponential backoff when
+    throttled. Values added with aggregate=True are merged into a single statistic set per
+    metric name, dimensions and unit.
+    """
+
+    def __init__(
+        self,
+        namespace,
+        region=None,
+        client=None,
+        endpoint_url=None,
+        max_workers=4,
+        max_attempts=5,
+        backoff_seconds=0.5,
+    ):
+        self.client = client or boto3.Session(region_name=region).client(
+            "cloudwatch", endpoint_url=endpoint_url
+        )
+        self.namespace = namespace
+        self.max_workers = max_workers
+        self.max_attempts = max_attempts
+        self.backoff_seconds = backoff_seconds
+        self._metric_data = []
+        self._statistic_sets = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.flush()
+
+    def add(self, name, value, unit="None", dimensions=None, aggregate=False):
+        """
+        Buffers a metric value.
+
+        :param name: str, metric name
+        :param value: float, metric value
+        :param unit: str, CloudWatch unit
+        :param dimensions: list[dict], CloudWatch dimensions
+        :param aggregate: bool, merge the value into a statistic set
+        """
+        dimensions = dimensions or []
+        if not aggregate:
+            self.add_metric_data(
+                {"MetricName": name, "Dimensions": dimensions, "Unit": unit, "Value": value}
+            )
+            return
+        key = (name, json.dumps(dimensions, sort_keys=True), unit)
+        statistic_set = self._statistic_sets.get(key)
+        if statistic_set is None:
+            self._statistic_sets[key] = {
+                "MetricName": name,
+                "Dimensions": dimensions,
+                "Unit": unit,
+                "StatisticValues": {
+                    "SampleCount": 1,
+                    "Sum": value,
+                    "Minimum": value,
+                    "Maximum": value,
+                },
+            }
+            return
+        statistic_values = statistic_set["StatisticValues"]
+        statistic_values["SampleCount"] += 1
+        statistic_values["Sum"] += value
+        statistic_values["Minimum"] = min(statistic_values["Minimum"], value)
+        statistic_values["Maximum"] = max(statistic_values["Maximum"], value)
+
+    def add_metric_data(self, metric_data):
+        """
+        Buffers a MetricData entry as accepted by PutMetricData.
+
+        :param metric_data: dict
+        """
+        self._metric_data.append(metric_data)
+
+    def get_batches(self):
+        """
+        Splits the buffered entries into PutMetricData sized batches.
+
+        :return: list[list[dict]]
+        """
+        batches = []
+        batch, batch_bytes = [], 0
+        for metric_data in self._metric_data + list(self._statistic_sets.values()):
+            # The query protocol encoding is larger than JSON, keep a margin for it
+            metric_data_bytes = 2 * len(json.dumps(metric_data, default=str))
+            if batch and (
+                len(batch) == MAX_METRIC_DATA_PER_REQUEST
+                or batch_bytes + metric_data_bytes > MAX_REQUEST_PAYLOAD_BYTES
+            ):
+                batches.append(batch)
+                batch, batch_bytes = [], 0
+            batch.append(metric_data)
+            batch_bytes += metric_data_bytes
+        if batch:
+            batches.append(batch)
+        return batches
+
+    def flush(self):
+        """
+        Publishes and clears the buffered entries.
+
+        :return: list[dict], PutMetricData responses
+        """
+        batches = self.get_batches()
+        self._metric_data = []
+        self._statistic_sets = {}
+        if not batches:
+            return []
+
+        responses, errors = [], []
+        with concurrent.futures.ThreadPoolExecutor(
+            max_workers=min(self.max_workers, len(batches))
+        ) as executor:
+            for future in [executor.submit(self._put_metric_data, batch) for batch in batches]:
+                try:
+                    responses.append(future.result())
+                except Exception as e:
+                    errors.append(str(e))
+        if errors:
+            raise Exception(
+                f"{len(errors)} of {len(batches)} metric batches could not be published: "
+                + "; ".join(errors)
+            )
+        return responses
+
+    def _put_metric_data(self, batch):
+        for attempt in range(self.max_attempts):
+            try:
+                return self.client.put_metric_data(MetricData=batch, Namespace=self.namespace)
+            except (ClientError, ConnectionError) as e:
+                is_retryable = not isinstance(e, ClientError) or (
+                    e.response["Error"]["Code"] in RETRYABLE_ERROR_CODES
+                )
+                if not is_retryable or attempt == self.max_attempts - 1:
+                    raise
+                # Full jitter, so that concurrent batches do not retry in lockstep
+                time.sleep(random.uniform(0, self.backoff_seconds * 2**attempt))
+
 
 class Metrics(object):
     def __init__(self, context="DEV", region="us-west-2", namespace="dlc-metrics"):
-        self.client = boto3.Session(region_name=region).client("cloudwatch")
+        self.publisher = MetricsPublisher(namespace, region=region)
+        self.client = self.publisher.client
         self.context = context
         self.namespace = namespace
 
-    def push(self, name, unit, value, metrics_info):
+    def push(self, name, unit, value, metrics_info, aggregate=False):
+        """
+        Buffers a metric, the metrics are published by flush. With aggregate=True the values of
+        the same metric and dimensions are published as a single statistic set.
+        """
         dimensions = [{"Name": "BuildContext", "Value": self.context}]
 
         for key in metrics_info:
             dimensions.append({"Name": key, "Value": metrics_info[key]})
 
-        try:
-            response = self.client.put_metric_data(
-                MetricData=[
-                    {
-                        "MetricName": name,
-                        "Dimensions": dimensions,
-                        "Unit": unit,
-                        "Value": value,
-                    },
-                ],
-                Namespace=self.namespace,
-            )
-        except Exception as e:
-            raise Exception(str(e))
+        self.publisher.add(name, value, unit=unit, dimensions=dimensions, aggregate=aggregate)
 
-        return response
+    def flush(self):
+        return self.publisher.flush()
 
     def push_image_metrics(self, image):
         info = {
@@ -49,6 +207,11 @@ class Metrics(object):
         self.push("build_time", "Seconds", build_time, info)
         self.push("build_status", "None", build_status, info)
 
+        # One statistic set of the step times per image, the time of each step is in the build
+        # profile
+        for step in image.log.steps:
+            self.push("build_step_time", "Seconds", step.seconds, info, aggregate=True)
+
         if image.build_status == constants.SUCCESS:
             image_size = image.summary["image_size"]
             self.push("image_size", "Bytes", image_size, info)
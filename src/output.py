@@ -12,11 +12,11 @@ distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF
 ANY KIND, either express or implied. See the License for the specific
 language governing permissions and limitations under the License.
 """
-import time
+import json
 import sys
 import shutil
 import logging
-from collections import defaultdict
+from concurrent.futures import as_completed
 
 import pyfiglet
 import reprint
@@ -79,39 +79,101 @@ class OutputFormatter:
 
     def progress(self, futures):
         """
-        Print a progressbar
+        Print the status of each future as soon as it completes, and return once the last one
+        is done. On a terminal the status lines are redrawn in place, otherwise every completion
+        is printed as a machine readable event. The futures may have waited for a worker, so no
+        per-task duration is printed.
         Note: futures is a dictionary. Keys = Name of the thread,
         Value = concurrent.futures object. The function being executed
-        MUST return a dictionary with 'status' key that defines the status code.
-        """
-
-        done = defaultdict(bool)
-
-        isatty = sys.stdout.isatty()
-
-        with reprint.output(
-            output_type="list", initial_len=len(futures.items()), interval=0
-        ) as output:
-            num_iterations = 0
+        MUST return the status code.
+
+        :param futures: dict, name -> concurrent.futures.Future
+        """
+        names = {future: name for name, future in futures.items()}
+        indexes = {name: index for index, name in enumerate(futures)}
+        errors = []
+
+        def get_status(future):
+            if future.exception() is not None:
+                errors.append(future.exception())
+                return "Error"
+            return constants.STATUS_MESSAGE.get(future.result(), str(future.result()))
+
+        if not sys.stdout.isatty():
+            for done, future in enumerate(as_completed(names), 1):
+                self.task_event(
+                    names[future],
+                    get_status(future),
+                    done=done,
+                    total=len(futures),
+                )
+        else:
+            with reprint.output(output_type="list", initial_len=len(futures), interval=0) as output:
+                for name, index in indexes.items():
+                    output[index] = f"{name}{'.' * 10}Running"
+                for future in as_completed(names):
+                    name = names[future]
+                    output[indexes[name]] = self.format_task_status(name, get_status(future))
             self.print_lines(output)
-            while True:
-                i = 0
-                num_iterations += 1
-                for image, thread in futures.items():
-                    output[i] = image
-                    if thread.done():
-                        output[i] += "." * 10 + constants.STATUS_MESSAGE[futures[image].result()]
-                        done[image] = True
-                    else:
-                        output[i] += "." * (num_iterations % 10)
-                        done[image] = False
-                    i += 1
-
-                if all(done.values()):
-                    break
-                time.sleep(1)
-
-        self.print_lines(output)
+
+        if errors:
+            raise errors[0]
+
+    def format_task_status(self, name, status, elapsed=None, transferred_bytes=None):
+        """
+        :param name: str, name of the task
+        :param status: str, status message
+        :param elapsed: float, seconds the task took, None if unknown
+        :param transferred_bytes: int, bytes transferred by the task
+        :return: str, status line of the task
+        """
+        line = f"{name}{'.' * 10}{status}"
+        details = []
+        if elapsed is not None:
+            details.append(f"{elapsed:.1f}s")
+        if transferred_bytes:
+            megabytes = transferred_bytes / (1024 * 1024)
+            if elapsed is not None:
+                details.append(f"{megabytes:.1f} MB at {megabytes / max(elapsed, 0.001):.1f} MB/s")
+            else:
+                details.append(f"{megabytes:.1f} MB")
+        if details:
+            line += f" ({', '.join(details)})"
+        return line
+
+    def task_event(self, name, status, elapsed=None, transferred_bytes=None, done=None, total=None):
+        """
+        Print the status of a finished task, as a status line on a terminal and as a JSON
+        progress event otherwise, so that CI logs can be parsed.
+
+        :param name: str, name of the task
+        :param status: str, status message
+        :param elapsed: float, seconds the task took, None if unknown
+        :param transferred_bytes: int, bytes transferred by the task
+        :param done: int, number of finished tasks
+        :param total: int, total number of tasks
+        """
+        if sys.stdout.isatty():
+            line = self.format_task_status(name, status, elapsed, transferred_bytes)
+            if done is not None and total is not None:
+                line = f"[{done}/{total}] {line}"
+            self.print(line)
+            return
+        event = {
+            "event": "progress",
+            "name": name,
+            "status": status,
+            "done": done,
+            "total": total,
+        }
+        if elapsed is not None:
+            event["elapsed_seconds"] = round(elapsed, 3)
+        if transferred_bytes:
+            event["bytes"] = transferred_bytes
+            if elapsed is not None:
+                event["bytes_per_second"] = round(transferred_bytes / max(elapsed, 0.001))
+        self.print(json.dumps(event))
+        sys.stdout.flush()
 
     def table(self, rows):
         """
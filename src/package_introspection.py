@@ -0,0 +1,203 @@
+"""
+Copyright 2019-2020 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+
+Licensed under the Apache License, Version 2.0 (the "License"). You
+may not use this file except in compliance with the License. A copy of
+the License is located at
+
+    http://aws.amazon.com/apache2.0/
+
+or in the "license" file accompanying this file. This file is
+distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF
+ANY KIND, either express or implied. See the License for the specific
+language governing permissions and limitations under the License.
+"""
+
+import io
+import json
+import logging
+import os
+import threading
+
+from invoke.context import Context
+
+import constants
+
+LOGGER = logging.getLogger(__name__)
+LOGGER.setLevel(logging.INFO)
+
+PACKAGE_COMMANDS = (
+    "pip list",
+    "dpkg-query -Wf '${Installed-Size}\\t${Package}\\n'",
+    "apt list --installed",
+)
+
+# Runs inside the image with "python - <patch details directory>" and prints a single JSON
+# document. It must stay compatible with the oldest python of the images.
+COLLECTOR_SCRIPT = """
+import json
+import os
+import subprocess
+import sys
+
+try:
+    import pkg_resources
+
+    python_packages = [{"name": d.key, "version": d.version} for d in pkg_resources.working_set]
+except ImportError:
+    import importlib.metadata
+
+    python_packages = [
+        {"name": d.metadata["Name"].lower(), "version": d.version}
+        for d in importlib.metadata.distributions()
+    ]
+
+commands = {}
+for command in %(commands)s:
+    process = subprocess.Popen(
+        command,
+        shell=True,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+        universal_newlines=True,
+    )
+    output, error = process.communicate()
+    commands[command] = {"exit_code": process.returncode, "output": output, "error": error}
+
+patch_details = {}
+patch_details_dir = sys.argv[1]
+if os.path.isdir(patch_details_dir):
+    for file_name in sorted(os.listdir(patch_details_dir)):
+        file_path = os.path.join(patch_details_dir, file_name)
+        if os.path.isfile(file_path):
+            with open(file_path) as patch_details_file:
+                patch_details[file_name] = patch_details_file.read()
+
+print(
+    json.dumps(
+        {
+            "python_packages": python_packages,
+            "commands": commands,
+            "patch_details": patch_details,
+        }
+    )
+)
+""" % {"commands": repr(list(PACKAGE_COMMANDS))}
+
+_cache = {}
+_locks = {}
+_locks_lock = threading.Lock()
+
+
+def get_image_id(image_uri, ctx=None):
+    """
+    :param image_uri: str, image uri
+    :param ctx: invoke Context
+    :return: str, id (digest of the configuration) of the local image
+    """
+    ctx = ctx or Context()
+    return ctx.run(
+        f"docker image inspect --format '{{{{.Id}}}}' {image_uri}", hide=True
+    ).stdout.strip()
+
+
+def get_package_information(image_uri, container_id=None, ctx=None):
+    """
+    Returns the packages installed in an image, collected by a single run of COLLECTOR_SCRIPT:
+    {
+        "image_id": "sha256:...",
+        "python_packages": [{"name": package_name, "version": package_version}, ...],
+        "commands": {command: {"exit_code": 0, "output": "...", "error": "..."}, ...},
+        "patch_details": {file_name: content, ...},
+    }
+    The commands are the PACKAGE_COMMANDS and the patch details are the files of the
+    patch-details directory of PATCHING_INFO_PATH_WITHIN_DLC. The document is cached in memory
+    and in PACKAGE_INFORMATION_CACHE_DIR by image id, so it is collected once per image.
+
+    :param image_uri: str, image uri
+    :param container_id: str, running container of the image to collect from. If it is not
+                         given, the document is collected in a new container.
+    :param ctx: invoke Context
+    :return: dict, as described above
+    """
+    ctx = ctx or Context()
+    image_id = get_image_id(image_uri, ctx=ctx)
+    with _locks_lock:
+        lock = _locks.setdefault(image_id, threading.Lock())
+    with lock:
+        if image_id not in _cache:
+            _cache[image_id] = _load_or_collect(image_uri, image_id, container_id, ctx)
+        return _cache[image_id]
+
+
+def get_scanned_package_information(image_uri, container_id, ctx=None):
+    """
+    Returns the package information of the image, with the python packages at the versions
+    installed in the container. Scanners installed in the container, e.g. safety, scan the
+    environment they run in, and installing them may have upgraded packages of the image.
+    Packages that were not in the image, e.g. the requirements of the scanner, are left out.
+
+    :param image_uri: str, image uri
+    :param container_id: str, running container of the image, with the scanner installed
+    :param ctx: invoke Context
+    :return: dict, as returned by get_package_information
+    """
+    ctx = ctx or Context()
+    package_information = get_package_information(image_uri, ctx=ctx)
+    image_package_names = {package["name"] for package in package_information["python_packages"]}
+    scanned_package_information = collect_package_information(image_uri, container_id, ctx=ctx)
+    return dict(
+        package_information,
+        python_packages=[
+            package
+            for package in scanned_package_information["python_packages"]
+            if package["name"] in image_package_names
+        ],
+    )
+
+
+def _load_or_collect(image_uri, image_id, container_id, ctx):
+    cache_path = os.path.join(
+        constants.PACKAGE_INFORMATION_CACHE_DIR, f"{image_id.replace(':', '-')}.json"
+    )
+    if os.path.exists(cache_path):
+        try:
+            with open(cache_path, "r") as cache_file:
+                return json.load(cache_file)
+        except ValueError:
+            LOGGER.info(f"Ignoring {cache_path}, it is not valid JSON")
+
+    package_information = collect_package_information(image_uri, container_id, ctx)
+    package_information["image_id"] = image_id
+
+    os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+    # Images are also introspected by concurrent test processes
+    temporary_path = f"{cache_path}.{os.getpid()}.{threading.get_ident()}"
+    with open(temporary_path, "w") as cache_file:
+        json.dump(package_information, cache_file)
+    os.replace(temporary_path, cache_path)
+    return package_information
+
+
+def collect_package_information(image_uri, container_id=None, ctx=None):
+    """
+    Runs COLLECTOR_SCRIPT in a container of the image, without caching the result.
+
+    :param image_uri: str, image uri
+    :param container_id: str, running container to collect from, a new container if None
+    :param ctx: invoke Context
+    :return: dict, as returned by get_package_information, without the image id
+    """
+    ctx = ctx or Context()
+    patch_details_dir = os.path.join(constants.PATCHING_INFO_PATH_WITHIN_DLC, "patch-details")
+    if container_id:
+        command = f"docker exec -i {container_id} python - {patch_details_dir}"
+    else:
+        command = f"docker run --rm -i --entrypoint python {image_uri} - {patch_details_dir}"
+    LOGGER.info(f"Collecting package information of {image_uri}")
+    run_output = ctx.run(command, in_stream=io.StringIO(COLLECTOR_SCRIPT), hide=True, warn=True)
+    if run_output.exited != 0:
+        raise Exception(
+            f"Package information cannot be retrieved from {image_uri}: {run_output.stderr}"
+        )
+    return json.loads(run_output.stdout)
@@ -224,7 +224,7 @@ def conduct_autopatch_build_setup(pre_push_image_object: DockerImage, download_p
             patch_details_path=current_patch_details_path,
             python_version=info.get("python_version"),
         )
-    FORMATTER.progress(THREADS)
+        FORMATTER.progress(THREADS)
 
     run(
         f"cp -r {current_patch_details_path}/. {complete_patching_info_dump_location}/patch-details-current"
@@ -363,8 +363,8 @@ def initiate_multithreaded_autopatch_prep(PRE_PUSH_STAGE_IMAGES, make_dummy_boto
             THREADS[pre_push_image_object.name] = executor.submit(
                 conduct_autopatch_build_setup, pre_push_image_object, download_path
             )
-    # the FORMATTER.progress(THREADS) function call also waits until all threads have completed
-    FORMATTER.progress(THREADS)
+        # the FORMATTER.progress(THREADS) function call also waits until all threads have completed
+        FORMATTER.progress(THREADS)
 
 
 def retrive_autopatched_image_history_and_upload_to_s3(image_uri):
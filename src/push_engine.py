@@ -0,0 +1,217 @@
+"""
+Copyright 2019-2020 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+
+Licensed under the Apache License, Version 2.0 (the "License"). You
+may not use this file except in compliance with the License. A copy of
+the License is located at
+
+    http://aws.amazon.com/apache2.0/
+
+or in the "license" file accompanying this file. This file is
+distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF
+ANY KIND, either express or implied. See the License for the specific
+language governing permissions and limitations under the License.
+"""
+
+import logging
+import re
+import threading
+
+import boto3
+
+from botocore.exceptions import ClientError
+
+import constants
+
+LOGGER = logging.getLogger(__name__)
+LOGGER.setLevel(logging.INFO)
+
+ECR_REPOSITORY_PATTERN = re.compile(
+    r"^(?P<registry_id>\d{12})\.dkr\.ecr\.(?P<region>[a-z0-9-]+)\.amazonaws\.com(\.cn)?"
+    r"/(?P<name>.+)$"
+)
+
+MANIFEST_MEDIA_TYPES = [
+    "application/vnd.docker.distribution.manifest.v2+json",
+    "application/vnd.docker.distribution.manifest.list.v2+json",
+    "application/vnd.oci.image.manifest.v1+json",
+    "application/vnd.oci.image.index.v1+json",
+]
+
+
+def estimate_layer_sizes(client, image_uri):
+    """
+    Estimates the size of each layer of a local image from its history, in which the entries that
+    do not create a layer (ENV, LABEL, ...) have a size of 0.
+
+    :param client: docker.APIClient
+    :param image_uri: str, local image
+    :return: tuple(str, list[tuple(str, int)]), image id and (diff id, bytes) of each layer,
+             bottom layer first
+    """
+    image = client.inspect_image(image_uri)
+    layers = image["RootFS"]["Layers"]
+    sizes = [entry["Size"] for entry in reversed(client.history(image_uri))]
+    if len(sizes) != len(layers):
+        sizes = [size for size in sizes if size > 0]
+    if len(sizes) != len(layers):
+        sizes = [image["Size"] // max(1, len(layers))] * len(layers)
+    return image["Id"], list(zip(layers, sizes))
+
+
+class PushEngine:
+    """
+    Pushes images so that every layer and every image is uploaded once:
+    - an image already pushed to the same repository is not pushed again, its tag is added to the
+      pushed manifest instead
+    - a push waits for the pushes uploading layers it shares, so shared base layers are uploaded
+      first and only once, the waiting push then finds them in the registry
+    - concurrent pushes are limited by the estimated bytes of the layers they upload
+    Additional tags are applied as manifest-only operations with ECR PutImage, falling back to a
+    docker push for other registries.
+    """
+
+    def __init__(self, max_bytes_in_flight=constants.MAX_PUSH_BYTES_IN_FLIGHT):
+        self.max_bytes_in_flight = max_bytes_in_flight
+        self._condition = threading.Condition()
+        self._bytes_in_flight = 0
+        self._uploading_layers = set()
+        self._pushed_layers = set()
+        self._pushing_images = set()
+        self._pushed_images = {}
+        self._ecr_clients = {}
+        self.naive_bytes = 0
+        self.transferred_bytes = 0
+        self.docker_pushes = 0
+        self.manifest_tags = 0
+
+    def push(self, image):
+        """
+        Pushes repository:tag of an image.
+
+        :param image: DockerImage
+        :return: int, Build Status
+        """
+        image_id, layers = estimate_layer_sizes(image.client, image.ecr_url)
+        registry = image.repository.split("/")[0]
+        layer_keys = [(registry, diff_id) for diff_id, _ in layers]
+        image_key = (image.repository, image_id)
+
+        with self._condition:
+            # Without deduplication, every image push uploads all of its layers
+            self.naive_bytes += sum(size for _, size in layers)
+            while image_key not in self._pushed_images:
+                new_layers = [
+                    (key, size)
+                    for key, (_, size) in zip(layer_keys, layers)
+                    if key not in self._pushed_layers
+                ]
+                new_bytes = min(sum(size for _, size in new_layers), self.max_bytes_in_flight)
+                is_waiting_for_layers = image_key in self._pushing_images or any(
+                    key in self._uploading_layers for key, _ in new_layers
+                )
+                has_bandwidth = (
+                    self._bytes_in_flight == 0
+                    or self._bytes_in_flight + new_bytes <= self.max_bytes_in_flight
+                )
+                if not is_waiting_for_layers and has_bandwidth:
+                    break
+                self._condition.wait()
+
+            pushed_tag = self._pushed_images.get(image_key)
+            if pushed_tag is None:
+                self._pushing_images.add(image_key)
+                self._uploading_layers.update(key for key, _ in new_layers)
+                self._bytes_in_flight += new_bytes
+
+        if pushed_tag is not None:
+            LOGGER.info(f"{image.ecr_url} was already pushed as {image.repository}:{pushed_tag}")
+            return self.push_tag(image, image.tag, source_tag=pushed_tag)
+
+        status = constants.FAIL
+        try:
+            status = image.push_image()
+        finally:
+            with self._condition:
+                self._pushing_images.discard(image_key)
+                self._uploading_layers.difference_update(key for key, _ in new_layers)
+                self._bytes_in_flight -= new_bytes
+                if status == constants.SUCCESS:
+                    self._pushed_images[image_key] = image.tag
+                    self._pushed_layers.update(layer_keys)
+                self.docker_pushes += 1
+                self.transferred_bytes += image.pushed_bytes
+                self._condition.notify_all()
+        return status
+
+    def push_tag(self, image, tag, source_tag=None):
+        """
+        Adds a tag to an image that was already pushed, without uploading it again.
+
+        :param image: DockerImage
+        :param tag: str, tag to add
+        :param source_tag: str, tag the image was pushed with, image.tag by default
+        :return: int, Build Status
+        """
+        if self.put_image_tag(image.repository, source_tag or image.tag, tag):
+            with self._condition:
+                self.manifest_tags += 1
+            return image.record_pushed_tag(tag, f"Tagged {image.repository}:{tag} in the registry")
+        with self._condition:
+            self.docker_pushes += 1
+        status = image.push_image(tag_value=tag)
+        with self._condition:
+            self.transferred_bytes += image.pushed_bytes
+        return status
+
+    def put_image_tag(self, repository, source_tag, tag):
+        """
+        Adds a tag to the manifest of repository:source_tag with ECR PutImage.
+
+        :return: bool, False if the repository is not in ECR or the manifest could not be tagged
+        """
+        match = ECR_REPOSITORY_PATTERN.match(repository)
+        if not match:
+            return False
+        ecr_client = self._get_ecr_client(match.group("region"))
+        repository_id = {
+            "registryId": match.group("registry_id"),
+            "repositoryName": match.group("name"),
+        }
+        try:
+            images = ecr_client.batch_get_image(
+                imageIds=[{"imageTag": source_tag}],
+                acceptedMediaTypes=MANIFEST_MEDIA_TYPES,
+                **repository_id,
+            )["images"]
+            if not images:
+                return False
+            manifest = {"imageManifest": images[0]["imageManifest"]}
+            if images[0].get("imageManifestMediaType"):
+                manifest["imageManifestMediaType"] = images[0]["imageManifestMediaType"]
+            ecr_client.put_image(imageTag=tag, **manifest, **repository_id)
+        except ClientError as e:
+            # The tag already points to this manifest
+            if e.response["Error"]["Code"] == "ImageAlreadyExistsException":
+                return True
+            LOGGER.warning(f"Could not tag {repository}:{source_tag} as {tag} in ECR: {e}")
+            return False
+        return True
+
+    def _get_ecr_client(self, region):
+        # boto3 clients are thread safe, but creating them is not
+        with self._condition:
+            if region not in self._ecr_clients:
+                self._ecr_clients[region] = boto3.client("ecr", region_name=region)
+            return self._ecr_clients[region]
+
+    def report(self):
+        """
+        :return: str, bytes transferred by the pushes compared with the naive approach
+        """
+        return (
+            f"Uploaded {self.transferred_bytes / (1024 * 1024):.1f} MB of layers with "
+            f"{self.docker_pushes} docker pushes and {self.manifest_tags} manifest-only tags. "
+            f"Pushing every image with all of its layers would have uploaded "
+            f"{self.naive_bytes / (1024 * 1024):.1f} MB."
+        )
@@ -3,6 +3,7 @@ from datetime import datetime
 
 import json
 import os
+import package_introspection
 import utils
 from config import is_autopatch_build_enabled
 
@@ -32,7 +33,15 @@ class SafetyReportGenerator:
     ]
     """
 
-    def __init__(self, container_id, ignore_dict={}, image_uri="", image_info=None):
+    def __init__(
+        self,
+        container_id,
+        ignore_dict={},
+        image_uri="",
+        image_info=None,
+        package_information=None,
+        safety_db_path=None,
+    ):
         self.container_id = container_id
         self.vulnerability_dict = {}
         self.vulnerability_list = []
@@ -44,6 +53,8 @@ class SafetyReportGenerator:
         self.vulnerabilities_to_be_added_to_ignore_list = {}
         self.image_uri = image_uri
         self.image_info = image_info
+        self.package_information = package_information
+        self.safety_db_path = safety_db_path
 
     def insert_vulnerabilites_into_report(self, scanned_vulnerabilities):
         """
@@ -85,24 +96,26 @@ class SafetyReportGenerator:
             else:
                 self.vulnerability_dict[package]["vulnerabilities"].append(vulnerability_details)
 
+    def get_package_information(self):
+        """
+        Returns the package information document of the image, collected from the container the
+        first time it is needed.
+
+        :return: dict, as returned by package_introspection.get_package_information
+        """
+        if self.package_information is None:
+            self.package_information = package_introspection.get_package_information(
+                self.image_uri, container_id=self.container_id, ctx=self.ctx
+            )
+        return self.package_information
+
     def get_package_set_from_container(self):
         """
         Extracts package set of a container.
 
         :return: list[dict], each dict is structured like {'name': package_name, 'version':package_version}
         """
-
-        python_cmd_to_extract_package_set = """ python -c "import pkg_resources; \
-                import json; \
-                print(json.dumps([{'name':d.key, 'version':d.version} for d in pkg_resources.working_set]))" """
-
-        run_output = self.ctx.run(
-            f"{self.docker_exec_cmd} {python_cmd_to_extract_package_set}", hide=True, warn=True
-        )
-        if run_output.exited != 0:
-            raise Exception("Package set cannot be retrieved from the container.")
-
-        return json.loads(run_output.stdout)
+        return self.get_package_information()["python_packages"]
 
     def insert_safe_packages_into_report(self, packages):
         """
@@ -133,13 +146,12 @@ class SafetyReportGenerator:
         """
         This method extracts the dumped ignore lists within the DLCs that have been dumped by the autopatch procedure.
         """
-        from src import constants
-
-        dumped_ignore_list_command = f"{self.docker_exec_cmd} cat {constants.PATCHING_INFO_PATH_WITHIN_DLC}/patch-details/vuln_deactivation_data.json"
+        dumped_ignore_list = self.get_package_information()["patch_details"].get(
+            "vuln_deactivation_data.json", ""
+        )
         return_data = {}
         try:
-            run_out = self.ctx.run(dumped_ignore_list_command, hide=True)
-            return_data = json.loads(run_out.stdout.strip())
+            return_data = json.loads(dumped_ignore_list.strip())
         except:
             pass
         return return_data
@@ -150,6 +162,7 @@ class SafetyReportGenerator:
         On being called, it processes each package within the vulnerability_dict and appends it to the vulnerability_list.
         Before appending it checks if the scan_status is "TBD". If yes, it assigns the correct scan_status to the package.
         """
+        ignored_package_dict = None
         for package, package_scan_results in self.vulnerability_dict.items():
             if package_scan_results["scan_status"] == "TBD":
                 if (
@@ -162,7 +175,10 @@ class SafetyReportGenerator:
                     ## else call the package as failed itself
                     package_scan_results["scan_status"] = "FAILED"
                     if is_autopatch_build_enabled(buildspec_path=self.image_info["buildspec_path"]):
-                        ignored_package_dict = self.get_autopatched_dumped_ignore_dict_of_packages()
+                        if ignored_package_dict is None:
+                            ignored_package_dict = (
+                                self.get_autopatched_dumped_ignore_dict_of_packages()
+                            )
                         if package in ignored_package_dict:
                             ignore_message = f"""[Package: {package}] Conflicts for: {",".join(ignored_package_dict.get(package).keys())}"""
                             package_scan_results["scan_status"] = "IGNORED"
@@ -184,6 +200,8 @@ class SafetyReportGenerator:
         :return: string, A JSON formatted string containing vulnerabilities found in the container
         """
         safety_check_command = f"{self.docker_exec_cmd} safety check --output json"
+        if self.safety_db_path:
+            safety_check_command += f" --db {self.safety_db_path}"
         run_out = self.ctx.run(safety_check_command, warn=True, hide=True)
         if run_out.return_code != 0:
             print(
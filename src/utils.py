@@ -13,12 +13,12 @@ ANY KIND, either express or implied. See the License for the specific
 language governing permissions and limitations under the License.
 """
 import os
-import re
 import json
 import logging
 import sys
 import boto3
 import constants
+import package_introspection
 
 from botocore.exceptions import ClientError
 from invoke.context import Context
@@ -26,6 +26,7 @@ from invoke.context import Context
 from codebuild_environment import get_cloned_folder_path
 from config import is_build_enabled, is_autopatch_build_enabled
 from safety_report_generator import SafetyReportGenerator
+from vulnerability_db import SafetyDatabaseSnapshot
 
 LOGGER = logging.getLogger(__name__)
 LOGGER.setLevel(logging.DEBUG)
@@ -51,35 +52,6 @@ def download_s3_file(bucket_name, filepath, local_file_name):
         raise
 
 
-def download_file(remote_url: str, link_type: str):
-    """
-    Fetch remote files and save with provided local_path name
-    :param link_type: string
-    :param remote_url: string
-    :return: file_name: string
-    """
-    LOGGER.info(f"Downloading {remote_url}")
-
-    file_name = os.path.basename(remote_url).strip()
-    LOGGER.info(f"basename: {file_name}")
-
-    if link_type in ["s3"] and remote_url.startswith("s3://"):
-        match = re.match(r"s3:\/\/(.+?)\/(.+)", remote_url)
-        if match:
-            bucket_name = match.group(1)
-            bucket_key = match.group(2)
-            LOGGER.info(f"bucket_name: {bucket_name}")
-            LOGGER.info(f"bucket_key: {bucket_key}")
-            download_s3_file(bucket_name, bucket_key, file_name)
-        else:
-            raise ValueError(f"Regex matching on s3 URI failed.")
-    else:
-        ctx = Context()
-        ctx.run(f"curl -O {remote_url}")
-
-    return file_name
-
-
 def build_setup(framework, device_types=[], image_types=[], py_versions=[]):
     """
     Setup the appropriate environment variables depending on whether this is a PR build
@@ -381,16 +353,30 @@ def generate_safety_report_for_image(image_uri, image_info, storage_file_path=No
     :return: list[dict], safety report generated by SafetyReportGenerator
     """
     ctx = Context()
-    docker_run_cmd = f"docker run -id --entrypoint='/bin/bash' {image_uri} "
+    # Safety checks the packages against a read-only snapshot of the vulnerability database
+    safety_db_volume = SafetyDatabaseSnapshot().get_docker_volume_argument()
+    docker_run_cmd = f"docker run -id {safety_db_volume} --entrypoint='/bin/bash' {image_uri} "
     container_id = ctx.run(f"{docker_run_cmd}", hide=True, warn=True).stdout.strip()
+    # Collected before safety is installed, so that the report only lists the packages of the image
+    package_introspection.get_package_information(image_uri, container_id=container_id, ctx=ctx)
     install_safety_cmd = "pip install 'safety>=2.2.0,<3'"
     docker_exec_cmd = f"docker exec -i {container_id}"
     ctx.run(f"{docker_exec_cmd} {install_safety_cmd}", hide=True, warn=True)
+    # The install may upgrade packages of the image that safety depends on, report the versions
+    # safety actually scans
+    package_information = package_introspection.get_scanned_package_information(
+        image_uri, container_id, ctx=ctx
+    )
     ignore_dict = get_safety_ignore_dict(
         image_uri, image_info["framework"], image_info["python_version"], image_info["image_type"]
     )
     safety_report_generator_object = SafetyReportGenerator(
-        container_id, ignore_dict=ignore_dict, image_uri=image_uri, image_info=image_info
+        container_id,
+        ignore_dict=ignore_dict,
+        image_uri=image_uri,
+        image_info=image_info,
+        package_information=package_information,
+        safety_db_path=constants.SAFETY_DB_PATH_WITHIN_CONTAINER,
     )
     safety_scan_output = safety_report_generator_object.generate()
     ctx.run(f"docker rm -f {container_id}", hide=True, warn=True)
@@ -0,0 +1,290 @@
+"""
+Copyright 2019-2020 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+
+Licensed under the Apache License, Version 2.0 (the "License"). You
+may not use this file except in compliance with the License. A copy of
+the License is located at
+
+    http://aws.amazon.com/apache2.0/
+
+or in the "license" file accompanying this file. This file is
+distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF
+ANY KIND, either express or implied. See the License for the specific
+language governing permissions and limitations under the License.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import re
+import shutil
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+
+import constants
+
+LOGGER = logging.getLogger(__name__)
+LOGGER.setLevel(logging.INFO)
+
+SAFETY_DB_FILES = ("insecure.json", "insecure_full.json")
+
+# Shared by all the snapshots, since the images are scanned concurrently
+_refresh_lock = threading.Lock()
+
+
+def _is_remote(location):
+    return urllib.parse.urlparse(location).scheme in ("http", "https")
+
+
+def _write_json(path, data):
+    # The caches are shared by concurrent processes (e.g. pytest-xdist workers), each one writes
+    # its own temporary file
+    temporary_path = f"{path}.{os.getpid()}.{threading.get_ident()}"
+    with open(temporary_path, "w") as json_file:
+        json.dump(data, json_file)
+    os.replace(temporary_path, path)
+
+
+def _read_json(path):
+    """
+    :return: the content of a JSON file, None if it does not exist or is not valid JSON
+    """
+    try:
+        with open(path, "r") as json_file:
+            return json.load(json_file)
+    except FileNotFoundError:
+        return None
+    except ValueError:
+        LOGGER.info(f"Ignoring {path}, it is not valid JSON")
+        return None
+
+
+def _conditional_get(url, etag=None, timeout=60):
+    """
+    :return: tuple(bytes, str), content and ETag of the URL, content is None if the ETag matched
+    """
+    request = urllib.request.Request(url)
+    if etag:
+        request.add_header("If-None-Match", etag)
+    try:
+        with urllib.request.urlopen(request, timeout=timeout) as response:
+            return response.read(), response.headers.get("ETag")
+    except urllib.error.HTTPError as e:
+        if e.code == 304:
+            return None, etag
+        raise
+
+
+class SafetyDatabaseSnapshot(object):
+    """
+    Local, versioned copy of the safety vulnerability database, used with "safety check --db".
+    - versions/<version>/ holds the SAFETY_DB_FILES, the version is the hash of their content
+    - current.json points to the version in use, with the time and the ETags of the last refresh
+    The snapshot is refreshed from the mirror once it is older than max_age_hours. Files are
+    requested with their ETag, so unchanged files are not downloaded again, and a new version is
+    only created when the content changed. The mirror can also be a local directory, e.g. a
+    fixture snapshot for offline tests.
+    """
+
+    def __init__(
+        self,
+        snapshot_dir=constants.SAFETY_DB_SNAPSHOT_DIR,
+        mirror=constants.SAFETY_DB_MIRROR,
+        max_age_hours=constants.SAFETY_DB_MAX_AGE_HOURS,
+    ):
+        """
+        :param snapshot_dir: str, directory of the snapshots
+        :param mirror: str, URL or directory of the safety database
+        :param max_age_hours: float, age after which the snapshot is refreshed
+        """
+        self.snapshot_dir = snapshot_dir
+        self.mirror = mirror
+        self.max_age_hours = max_age_hours
+
+    @property
+    def current_path(self):
+        return os.path.join(self.snapshot_dir, "current.json")
+
+    def get_current(self):
+        """
+        :return: dict, {"version", "refreshed_at", "etags"} of the snapshot in use, None if there
+                 is no snapshot
+        """
+        return _read_json(self.current_path)
+
+    def get_version_path(self, version):
+        return os.path.join(self.snapshot_dir, "versions", version)
+
+    def refresh(self, force=False):
+        """
+        Refreshes the snapshot unless it is more recent than max_age_hours.
+
+        :param force: bool, refresh regardless of the age of the snapshot
+        :return: str, directory of the snapshot in use
+        """
+        with _refresh_lock:
+            current = self.get_current()
+            if (
+                current
+                and not force
+                and time.time() - current["refreshed_at"] < self.max_age_hours * 3600
+            ):
+                return self.get_version_path(current["version"])
+
+            has_current = current and os.path.isdir(self.get_version_path(current["version"]))
+            try:
+                contents, new_etags = self._fetch(current["etags"] if has_current else {}, current)
+            except (urllib.error.URLError, OSError) as e:
+                if not has_current:
+                    raise
+                LOGGER.info(f"Using the expired safety database, it cannot be refreshed: {e}")
+                return self.get_version_path(current["version"])
+
+            sha256 = hashlib.sha256()
+            for file_name in SAFETY_DB_FILES:
+                sha256.update(hashlib.sha256(contents[file_name]).digest())
+            version = sha256.hexdigest()[:16]
+            version_path = self.get_version_path(version)
+            if not os.path.isdir(version_path):
+                for file_name in SAFETY_DB_FILES:
+                    # The database must be valid JSON, or safety fails on every image
+                    json.loads(contents[file_name])
+                temporary_path = f"{version_path}.{os.getpid()}"
+                os.makedirs(temporary_path, exist_ok=True)
+                for file_name in SAFETY_DB_FILES:
+                    with open(os.path.join(temporary_path, file_name), "wb") as db_file:
+                        db_file.write(contents[file_name])
+                try:
+                    os.replace(temporary_path, version_path)
+                except OSError:
+                    # Another process created the same version first
+                    if not os.path.isdir(version_path):
+                        raise
+                    shutil.rmtree(temporary_path, ignore_errors=True)
+            if has_current and current["version"] != version:
+                LOGGER.info(
+                    f"Safety database updated from {current['version']} to {version}: "
+                    f"{self.get_delta(current['version'], version)}"
+                )
+            _write_json(
+                self.current_path,
+                {"version": version, "refreshed_at": time.time(), "etags": new_etags},
+            )
+            self._prune(keep=version)
+            return version_path
+
+    def _fetch(self, etags, current):
+        contents, new_etags = {}, {}
+        for file_name in SAFETY_DB_FILES:
+            if _is_remote(self.mirror):
+                contents[file_name], new_etags[file_name] = _conditional_get(
+                    urllib.parse.urljoin(self.mirror, file_name),
+                    etag=etags.get(file_name),
+                )
+            else:
+                with open(os.path.join(self.mirror, file_name), "rb") as db_file:
+                    contents[file_name], new_etags[file_name] = db_file.read(), None
+            if contents[file_name] is None:
+                # Not modified since the last refresh
+                with open(
+                    os.path.join(self.get_version_path(current["version"]), file_name), "rb"
+                ) as db_file:
+                    contents[file_name] = db_file.read()
+        return contents, new_etags
+
+    def get_delta(self, old_version, new_version):
+        """
+        :return: dict, vulnerable packages added to, removed from and changed in new_version
+        """
+        old, new = [self._load(version, "insecure.json") for version in (old_version, new_version)]
+        return {
+            "added": sorted(set(new) - set(old)),
+            "removed": sorted(set(old) - set(new)),
+            "changed": sorted(name for name in set(old) & set(new) if old[name] != new[name]),
+        }
+
+    def _load(self, version, file_name):
+        with open(os.path.join(self.get_version_path(version), file_name), "r") as db_file:
+            return {key: value for key, value in json.load(db_file).items() if key != "$meta"}
+
+    def _prune(self, keep):
+        versions_dir = os.path.join(self.snapshot_dir, "versions")
+        versions = sorted(
+            (entry for entry in os.scandir(versions_dir) if entry.name != keep),
+            key=lambda entry: entry.stat().st_mtime,
+            reverse=True,
+        )
+        for entry in versions[constants.SAFETY_DB_SNAPSHOT_HISTORY - 1 :]:
+            shutil.rmtree(entry.path, ignore_errors=True)
+
+    def get_docker_volume_argument(self):
+        """
+        Refreshes the snapshot if needed and returns the docker run argument that mounts it
+        read-only at SAFETY_DB_PATH_WITHIN_CONTAINER.
+
+        :return: str
+        """
+        version_path = os.path.abspath(self.refresh())
+        return f"-v {version_path}:{constants.SAFETY_DB_PATH_WITHIN_CONTAINER}:ro"
+
+
+class PackageMetadataCache(object):
+    """
+    On-disk cache of the PyPI JSON metadata of python packages. Entries older than ttl_hours are
+    revalidated with their ETag. If PyPI cannot be reached, expired entries are still used.
+    """
+
+    def __init__(
+        self,
+        cache_dir=constants.PYPI_METADATA_CACHE_DIR,
+        ttl_hours=constants.PYPI_METADATA_TTL_HOURS,
+        index_url="https://pypi.org/pypi",
+    ):
+        """
+        :param cache_dir: str, directory of the cache
+        :param ttl_hours: float, age after which an entry is revalidated
+        :param index_url: str, PyPI JSON API
+        """
+        self.cache_dir = cache_dir
+        self.ttl_hours = ttl_hours
+        self.index_url = index_url
+        self._lock = threading.Lock()
+
+    def get(self, package_name):
+        """
+        :param package_name: str
+        :return: dict, PyPI JSON metadata of the package
+        """
+        name = re.sub(r"[-_.]+", "-", package_name).lower()
+        entry_path = os.path.join(self.cache_dir, f"{name}.json")
+        # A corrupt entry is a cache miss, it is replaced by the new download
+        entry = _read_json(entry_path)
+        if entry is not None and time.time() - entry["fetched_at"] < self.ttl_hours * 3600:
+            return entry["data"]
+
+        try:
+            content, etag = _conditional_get(
+                f"{self.index_url}/{name}/json", etag=entry["etag"] if entry else None
+            )
+        except (urllib.error.URLError, OSError) as e:
+            if entry is None:
+                raise
+            LOGGER.info(f"Using expired PyPI metadata of {name}, PyPI cannot be reached: {e}")
+            return entry["data"]
+
+        data = entry["data"] if content is None else json.loads(content)
+        with self._lock:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            _write_json(entry_path, {"fetched_at": time.time(), "etag": etag, "data": data})
+        return data
+
+    def get_latest_version(self, package_name):
+        """
+        :param package_name: str
+        :return: str, latest version of the package according to PyPI
+        """
+        return self.get(package_name)["info"]["version"]
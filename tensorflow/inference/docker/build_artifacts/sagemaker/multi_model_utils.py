@@ -11,12 +11,20 @@
 # ANY KIND, either express or implied. See the License for the specific
 # language governing permissions and limitations under the License.
 import fcntl
+import json
+import mmap
+import multiprocessing
+import os
 import signal
+import struct
 import time
+import zlib
 from contextlib import contextmanager
 
 MODEL_CONFIG_FILE = "/sagemaker/model-config.cfg"
 DEFAULT_LOCK_FILE = "/sagemaker/lock-file.lock"
+DEFAULT_REGISTRY_FILE = "/sagemaker/tfs-instance-registry.mmap"
+DEFAULT_REGISTRY_SIZE = 4 * 1024 * 1024
 
 
 @contextmanager
@@ -28,7 +36,6 @@ def lock(path=DEFAULT_LOCK_FILE):
     try:
         yield
     finally:
-        time.sleep(1)
         fcntl.lockf(fd, fcntl.LOCK_UN)
 
 
@@ -51,3 +58,80 @@ class MultiModelException(Exception):
         self.pid = pid
         self.code = code
         self.msg = msg
+
+
+class TfsInstanceRegistry:
+    """Table of model name -> TFS instances (ports and pids) shared by all gunicorn workers.
+
+    The table is stored in a memory-mapped file behind a header holding a generation counter.
+    Writers are serialized by lock() and make the generation odd while they update the table,
+    so readers never lock: they check the generation and only decode the table when it moved.
+    """
+
+    _HEADER = struct.Struct("<4sQII")  # magic, generation, payload length, payload crc32
+    _MAGIC = b"TFSR"
+
+    def __init__(self, path=DEFAULT_REGISTRY_FILE, size=DEFAULT_REGISTRY_SIZE):
+        fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            if os.fstat(fd).st_size < size:
+                os.ftruncate(fd, size)
+            self._mmap = mmap.mmap(fd, size)
+        finally:
+            os.close(fd)
+        self._size = size
+
+    def generation(self):
+        magic, generation, _, _ = self._HEADER.unpack_from(self._mmap, 0)
+        return generation if magic == self._MAGIC else 0
+
+    def read(self, timeout_seconds=1):
+        """Return a consistent (generation, table) snapshot, or None if a writer did not
+        finish its update within timeout_seconds"""
+        deadline = time.time() + timeout_seconds
+        while time.time() < deadline:
+            magic, generation, length, checksum = self._HEADER.unpack_from(self._mmap, 0)
+            if magic != self._MAGIC:
+                return 0, {}
+            if generation % 2 == 0:
+                payload = self._mmap[self._HEADER.size : self._HEADER.size + length]
+                # the checksum also catches reads torn by a concurrent writer
+                if self.generation() == generation and zlib.crc32(payload) == checksum:
+                    return generation, json.loads(payload.decode("utf-8"))
+            time.sleep(0)
+        return None
+
+    def write(self, table):
+        """Publish a new table and return its generation. Callers must hold lock()."""
+        payload = json.dumps(table).encode("utf-8")
+        if self._HEADER.size + len(payload) > self._size:
+            raise MultiModelException(507, "Too many models loaded for the TFS registry", None)
+
+        generation = self.generation()
+        # round an odd generation left behind by a writer that died mid-update up to even
+        generation += generation % 2
+        self._HEADER.pack_into(self._mmap, 0, self._MAGIC, generation + 1, 0, 0)
+        self._mmap[self._HEADER.size : self._HEADER.size + len(payload)] = payload
+        self._HEADER.pack_into(
+            self._mmap, 0, self._MAGIC, generation + 2, len(payload), zlib.crc32(payload)
+        )
+        return generation + 2
+
+
+class LastUsedClock:
+    """Last time each TFS rest port served a request, shared by all gunicorn workers.
+
+    Timestamps live in shared memory allocated before gunicorn forks its workers, so recording
+    a request is a single store without any lock. Concurrent stores only race between two
+    recent timestamps, which is fine to pick eviction candidates.
+    """
+
+    def __init__(self, rest_ports):
+        self._columns = {int(port): column for column, port in enumerate(rest_ports)}
+        self._times = multiprocessing.RawArray("d", len(self._columns))
+
+    def touch(self, rest_port):
+        self._times[self._columns[int(rest_port)]] = time.time()
+
+    def get(self, rest_port):
+        return self._times[self._columns[int(rest_port)]]
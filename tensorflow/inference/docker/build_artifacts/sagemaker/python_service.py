@@ -28,13 +28,16 @@ import grpc
 import sys
 import shutil
 import copy
-import pickle
+import time
+
+from concurrent.futures import ThreadPoolExecutor
 
 import falcon
 import requests
-import random
 
-from multi_model_utils import MultiModelException, lock
+from multi_model_utils import LastUsedClock, MultiModelException, TfsInstanceRegistry, lock
+import tfs_grpc
+import tfs_router
 import tfs_utils
 
 SAGEMAKER_MULTI_MODEL_ENABLED = os.environ.get("SAGEMAKER_MULTI_MODEL", "false").lower() == "true"
@@ -50,6 +53,25 @@ TFS_GRPC_PORTS = os.environ.get("TFS_GRPC_PORTS")
 TFS_REST_PORTS = os.environ.get("TFS_REST_PORTS")
 SAGEMAKER_TFS_PORT_RANGE = os.environ.get("SAGEMAKER_SAFE_PORT_RANGE")
 TFS_INSTANCE_COUNT = int(os.environ.get("SAGEMAKER_TFS_INSTANCE_COUNT", "1"))
+TFS_SESSION_POOL_SIZE = int(os.environ.get("SAGEMAKER_TFS_SESSION_POOL_SIZE", "10"))
+TFS_SESSION_POOL_BLOCK = (
+    os.environ.get("SAGEMAKER_TFS_SESSION_POOL_BLOCK", "false").lower() == "true"
+)
+SAGEMAKER_TFS_GRPC_PREDICT_ENABLED = (
+    os.environ.get("SAGEMAKER_TFS_GRPC_PREDICT", "false").lower() == "true"
+)
+TFS_GRPC_TIMEOUT_SECONDS = int(os.environ.get("SAGEMAKER_TFS_GRPC_TIMEOUT_SECONDS", "60"))
+TFS_ROUTING_POLICY = os.environ.get(
+    "SAGEMAKER_TFS_ROUTING_POLICY", tfs_router.LEAST_OUTSTANDING_REQUESTS
+).lower()
+# unset by default: loads are only rejected once TFS fails to start, as before
+MME_MAX_MEMORY_UTILIZATION = os.environ.get("SAGEMAKER_MME_MAX_MEMORY_UTILIZATION")
+MME_MAX_MEMORY_UTILIZATION = (
+    float(MME_MAX_MEMORY_UTILIZATION) if MME_MAX_MEMORY_UTILIZATION else None
+)
+MME_LRU_EVICTION_ENABLED = os.environ.get("SAGEMAKER_MME_LRU_EVICTION", "false").lower() == "true"
+TFS_PROFILE_REQUESTS = os.environ.get("SAGEMAKER_TFS_PROFILE_REQUESTS", "false").lower() == "true"
+TFS_STREAMING_ENABLED = os.environ.get("SAGEMAKER_TFS_STREAMING", "false").lower() == "true"
 
 logging.basicConfig(
     format="%(process)d %(asctime)s %(levelname)-8s %(message)s", force=True, level=logging.INFO
@@ -57,23 +79,38 @@ logging.basicConfig(
 log = logging.getLogger(__name__)
 
 CUSTOM_ATTRIBUTES_HEADER = "X-Amzn-SageMaker-Custom-Attributes"
-MME_TFS_INSTANCE_STATUS_FILE = "/sagemaker/tfs_instance.pickle"
+MME_LOADING_MODELS_FILE = "/sagemaker/tfs-loading-models.json"
 
 
 def default_handler(data, context):
     """A default inference request handler that directly send post request to TFS rest port with
     un-processed data and return un-processed response
     :param data: input data
-    :param context: context instance that contains tfs_rest_uri
+    :param context: context instance that contains tfs_rest_uri and a keep-alive session
     :return: inference response from TFS model server
     """
     data = data.read().decode("utf-8")
     if not isinstance(data, str):
         data = json.loads(data)
-    response = requests.post(context.rest_uri, data=data)
+    response = context.session.post(context.rest_uri, data=data)
     return response.content, context.accept_header
 
 
+def streaming_default_handler(data, context):
+    """A default inference request handler that streams the request body to the TFS rest port
+    and the TFS response back to the client, so memory per request stays bounded
+    :param data: input data stream
+    :param context: context instance that contains tfs_rest_uri and a keep-alive session
+    :return: streamed inference response from TFS model server
+    """
+    if context.content_length:
+        data = tfs_utils.RequestBodyStream(data, context.content_length)
+    else:
+        data = data.read()
+    response = context.session.post(context.rest_uri, data=data, stream=True)
+    return tfs_utils.StreamingResponse(response), context.accept_header
+
+
 class TfsInstanceStatus:
     def __init__(self, rest_port: str, grpc_port: str, pid: int):
         self.rest_port = rest_port
@@ -86,8 +123,15 @@ class TfsInstanceStatus:
 
 class PythonServiceResource:
     def __init__(self):
+        # keep-alive connections to TFS, shared by default and custom handlers
+        self._tfs_sessions = tfs_utils.TfsSessionPool(
+            pool_size=TFS_SESSION_POOL_SIZE, pool_block=TFS_SESSION_POOL_BLOCK
+        )
         if SAGEMAKER_MULTI_MODEL_ENABLED:
             self._mme_tfs_instances_status: dict[str, [TfsInstanceStatus]] = {}
+            # shared with the other gunicorn workers, refreshed when its generation changes
+            self._mme_registry = TfsInstanceRegistry()
+            self._mme_registry_generation = 0
             self._tfs_ports = self._parse_sagemaker_port_range_mme(SAGEMAKER_TFS_PORT_RANGE)
             self._tfs_available_ports = self._parse_sagemaker_port_range_mme(
                 SAGEMAKER_TFS_PORT_RANGE
@@ -99,6 +143,12 @@ class PythonServiceResource:
             self._tfs_grpc_ports = self._parse_concat_ports(TFS_GRPC_PORTS)
             self._tfs_rest_ports = self._parse_concat_ports(TFS_REST_PORTS)
 
+            # serve.py assigns the ports of each TFS instance at the same index
+            self._tfs_instances = [
+                tfs_router.TfsInstance(rest_port, grpc_port)
+                for rest_port, grpc_port in zip(self._tfs_rest_ports, self._tfs_grpc_ports)
+            ]
+
             self._channels = {}
             for grpc_port in self._tfs_grpc_ports:
                 # Initialize grpc channel here so gunicorn worker could have mapping
@@ -113,7 +163,7 @@ class PythonServiceResource:
                 self._handler, self._input_handler, self._output_handler
             )
         else:
-            self._handlers = default_handler
+            self._handlers = streaming_default_handler if TFS_STREAMING_ENABLED else default_handler
             self._default_handlers_enabled = True
 
         self._tfs_enable_batching = SAGEMAKER_BATCHING_ENABLED == "true"
@@ -126,9 +176,39 @@ class PythonServiceResource:
             os.environ.get("SAGEMAKER_TFS_WAIT_TIME_SECONDS", 55 // self._tfs_instance_count)
         )
 
+        # in-flight counters must be allocated here, before gunicorn forks the workers
+        if SAGEMAKER_MULTI_MODEL_ENABLED:
+            routed_rest_ports = self._tfs_ports["rest_port"]
+        else:
+            routed_rest_ports = self._tfs_rest_ports
+        self._in_flight = tfs_router.InFlightCounter(
+            routed_rest_ports, max_workers=2 * self._gunicorn_workers
+        )
+        self._router = tfs_router.Router(TFS_ROUTING_POLICY, self._in_flight)
+        if SAGEMAKER_MULTI_MODEL_ENABLED:
+            # picks the least recently used models to evict, shared by the workers as well
+            self._last_used = LastUsedClock(routed_rest_ports)
+
+        # gRPC predict fast path for the default handler, only single-model mode has channels
+        self._grpc_predict_handler = None
+        if self._default_handlers_enabled and not SAGEMAKER_MULTI_MODEL_ENABLED:
+            if tfs_grpc.GRPC_PREDICT_AVAILABLE:
+                self._grpc_predict_handler = tfs_grpc.GrpcPredictHandler(
+                    self._tfs_default_model_name, self._handlers, TFS_GRPC_TIMEOUT_SECONDS
+                )
+            elif SAGEMAKER_TFS_GRPC_PREDICT_ENABLED:
+                log.warning(
+                    "SAGEMAKER_TFS_GRPC_PREDICT is enabled but tensorflow and numpy are not "
+                    "installed, falling back to the TFS REST API."
+                )
+
     def on_post(self, req, res, model_name=None):
         if model_name or "invocations" in req.uri:
-            self._handle_invocation_post(req, res, model_name)
+            if TFS_PROFILE_REQUESTS:
+                with tfs_utils.RequestProfile(model_name or self._tfs_default_model_name):
+                    self._handle_invocation_post(req, res, model_name)
+            else:
+                self._handle_invocation_post(req, res, model_name)
         else:
             data = json.loads(req.stream.read().decode("utf-8"))
             self._handle_load_model_post(res, data)
@@ -136,9 +216,6 @@ class PythonServiceResource:
     def _parse_concat_ports(self, concat_ports):
         return concat_ports.split(",")
 
-    def _pick_port(self, ports):
-        return random.choice(ports)
-
     def _parse_sagemaker_port_range_mme(self, port_range):
         lower, upper = port_range.split("-")
         lower = int(lower)
@@ -156,50 +233,97 @@ class PythonServiceResource:
         grpc_ports = self._tfs_available_ports["grpc_port"]
         return len(rest_ports) > 0 and len(grpc_ports) > 0
 
-    def _update_ports_available(self):
+    def _update_ports_available(self, loading_models=None):
         self._tfs_available_ports = copy.deepcopy(self._tfs_ports)
-        for _, tf_status_list in self._mme_tfs_instances_status.items():
-            for tf_status in tf_status_list:
-                if tf_status.rest_port in self._tfs_available_ports["rest_port"]:
-                    self._tfs_available_ports["rest_port"].remove(tf_status.rest_port)
-                if tf_status.grpc_port in self._tfs_available_ports["grpc_port"]:
-                    self._tfs_available_ports["grpc_port"].remove(tf_status.grpc_port)
+        used_ports = [
+            (tf_status.rest_port, tf_status.grpc_port)
+            for tf_status_list in self._mme_tfs_instances_status.values()
+            for tf_status in tf_status_list
+        ]
+        # ports reserved by models that are still loading in any worker
+        for loading_model in (loading_models or {}).values():
+            used_ports.extend(tuple(ports) for ports in loading_model["ports"])
+        for rest_port, grpc_port in used_ports:
+            if rest_port in self._tfs_available_ports["rest_port"]:
+                self._tfs_available_ports["rest_port"].remove(rest_port)
+            if grpc_port in self._tfs_available_ports["grpc_port"]:
+                self._tfs_available_ports["grpc_port"].remove(grpc_port)
         log.info(f"available ports : {self._tfs_available_ports}")
 
-    def _load_model(self, model_name, base_path, rest_port, grpc_port, model_index):
-        if self.validate_model_dir(base_path):
-            try:
-                self._import_custom_modules(model_name)
-                tfs_config = tfs_utils.create_tfs_config_individual_model(model_name, base_path)
-                tfs_config_file = "/sagemaker/tfs-config/{}/{}/model-config.cfg".format(
-                    model_name, model_index
-                )
-                log.info("tensorflow serving model config: \n%s\n", tfs_config)
-                os.makedirs(os.path.dirname(tfs_config_file))
-                with open(tfs_config_file, "w", encoding="utf8") as f:
-                    f.write(tfs_config)
+    def _read_loading_models(self):
+        """Models being loaded by any worker, with the worker pid and the ports reserved"""
+        if not os.path.exists(MME_LOADING_MODELS_FILE):
+            return {}
+        with open(MME_LOADING_MODELS_FILE, "r", encoding="utf8") as f:
+            loading_models = json.load(f)
+        # drop reservations of workers that died while loading
+        return {
+            model_name: loading_model
+            for model_name, loading_model in loading_models.items()
+            if self._check_pid(loading_model["pid"])
+        }
 
-                batching_config_file = "/sagemaker/batching/{}/{}/batching-config.cfg".format(
-                    model_name, model_index
-                )
-                if self._tfs_enable_batching:
-                    tfs_utils.create_batching_config(batching_config_file)
-
-                cmd = tfs_utils.tfs_command(
-                    grpc_port,
-                    rest_port,
-                    tfs_config_file,
-                    self._tfs_enable_batching,
-                    batching_config_file,
-                    tfs_intra_op_parallelism=self._tfs_intra_op_parallelism,
-                    tfs_inter_op_parallelism=self._tfs_inter_op_parallelism,
-                )
-                log.info("MME starts tensorflow serving with command: {}".format(cmd))
-                p = subprocess.Popen(cmd.split())
+    def _write_loading_models(self, loading_models):
+        with open(MME_LOADING_MODELS_FILE, "w", encoding="utf8") as f:
+            json.dump(loading_models, f)
 
-                tfs_utils.wait_for_model(rest_port, model_name, self._tfs_wait_time_seconds, p.pid)
+    def _start_tfs_instance(self, model_name, base_path, rest_port, grpc_port, model_index):
+        tfs_config = tfs_utils.create_tfs_config_individual_model(model_name, base_path)
+        tfs_config_file = "/sagemaker/tfs-config/{}/{}/model-config.cfg".format(
+            model_name, model_index
+        )
+        log.info("tensorflow serving model config: \n%s\n", tfs_config)
+        os.makedirs(os.path.dirname(tfs_config_file))
+        with open(tfs_config_file, "w", encoding="utf8") as f:
+            f.write(tfs_config)
 
-                log.info("started tensorflow serving (pid: %d)", p.pid)
+        batching_config_file = "/sagemaker/batching/{}/{}/batching-config.cfg".format(
+            model_name, model_index
+        )
+        if self._tfs_enable_batching:
+            tfs_utils.create_batching_config(batching_config_file)
+
+        cmd = tfs_utils.tfs_command(
+            grpc_port,
+            rest_port,
+            tfs_config_file,
+            self._tfs_enable_batching,
+            batching_config_file,
+            tfs_intra_op_parallelism=self._tfs_intra_op_parallelism,
+            tfs_inter_op_parallelism=self._tfs_inter_op_parallelism,
+        )
+        log.info("MME starts tensorflow serving with command: {}".format(cmd))
+        p = subprocess.Popen(cmd.split())
+        log.info("started tensorflow serving (pid: %d)", p.pid)
+        return p
+
+    def _load_model(self, model_name, base_path, instance_ports):
+        """Start one TFS instance per (rest_port, grpc_port) pair at once and wait for all of
+        them to be ready within the same deadline"""
+        if self.validate_model_dir(base_path):
+            pids = []
+            try:
+                self._import_custom_modules(model_name)
+                for model_index, (rest_port, grpc_port) in enumerate(instance_ports):
+                    p = self._start_tfs_instance(
+                        model_name, base_path, rest_port, grpc_port, model_index
+                    )
+                    pids.append(p.pid)
+
+                deadline = time.time() + self._tfs_wait_time_seconds
+                with ThreadPoolExecutor(max_workers=len(instance_ports)) as executor:
+                    futures = [
+                        executor.submit(
+                            tfs_utils.wait_for_model,
+                            rest_port,
+                            model_name,
+                            max(1, int(deadline - time.time())),
+                            pid,
+                        )
+                        for (rest_port, _), pid in zip(instance_ports, pids)
+                    ]
+                    for future in futures:
+                        future.result()
 
                 return {
                     "status": falcon.HTTP_200,
@@ -207,17 +331,21 @@ class PythonServiceResource:
                         {
                             "success": "Successfully loaded model {}, "
                             "listening on rest port {} "
-                            "and grpc port {}.".format(model_name, rest_port, grpc_port)
+                            "and grpc port {}.".format(
+                                model_name,
+                                ",".join(str(rest_port) for rest_port, _ in instance_ports),
+                                ",".join(str(grpc_port) for _, grpc_port in instance_ports),
+                            )
                         },
                     ),
-                    "pid": p.pid,
+                    "pids": pids,
                 }
             except MultiModelException as multi_model_exception:
                 if multi_model_exception.code == 409:
                     return {
                         "status": falcon.HTTP_409,
                         "body": multi_model_exception.msg,
-                        "pid": multi_model_exception.pid,
+                        "pids": pids,
                     }
                 elif multi_model_exception.code == 408:
                     cpu_memory_usage = tfs_utils.get_cpu_memory_util()
@@ -226,18 +354,18 @@ class PythonServiceResource:
                         return {
                             "status": falcon.HTTP_507,
                             "body": "Memory exhausted: not enough memory to start TFS instance",
-                            "pid": multi_model_exception.pid,
+                            "pids": pids,
                         }
                     return {
                         "status": falcon.HTTP_408,
                         "body": multi_model_exception.msg,
-                        "pid": multi_model_exception.pid,
+                        "pids": pids,
                     }
                 else:
                     return {
                         "status": falcon.HTTP_500,
                         "body": multi_model_exception.msg,
-                        "pid": multi_model_exception.pid,
+                        "pids": pids,
                     }
             except FileExistsError as e:
                 return {
@@ -245,6 +373,7 @@ class PythonServiceResource:
                     "body": json.dumps(
                         {"error": "Model {} is already loaded. {}".format(model_name, str(e))}
                     ),
+                    "pids": pids,
                 }
             except OSError as os_error:
                 log.error(f"failed to load model with exception {os_error}")
@@ -252,11 +381,13 @@ class PythonServiceResource:
                     return {
                         "status": falcon.HTTP_507,
                         "body": "Memory exhausted: not enough memory to start TFS instance",
+                        "pids": pids,
                     }
                 else:
                     return {
                         "status": falcon.HTTP_500,
                         "body": os_error.strerror,
+                        "pids": pids,
                     }
         else:
             return {
@@ -268,16 +399,20 @@ class PythonServiceResource:
                         )
                     }
                 ),
+                "pids": [],
             }
 
-    def _handle_load_model_post(self, res, data):  # noqa: C901
-        with lock():
-            model_name = data["model_name"]
-            base_path = data["url"]
+    def _handle_load_model_post(self, res, data):
+        model_name = data["model_name"]
+        base_path = data["url"]
 
+        # only reserve ports under the lock, so that loading other models is not blocked
+        # while the TFS instances of this one start
+        with lock():
             # sync sync_local_mme_instance_status & update available ports
             self._sync_local_mme_instance_status()
-            self._update_ports_available()
+            loading_models = self._read_loading_models()
+            self._update_ports_available(loading_models)
             self._sync_model_handlers()
 
             # model is already loaded
@@ -285,42 +420,187 @@ class PythonServiceResource:
                 res.status = falcon.HTTP_409
                 res.body = json.dumps({"error": "Model {} is already loaded.".format(model_name)})
                 return
+            if model_name in loading_models:
+                res.status = falcon.HTTP_409
+                res.body = json.dumps(
+                    {"error": "Model {} is already being loaded.".format(model_name)}
+                )
+                return
+
+            if not self._admit_model(model_name, base_path, loading_models):
+                res.status = falcon.HTTP_507
+                res.body = json.dumps(
+                    {"error": "Memory exhausted: not enough memory to load the model."}
+                )
+                return
 
-            is_load_successful = True
-            response = {}
-            for i in range(self._tfs_instance_count):
+            instance_ports = []
+            for _ in range(self._tfs_instance_count):
                 # check if there are available ports
                 if not self._ports_available():
-                    is_load_successful = False
-                    response["status"] = falcon.HTTP_507
-                    response["body"] = json.dumps(
+                    res.status = falcon.HTTP_507
+                    res.body = json.dumps(
                         {"error": "Memory exhausted: no available ports to load the model."}
                     )
-                    break
-                tfs_rest_port = self._tfs_available_ports["rest_port"].pop()
-                tfs_grpc_port = self._tfs_available_ports["grpc_port"].pop()
-
-                response = self._load_model(model_name, base_path, tfs_rest_port, tfs_grpc_port, i)
-
-                if "pid" in response:
-                    self._mme_tfs_instances_status.setdefault(model_name, []).append(
-                        TfsInstanceStatus(tfs_rest_port, tfs_grpc_port, response["pid"])
+                    return
+                instance_ports.append(
+                    (
+                        self._tfs_available_ports["rest_port"].pop(),
+                        self._tfs_available_ports["grpc_port"].pop(),
                     )
+                )
+            loading_models[model_name] = {"pid": os.getpid(), "ports": instance_ports}
+            self._write_loading_models(loading_models)
+
+        start = time.time()
+        response = self._load_model(model_name, base_path, instance_ports)
+        load_seconds = time.time() - start
+        log.info(
+            "model load latency: model={} instances={} status={} seconds={:.3f}".format(
+                model_name, len(instance_ports), response["status"], load_seconds
+            )
+        )
+        tfs_utils.log_metrics(
+            {"ModelLoadLatency": round(load_seconds, 3)},
+            dimensions={"Status": response["status"].split(" ", 1)[0]},
+            properties={"Model": model_name, "Instances": len(instance_ports)},
+        )
 
-                if response["status"] != falcon.HTTP_200:
-                    log.info(f"Failed to load model : {model_name}")
+        with lock():
+            # other workers may have loaded or unloaded models in the meantime
+            self._sync_local_mme_instance_status()
+            is_load_successful = response["status"] == falcon.HTTP_200
+            if is_load_successful:
+                self._mme_tfs_instances_status[model_name] = [
+                    TfsInstanceStatus(rest_port, grpc_port, pid)
+                    for (rest_port, grpc_port), pid in zip(instance_ports, response["pids"])
+                ]
+                # the ports may have served an evicted model, do not inherit its last use
+                for rest_port, _ in instance_ports:
+                    self._last_used.touch(rest_port)
+                try:
+                    self._upload_mme_instance_status()
+                except MultiModelException as multi_model_exception:
                     is_load_successful = False
-                    break
+                    response["status"] = falcon.HTTP_507
+                    response["body"] = json.dumps({"error": multi_model_exception.msg})
 
             if not is_load_successful:
                 log.info(f"Failed to load model : {model_name}, Starting to cleanup...")
-                self._delete_model(model_name)
+                for pid in response["pids"]:
+                    self._kill_tfs_process(pid)
                 self._remove_model_config(model_name)
-            else:
-                self._upload_mme_instance_status()
+                # the registry was not updated, so drop the local entry as well
+                self._mme_tfs_instances_status.pop(model_name, None)
+
+            loading_models = self._read_loading_models()
+            loading_models.pop(model_name, None)
+            self._write_loading_models(loading_models)
+
+        res.status = response["status"]
+        res.body = response["body"]
+
+    def _admit_model(self, model_name, base_path, loading_models):
+        """Check that the model fits in memory (when SAGEMAKER_MME_MAX_MEMORY_UTILIZATION is set)
+        and ports, evicting the least recently used idle models to make room when
+        SAGEMAKER_MME_LRU_EVICTION is enabled. Must hold lock()."""
+        if MME_MAX_MEMORY_UTILIZATION is None and not MME_LRU_EVICTION_ENABLED:
+            return True
+        required_bytes = 0
+        if MME_MAX_MEMORY_UTILIZATION is not None:
+            # TFS memory usage roughly follows the size of the SavedModel on disk
+            required_bytes = tfs_utils.get_model_size_bytes(base_path) * self._tfs_instance_count
+        free_ports = min(
+            len(self._tfs_available_ports["rest_port"]),
+            len(self._tfs_available_ports["grpc_port"]),
+        )
+        # without eviction, running out of ports is reported by the caller as before
+        victims = tfs_utils.plan_model_admission(
+            required_bytes,
+            self._tfs_instance_count if MME_LRU_EVICTION_ENABLED else 0,
+            free_ports,
+            self._eviction_candidates() if MME_LRU_EVICTION_ENABLED else [],
+            MME_MAX_MEMORY_UTILIZATION,
+        )
+        if victims is None:
+            log.info(
+                "rejecting model {}: {} MiB and {} ports required, {}% memory used, {} free "
+                "ports, even after evicting every idle model".format(
+                    model_name,
+                    required_bytes >> 20,
+                    self._tfs_instance_count,
+                    tfs_utils.get_cpu_memory_util(),
+                    free_ports,
+                )
+            )
+            return False
+        if not victims:
+            return True
+        if not self._evict_models(victims, model_name):
+            return False
+        self._update_ports_available(loading_models)
+        return True
+
+    def _eviction_candidates(self):
+        """(model name, TFS pids) of the loaded models without in-flight requests, least
+        recently used first"""
+        idle_models = [
+            model_name
+            for model_name, tfs_status_list in self._mme_tfs_instances_status.items()
+            if all(self._in_flight.get(tfs_status.rest_port) == 0 for tfs_status in tfs_status_list)
+        ]
+        idle_models.sort(
+            key=lambda model_name: max(
+                self._last_used.get(tfs_status.rest_port)
+                for tfs_status in self._mme_tfs_instances_status[model_name]
+            )
+        )
+        return [
+            (
+                model_name,
+                [tfs_status.pid for tfs_status in self._mme_tfs_instances_status[model_name]],
+            )
+            for model_name in idle_models
+        ]
+
+    def _evict_models(self, victims, model_name):
+        """Unload the victims, unless one of them received a request since it was picked.
+
+        Invocations count themselves as in flight before checking that their model is still
+        loaded, so the victims are unpublished first and their in-flight counts checked after:
+        either the invocation sees the model gone, or the eviction sees the invocation. Must
+        hold lock()."""
+        evicted = {victim: self._mme_tfs_instances_status.pop(victim) for victim in victims}
+        self._upload_mme_instance_status()
+        busy = [
+            victim
+            for victim, tfs_status_list in evicted.items()
+            if any(self._in_flight.get(tfs_status.rest_port) for tfs_status in tfs_status_list)
+        ]
+        if busy:
+            log.info(
+                "not evicting models {} to load model {}: {} received requests meanwhile".format(
+                    victims, model_name, busy
+                )
+            )
+            self._mme_tfs_instances_status.update(evicted)
+            self._upload_mme_instance_status()
+            return False
 
-            res.status = response["status"]
-            res.body = response["body"]
+        for victim, tfs_status_list in evicted.items():
+            rss_bytes = sum(
+                tfs_utils.get_process_rss_bytes(tfs_status.pid) for tfs_status in tfs_status_list
+            )
+            log.info(
+                "evicting least recently used model {} (rss: {} MiB) to load model {}".format(
+                    victim, rss_bytes >> 20, model_name
+                )
+            )
+            for tfs_status in tfs_status_list:
+                self._kill_tfs_process(tfs_status.pid)
+                self._tfs_sessions.evict(tfs_status.rest_port)
+            self._remove_model_config(victim)
+        return True
 
     def _import_custom_modules(self, model_name):
         inference_script_path = "/opt/ml/models/{}/model/code/inference.py".format(model_name)
@@ -358,11 +638,8 @@ class PythonServiceResource:
         if SAGEMAKER_MULTI_MODEL_ENABLED:
             if model_name:
                 if self._gunicorn_workers > 1:
-                    if model_name not in self._mme_tfs_instances_status or not self._check_pid(
-                        self._mme_tfs_instances_status[model_name][0].pid
-                    ):
-                        with lock():
-                            self._sync_local_mme_instance_status()
+                    # lock-free: only decodes the registry if another worker updated it
+                    if self._sync_local_mme_instance_status():
                         self._sync_model_handlers()
 
                 if model_name not in self._mme_tfs_instances_status:
@@ -372,61 +649,107 @@ class PythonServiceResource:
                     )
                     return
                 else:
-                    log.info("model name: {}".format(model_name))
-                    rest_ports = [
-                        status.rest_port for status in self._mme_tfs_instances_status[model_name]
-                    ]
-                    rest_port = self._pick_port(rest_ports)
-                    log.info("rest port: {}".format(str(rest_port)))
-                    grpc_ports = [
-                        status.grpc_port for status in self._mme_tfs_instances_status[model_name]
-                    ]
-                    grpc_port = grpc_ports[rest_ports.index(rest_port)]
-                    log.info("grpc port: {}".format(str(grpc_port)))
-                    data, context = tfs_utils.parse_request(
-                        req,
-                        rest_port,
-                        grpc_port,
-                        self._tfs_default_model_name,
-                        model_name=model_name,
+                    log.debug("model name: {}".format(model_name))
+                    instance = self._router.pick(
+                        [
+                            tfs_router.TfsInstance(status.rest_port, status.grpc_port)
+                            for status in self._mme_tfs_instances_status[model_name]
+                        ]
                     )
+                    release = self._router.acquire(instance)
+                    # evictions unpublish a model before checking its in-flight requests, so
+                    # once counted, the instance is either still published or not evicted
+                    if self._gunicorn_workers > 1:
+                        self._sync_local_mme_instance_status()
+                    if instance.rest_port not in [
+                        status.rest_port
+                        for status in self._mme_tfs_instances_status.get(model_name, [])
+                    ]:
+                        release()
+                        res.status = falcon.HTTP_404
+                        res.body = json.dumps(
+                            {"error": "Model {} is not loaded yet.".format(model_name)}
+                        )
+                        return
+                    self._last_used.touch(instance.rest_port)
+                    log.debug("rest port: {}".format(str(instance.rest_port)))
+                    log.debug("grpc port: {}".format(str(instance.grpc_port)))
             else:
                 res.status = falcon.HTTP_400
                 res.body = json.dumps({"error": "Invocation request does not contain model name."})
                 return
         else:
-            # Randomly pick port used for routing incoming request.
-            grpc_port = self._pick_port(self._tfs_grpc_ports)
-            rest_port = self._pick_port(self._tfs_rest_ports)
-            data, context = tfs_utils.parse_request(
-                req,
-                rest_port,
-                grpc_port,
-                self._tfs_default_model_name,
-                channel=self._channels[grpc_port],
-            )
+            # Pick the TFS instance used for routing incoming request.
+            instance = self._router.pick(self._tfs_instances)
+            release = self._router.acquire(instance)
+
+        try:
+            body = self._invoke(req, res, model_name, instance)
+            if isinstance(body, tfs_utils.StreamingResponse):
+                # the request is only done once the TFS response is relayed to the client
+                body.on_close(release)
+                profile = tfs_utils.RequestProfile.active()
+                if profile:
+                    body.on_close(profile.defer())
+                release = None
+        finally:
+            if release:
+                release()
+
+    def _invoke(self, req, res, model_name, instance):
+        """Run the handlers, returns the response body"""
+        with tfs_utils.profile_phase("parse"):
+            if SAGEMAKER_MULTI_MODEL_ENABLED:
+                data, context = tfs_utils.parse_request(
+                    req,
+                    instance.rest_port,
+                    instance.grpc_port,
+                    self._tfs_default_model_name,
+                    model_name=model_name,
+                    session=self._tfs_sessions.get(instance.rest_port),
+                )
+            else:
+                data, context = tfs_utils.parse_request(
+                    req,
+                    instance.rest_port,
+                    instance.grpc_port,
+                    self._tfs_default_model_name,
+                    channel=self._channels[instance.grpc_port],
+                    session=self._tfs_sessions.get(instance.rest_port),
+                )
 
         try:
             res.status = falcon.HTTP_200
             handlers = self._handlers
             if SAGEMAKER_MULTI_MODEL_ENABLED and model_name in self.model_handlers:
-                log.info(
+                log.debug(
                     "Model-specific inference script for the model {} exists, importing handlers.".format(
                         model_name
                     )
                 )
                 handlers = self.model_handlers[model_name]
             elif not self._default_handlers_enabled:
-                log.info(
+                log.debug(
                     "Universal inference script exists at path {}, importing handlers.".format(
                         INFERENCE_SCRIPT_PATH
                     )
                 )
             else:
-                log.info(
+                log.debug(
                     "Model-specific inference script and universal inference script both do not exist, using default handlers."
                 )
-            res.body, res.content_type = handlers(data, context)
+                if self._grpc_predict_handler and tfs_grpc.grpc_predict_requested(
+                    tfs_utils.parse_tfs_custom_attributes(req), SAGEMAKER_TFS_GRPC_PREDICT_ENABLED
+                ):
+                    handlers = self._grpc_predict_handler
+            with tfs_utils.profile_phase("handler"):
+                body, res.content_type = handlers(data, context)
+            if isinstance(body, tfs_utils.StreamingResponse):
+                res.stream = body
+                res.content_length = body.content_length
+            else:
+                res.body = body
+            return body
         except Exception as e:  # pylint: disable=broad-except
             log.exception("exception handling request: {}".format(e))
             res.status = falcon.HTTP_500
@@ -458,9 +781,11 @@ class PythonServiceResource:
             return custom_handler
 
         def handler(data, context):
-            processed_input = custom_input_handler(data, context)
-            response = requests.post(context.rest_uri, data=processed_input)
-            return custom_output_handler(response, context)
+            with tfs_utils.profile_phase("serialization"):
+                processed_input = custom_input_handler(data, context)
+            response = context.session.post(context.rest_uri, data=processed_input)
+            with tfs_utils.profile_phase("serialization"):
+                return custom_output_handler(response, context)
 
         return handler
 
@@ -526,7 +851,14 @@ class PythonServiceResource:
         if model_name not in self._mme_tfs_instances_status:
             return
         for tfs_status in self._mme_tfs_instances_status[model_name]:
-            os.kill(tfs_status.pid, signal.SIGKILL)
+            self._kill_tfs_process(tfs_status.pid)
+            self._tfs_sessions.evict(tfs_status.rest_port)
+
+    def _kill_tfs_process(self, pid):
+        try:
+            os.kill(pid, signal.SIGKILL)
+        except ProcessLookupError:
+            log.info("tensorflow serving (pid: {}) already exited".format(pid))
 
     def _remove_model_config(self, model_name):
         shutil.rmtree("/sagemaker/tfs-config/{}".format(model_name), ignore_errors=True)
@@ -555,25 +887,36 @@ class PythonServiceResource:
         return False
 
     def _upload_mme_instance_status(self):
+        table = {
+            model_name: [vars(tfs_status) for tfs_status in tfs_status_list]
+            for model_name, tfs_status_list in self._mme_tfs_instances_status.items()
+        }
+        self._mme_registry_generation = self._mme_registry.write(table)
         log.info(
-            "uploaded mme instance status file with content: {}".format(
-                self._mme_tfs_instances_status
+            "uploaded mme instance status generation {} with content: {}".format(
+                self._mme_registry_generation, self._mme_tfs_instances_status
             )
         )
-        with open(MME_TFS_INSTANCE_STATUS_FILE, "wb") as handle:
-            pickle.dump(self._mme_tfs_instances_status, handle, protocol=pickle.HIGHEST_PROTOCOL)
 
     def _sync_local_mme_instance_status(self):
-        if not os.path.exists(MME_TFS_INSTANCE_STATUS_FILE):
-            log.info("mme instance status file does not found.")
-            return
-        with open(MME_TFS_INSTANCE_STATUS_FILE, "rb") as handle:
-            self._mme_tfs_instances_status = pickle.load(handle)
+        """Refresh the local copy of the mme instance status, returns whether it changed"""
+        if self._mme_registry.generation() == self._mme_registry_generation:
+            return False
+        snapshot = self._mme_registry.read()
+        if snapshot is None:
+            log.warning("mme instance status is being updated, keeping local status.")
+            return False
+        self._mme_registry_generation, table = snapshot
+        self._mme_tfs_instances_status = {
+            model_name: [TfsInstanceStatus(**tfs_status) for tfs_status in tfs_status_list]
+            for model_name, tfs_status_list in table.items()
+        }
         log.info(
-            "updated local mme instance status with content: {}".format(
-                self._mme_tfs_instances_status
+            "updated local mme instance status to generation {} with content: {}".format(
+                self._mme_registry_generation, self._mme_tfs_instances_status
             )
         )
+        return True
 
     def _sync_model_handlers(self):
         for model_name, _ in self._mme_tfs_instances_status.items():
@@ -663,6 +1006,15 @@ if __name__ == "__main__":
             f'SAGEMAKER_TFS_INTRA_OP_PARALLELISM={os.environ.get("SAGEMAKER_TFS_INTRA_OP_PARALLELISM", 0)}',
             f'SAGEMAKER_TFS_INSTANCE_COUNT={os.environ.get("SAGEMAKER_TFS_INSTANCE_COUNT", "1")}',
             f'SAGEMAKER_GUNICORN_WORKERS={os.environ.get("SAGEMAKER_GUNICORN_WORKERS", "1")}',
+            f"SAGEMAKER_TFS_SESSION_POOL_SIZE={TFS_SESSION_POOL_SIZE}",
+            f"SAGEMAKER_TFS_SESSION_POOL_BLOCK={str(TFS_SESSION_POOL_BLOCK).lower()}",
+            f"SAGEMAKER_TFS_GRPC_PREDICT={str(SAGEMAKER_TFS_GRPC_PREDICT_ENABLED).lower()}",
+            f"SAGEMAKER_TFS_GRPC_TIMEOUT_SECONDS={TFS_GRPC_TIMEOUT_SECONDS}",
+            f"SAGEMAKER_TFS_ROUTING_POLICY={TFS_ROUTING_POLICY}",
+            f'SAGEMAKER_MME_MAX_MEMORY_UTILIZATION={os.environ.get("SAGEMAKER_MME_MAX_MEMORY_UTILIZATION", "")}',
+            f"SAGEMAKER_MME_LRU_EVICTION={str(MME_LRU_EVICTION_ENABLED).lower()}",
+            f"SAGEMAKER_TFS_PROFILE_REQUESTS={str(TFS_PROFILE_REQUESTS).lower()}",
+            f"SAGEMAKER_TFS_STREAMING={str(TFS_STREAMING_ENABLED).lower()}",
         ],
     }
 
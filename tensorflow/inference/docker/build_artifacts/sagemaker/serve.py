@@ -16,10 +16,10 @@ import os
 import re
 import signal
 import subprocess
+import tfs_batching_tuner
+import tfs_readiness
 import tfs_utils
 
-from contextlib import contextmanager
-
 logging.basicConfig(
     format="%(process)d %(asctime)s %(levelname)-8s %(message)s", force=True, level=logging.INFO
 )
@@ -42,6 +42,7 @@ INFERENCE_PATH = os.path.join(CODE_DIR, "inference.py")
 class ServiceManager(object):
     def __init__(self):
         self._state = "initializing"
+        self._timeline = tfs_readiness.StartupTimeline()
         self._nginx = None
         self._tfs = []
         self._gunicorn = None
@@ -102,6 +103,9 @@ class ServiceManager(object):
         if _enable_batching not in ["true", "false"]:
             raise ValueError("SAGEMAKER_TFS_ENABLE_BATCHING must be 'true' or 'false'")
         self._tfs_enable_batching = _enable_batching == "true"
+        self._tfs_batching_autotune = (
+            os.environ.get("SAGEMAKER_TFS_BATCHING_AUTOTUNE", "false").lower() == "true"
+        )
 
         if _enable_multi_model_endpoint not in ["true", "false"]:
             raise ValueError("SAGEMAKER_MULTI_MODEL must be 'true' or 'false'")
@@ -194,6 +198,35 @@ class ServiceManager(object):
         with open(self._tfs_config_path, "w", encoding="utf8") as f:
             f.write(config)
 
+    def _tune_batching(self):
+        tuner = tfs_batching_tuner.BatchingTuner(
+            lambda: self._start_single_tfs(0),
+            self._tfs_rest_ports[0],
+            self._tfs_default_model_name,
+            self._tfs_batching_config_path,
+            p99_budget_ms=float(os.environ.get("SAGEMAKER_TFS_BATCHING_AUTOTUNE_P99_MS", 100)),
+            duration_seconds=float(
+                os.environ.get("SAGEMAKER_TFS_BATCHING_AUTOTUNE_DURATION_SECONDS", 3)
+            ),
+            concurrency=int(os.environ.get("SAGEMAKER_TFS_BATCHING_AUTOTUNE_CONCURRENCY", 32)),
+            wait_time_seconds=self._tfs_wait_time_seconds,
+            sample_request_file=os.environ.get("SAGEMAKER_TFS_BATCHING_AUTOTUNE_SAMPLE_REQUEST"),
+            max_seconds=(
+                float(os.environ["SAGEMAKER_TFS_BATCHING_AUTOTUNE_MAX_SECONDS"])
+                if "SAGEMAKER_TFS_BATCHING_AUTOTUNE_MAX_SECONDS" in os.environ
+                else None
+            ),
+        )
+        try:
+            tuned_parameters = tuner.tune()
+        except Exception as e:  # pylint: disable=broad-except
+            # a failed sweep must not keep the endpoint from starting
+            log.exception(
+                "batching auto-tune failed, using the default batching config: {}".format(e)
+            )
+            tuned_parameters = None
+        tfs_utils.create_batching_config(self._tfs_batching_config_path, tuned_parameters)
+
     def _setup_gunicorn(self):
         python_path_content = []
         python_path_option = ""
@@ -389,28 +422,39 @@ class ServiceManager(object):
         log.info("stopped")
 
     def _wait_for_gunicorn(self):
-        while True:
-            if os.path.exists("/tmp/gunicorn.sock"):
-                log.info("gunicorn server is ready!")
-                return
+        # woken up by inotify when gunicorn binds its socket, fails fast if gunicorn dies
+        tfs_readiness.wait_for_path(
+            "/tmp/gunicorn.sock",
+            self._gunicorn_timeout_seconds,
+            pid=self._gunicorn.pid,
+            name="gunicorn",
+        )
+        log.info("gunicorn server is ready!")
 
     def _wait_for_tfs(self):
         for i in range(self._tfs_instance_count):
             tfs_utils.wait_for_model(
-                self._tfs_rest_ports[i], self._tfs_default_model_name, self._tfs_wait_time_seconds
+                self._tfs_rest_ports[i],
+                self._tfs_default_model_name,
+                self._tfs_wait_time_seconds,
+                pid=self._tfs[i].pid,
             )
 
-    @contextmanager
-    def _timeout(self, seconds):
-        def _raise_timeout_error(signum, frame):
-            raise TimeoutError("time out after {} seconds".format(seconds))
-
+    def _wait_for_nginx(self):
+        """Return whether nginx accepts connections"""
         try:
-            signal.signal(signal.SIGALRM, _raise_timeout_error)
-            signal.alarm(seconds)
-            yield
-        finally:
-            signal.alarm(0)
+            tfs_readiness.wait_for_port(
+                self._nginx_http_port,
+                self._nginx_proxy_read_timeout_seconds,
+                pid=self._nginx.pid,
+                name="nginx",
+            )
+            log.info("nginx is ready!")
+            return True
+        except (TimeoutError, tfs_readiness.ProcessExitedError) as error:
+            # the monitor restarts nginx if it exited
+            log.warning("nginx is not ready: {}".format(error))
+            return False
 
     def _is_tfs_process(self, pid):
         for p in self._tfs:
@@ -500,8 +544,13 @@ class ServiceManager(object):
             log.info("multi-model endpoint is enabled, TFS model servers will be started later")
         else:
             self._create_tfs_config()
+            if self._tfs_enable_batching and self._tfs_batching_autotune:
+                self._tune_batching()
+                self._timeline.mark("batching_tuned")
             self._start_tfs()
+            self._timeline.mark("tfs_spawned")
             self._wait_for_tfs()
+            self._timeline.mark("tfs_model_available")
 
         self._create_nginx_config()
 
@@ -509,10 +558,21 @@ class ServiceManager(object):
             self._setup_gunicorn()
             self._start_gunicorn()
             # make sure gunicorn is up
-            with self._timeout(seconds=self._gunicorn_timeout_seconds):
-                self._wait_for_gunicorn()
+            self._wait_for_gunicorn()
+            self._timeline.mark("gunicorn_ready")
 
         self._start_nginx()
+        if self._wait_for_nginx():
+            self._timeline.mark("nginx_ready")
+        else:
+            self._timeline.mark("nginx_unready")
+        self._timeline.log_summary()
+        tfs_utils.log_metrics(
+            self._timeline.events(),
+            dimensions={
+                "Mode": "multi-model" if self._tfs_enable_multi_model_endpoint else "single-model"
+            },
+        )
         self._state = "started"
         self._monitor()
         self._stop()
@@ -0,0 +1,278 @@
+# Copyright 2020 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"). You
+# may not use this file except in compliance with the License. A copy of
+# the License is located at
+#
+#     http://aws.amazon.com/apache2.0/
+#
+# or in the "license" file accompanying this file. This file is
+# distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF
+# ANY KIND, either express or implied. See the License for the specific
+# language governing permissions and limitations under the License.
+import itertools
+import json
+import logging
+import multiprocessing
+import os
+import threading
+import time
+
+import requests
+import tfs_utils
+
+log = logging.getLogger(__name__)
+
+DEFAULT_RESULTS_FILE = "/sagemaker/batching-autotune.json"
+MAX_BATCH_SIZES = (8, 16, 32, 64)
+BATCH_TIMEOUTS_MICROS = (1000, 5000, 20000)
+# swept as multiples of the number of CPUs
+NUM_BATCH_THREADS_PER_CPU = (0.5, 1, 2)
+MAX_ENQUEUED_BATCHES_PER_CPU = (1, 4)
+
+# the parameters swept in each stage, the later stages keep the parameters chosen before them
+SWEEP_STAGES = (
+    ("max_batch_size", "batch_timeout_micros"),
+    ("num_batch_threads", "max_enqueued_batches"),
+)
+PARAMETER_ENV_VARS = {
+    "max_batch_size": "SAGEMAKER_TFS_MAX_BATCH_SIZE",
+    "batch_timeout_micros": "SAGEMAKER_TFS_BATCH_TIMEOUT_MICROS",
+    "num_batch_threads": "SAGEMAKER_TFS_NUM_BATCH_THREADS",
+    "max_enqueued_batches": "SAGEMAKER_TFS_MAX_ENQUEUED_BATCHES",
+}
+
+# placeholder values used to fill synthetic requests, per TFS dtype
+_SYNTHETIC_VALUES = {
+    "DT_STRING": "",
+    "DT_BOOL": False,
+    "DT_FLOAT": 0.0,
+    "DT_DOUBLE": 0.0,
+    "DT_HALF": 0.0,
+}
+
+
+def synthetic_request(metadata, signature_name="serving_default"):
+    """A one row predict request built from the model signature returned by the TFS
+    /metadata REST API. Unknown dimensions other than the batch dimension are set to 1."""
+    signature = metadata["metadata"]["signature_def"]["signature_def"][signature_name]
+    instance = {}
+    for name, tensor_info in signature["inputs"].items():
+        dims = [int(dim["size"]) for dim in tensor_info.get("tensor_shape", {}).get("dim", [])]
+        value = _SYNTHETIC_VALUES.get(tensor_info["dtype"], 0)
+        # the first dimension is the batch, a row has the remaining dimensions
+        for size in reversed(dims[1:]):
+            value = [value] * (size if size > 0 else 1)
+        instance[name] = value
+    if len(instance) == 1:
+        return {"signature_name": signature_name, "instances": list(instance.values())}
+    return {"signature_name": signature_name, "instances": [instance]}
+
+
+def measure(uri, body, concurrency, duration_seconds):
+    """Send the request from concurrency threads for duration_seconds, returns the throughput
+    in requests per second, the p50 and p99 latencies in milliseconds and the error count"""
+    latencies = []
+    errors = [0]
+    lock = threading.Lock()
+    deadline = time.time() + duration_seconds
+
+    def worker():
+        local_latencies, local_errors = [], 0
+        with requests.Session() as session:
+            while time.time() < deadline:
+                start = time.perf_counter()
+                try:
+                    response = session.post(uri, data=body, timeout=30)
+                    if response.status_code != 200:
+                        local_errors += 1
+                        continue
+                except requests.exceptions.RequestException:
+                    local_errors += 1
+                    continue
+                local_latencies.append(time.perf_counter() - start)
+        with lock:
+            latencies.extend(local_latencies)
+            errors[0] += local_errors
+
+    start = time.perf_counter()
+    threads = [threading.Thread(target=worker) for _ in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+
+    latencies.sort()
+
+    def percentile(pct):
+        if not latencies:
+            return float("inf")
+        return latencies[min(len(latencies) - 1, int(len(latencies) * pct / 100))] * 1000
+
+    return len(latencies) / elapsed, percentile(50), percentile(99), errors[0]
+
+
+class BatchingTuner:
+    """Sweeps TFS batching parameters at startup and picks the configuration with the highest
+    throughput whose p99 latency stays within the budget.
+
+    The sweep runs in SWEEP_STAGES: max_batch_size and batch_timeout_micros first, then
+    num_batch_threads and max_enqueued_batches with the batch size and timeout chosen by the
+    first stage. Each candidate restarts tensorflow_model_server with its batching config, since
+    TFS only reads the batching parameters file at startup, and replays a request against it: a
+    recorded request if one is given, otherwise a synthetic one built from the signature.
+    Parameters set through their SAGEMAKER_TFS_* environment variable are not swept, and
+    max_enqueued_batches is not swept for batch transform, which sets it high on purpose.
+    If max_seconds is set, the sweep stops before the candidate that would exceed it and picks
+    the best configuration measured so far.
+    """
+
+    def __init__(
+        self,
+        start_tfs,
+        rest_port,
+        model_name,
+        batching_config_file,
+        p99_budget_ms=100,
+        duration_seconds=3,
+        concurrency=32,
+        wait_time_seconds=55,
+        sample_request_file=None,
+        results_file=DEFAULT_RESULTS_FILE,
+        max_seconds=None,
+    ):
+        self._start_tfs = start_tfs
+        self._rest_port = rest_port
+        self._model_name = model_name
+        self._batching_config_file = batching_config_file
+        self._p99_budget_ms = p99_budget_ms
+        self._duration_seconds = duration_seconds
+        self._concurrency = concurrency
+        self._wait_time_seconds = wait_time_seconds
+        self._sample_request_file = sample_request_file
+        self._results_file = results_file
+        self._max_seconds = max_seconds
+        self._body = None
+
+    def _values(self, key):
+        """The values swept for a batching parameter, None if it keeps its default"""
+        env_var = PARAMETER_ENV_VARS[key]
+        if env_var in os.environ:
+            return (int(os.environ[env_var]),)
+        if key == "max_batch_size":
+            return MAX_BATCH_SIZES
+        if key == "batch_timeout_micros":
+            return BATCH_TIMEOUTS_MICROS
+        if key == "max_enqueued_batches" and "SAGEMAKER_BATCH" in os.environ:
+            return None
+        per_cpu = NUM_BATCH_THREADS_PER_CPU
+        if key == "max_enqueued_batches":
+            per_cpu = MAX_ENQUEUED_BATCHES_PER_CPU
+        cpu_count = multiprocessing.cpu_count()
+        return tuple(sorted({max(1, int(cpu_count * factor)) for factor in per_cpu}))
+
+    def candidates(self, stage=0, chosen=None):
+        """The batching parameters of the candidates of a sweep stage, each one extends the
+        parameters chosen by the previous stages"""
+        keys = [key for key in SWEEP_STAGES[stage] if self._values(key)]
+        return [
+            dict(chosen or {}, **dict(zip(keys, values)))
+            for values in itertools.product(*(self._values(key) for key in keys))
+        ]
+
+    def tune(self):
+        """Run the sweep, write the results file and return the chosen parameters"""
+        results = []
+        chosen = None
+        stopped_early = False
+        start = time.perf_counter()
+        for stage in range(len(SWEEP_STAGES)):
+            candidates = self.candidates(stage, chosen and self._parameters(chosen))
+            if stage > 0 and len(candidates) < 2:
+                # nothing left to compare against the configuration already chosen
+                continue
+            stage_results = []
+            for parameters in candidates:
+                elapsed = time.perf_counter() - start
+                if (
+                    self._max_seconds is not None
+                    and results
+                    and elapsed + elapsed / len(results) > self._max_seconds
+                ):
+                    stopped_early = True
+                    break
+                result = self._run_candidate(parameters)
+                stage_results.append(result)
+                results.append(result)
+            if stage_results:
+                chosen = self._choose(stage_results + ([chosen] if chosen else []))
+            if stopped_early:
+                log.warning(
+                    "batching auto-tune stopped after {} candidates, the time budget of {} "
+                    "seconds is spent".format(len(results), self._max_seconds)
+                )
+                break
+
+        with open(self._results_file, "w", encoding="utf8") as f:
+            json.dump(
+                {
+                    "p99_budget_ms": self._p99_budget_ms,
+                    "stopped_early": stopped_early,
+                    "chosen": chosen,
+                    "results": results,
+                },
+                f,
+                indent=2,
+            )
+        log.info("batching auto-tune chose {}, results in {}".format(chosen, self._results_file))
+        return self._parameters(chosen)
+
+    @staticmethod
+    def _parameters(result):
+        return {key: result[key] for key in PARAMETER_ENV_VARS if key in result}
+
+    def _run_candidate(self, parameters):
+        tfs_utils.create_batching_config(self._batching_config_file, parameters)
+        process = self._start_tfs()
+        try:
+            tfs_utils.wait_for_model(
+                self._rest_port, self._model_name, self._wait_time_seconds, pid=process.pid
+            )
+            if self._body is None:
+                self._body = self._request_body()
+            uri = "http://localhost:{}/v1/models/{}:predict".format(
+                self._rest_port, self._model_name
+            )
+            # warm up, the first requests of a model are much slower
+            measure(uri, self._body, 1, min(1, self._duration_seconds))
+            rps, p50, p99, errors = measure(
+                uri, self._body, self._concurrency, self._duration_seconds
+            )
+        finally:
+            process.kill()
+            process.wait()
+        result = dict(parameters, rps=round(rps, 1), p50_ms=round(p50, 2))
+        result.update(p99_ms=round(p99, 2), errors=errors)
+        log.info("batching sweep: {}".format(result))
+        return result
+
+    def _choose(self, results):
+        valid = [result for result in results if not result["errors"]] or results
+        within_budget = [result for result in valid if result["p99_ms"] <= self._p99_budget_ms]
+        if within_budget:
+            return max(within_budget, key=lambda result: result["rps"])
+        log.warning(
+            "no batching configuration met the p99 budget of {} ms, using the lowest p99".format(
+                self._p99_budget_ms
+            )
+        )
+        return min(valid, key=lambda result: result["p99_ms"])
+
+    def _request_body(self):
+        if self._sample_request_file:
+            with open(self._sample_request_file, "rb") as f:
+                return f.read()
+        uri = "http://localhost:{}/v1/models/{}/metadata".format(self._rest_port, self._model_name)
+        metadata = requests.get(uri, timeout=10).json()
+        return json.dumps(synthetic_request(metadata))
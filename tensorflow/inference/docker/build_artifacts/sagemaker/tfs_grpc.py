@@ -0,0 +1,290 @@
+# Copyright 2020 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"). You
+# may not use this file except in compliance with the License. A copy of
+# the License is located at
+#
+#     http://aws.amazon.com/apache2.0/
+#
+# or in the "license" file accompanying this file. This file is
+# distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF
+# ANY KIND, either express or implied. See the License for the specific
+# language governing permissions and limitations under the License.
+import base64
+import io
+import json
+import logging
+
+import tfs_utils
+
+try:
+    # tensorflow-serving-api is installed without its tensorflow dependency, so the gRPC
+    # predict path is only available when the user brings tensorflow (and numpy) along.
+    import numpy as np
+    from tensorflow.core.framework import tensor_pb2, tensor_shape_pb2, types_pb2
+    from tensorflow_serving.apis import get_model_metadata_pb2, predict_pb2
+    from tensorflow_serving.apis import prediction_service_pb2_grpc
+
+    GRPC_PREDICT_AVAILABLE = True
+except ImportError:
+    GRPC_PREDICT_AVAILABLE = False
+
+log = logging.getLogger(__name__)
+
+JSON_CONTENT_TYPE = "application/json"
+NPY_CONTENT_TYPE = "application/x-npy"
+PROTOBUF_CONTENT_TYPE = "application/x-protobuf"
+SUPPORTED_CONTENT_TYPES = (JSON_CONTENT_TYPE, NPY_CONTENT_TYPE, PROTOBUF_CONTENT_TYPE)
+DEFAULT_SIGNATURE_NAME = "serving_default"
+GRPC_PREDICT_ATTRIBUTE = "tfs-grpc-predict"
+
+if GRPC_PREDICT_AVAILABLE:
+    _NUMPY_DTYPES = {
+        types_pb2.DT_FLOAT: np.float32,
+        types_pb2.DT_DOUBLE: np.float64,
+        types_pb2.DT_HALF: np.float16,
+        types_pb2.DT_INT8: np.int8,
+        types_pb2.DT_INT16: np.int16,
+        types_pb2.DT_INT32: np.int32,
+        types_pb2.DT_INT64: np.int64,
+        types_pb2.DT_UINT8: np.uint8,
+        types_pb2.DT_UINT16: np.uint16,
+        types_pb2.DT_UINT32: np.uint32,
+        types_pb2.DT_UINT64: np.uint64,
+        types_pb2.DT_BOOL: np.bool_,
+        types_pb2.DT_STRING: np.object_,
+    }
+
+
+def grpc_predict_requested(tfs_attributes, enabled_by_default):
+    """The tfs-grpc-predict custom attribute overrides SAGEMAKER_TFS_GRPC_PREDICT per request"""
+    value = tfs_attributes.get(GRPC_PREDICT_ATTRIBUTE)
+    if value is None:
+        return enabled_by_default
+    return value.strip().lower() == "true"
+
+
+def make_tensor_proto(array, dtype):
+    """Build a TensorProto directly from the numpy buffer, without going through tensorflow"""
+    shape = tensor_shape_pb2.TensorShapeProto(
+        dim=[tensor_shape_pb2.TensorShapeProto.Dim(size=size) for size in array.shape]
+    )
+    tensor = tensor_pb2.TensorProto(dtype=dtype, tensor_shape=shape)
+    if dtype == types_pb2.DT_STRING:
+        tensor.string_val.extend(
+            value if isinstance(value, bytes) else str(value).encode("utf-8")
+            for value in array.flat
+        )
+    else:
+        tensor.tensor_content = np.ascontiguousarray(array, dtype=_NUMPY_DTYPES[dtype]).tobytes()
+    return tensor
+
+
+def make_ndarray(tensor):
+    shape = [dim.size for dim in tensor.tensor_shape.dim]
+    if tensor.dtype == types_pb2.DT_STRING:
+        return np.array(list(tensor.string_val), dtype=np.object_).reshape(shape)
+
+    dtype = _NUMPY_DTYPES[tensor.dtype]
+    if tensor.tensor_content:
+        return np.frombuffer(tensor.tensor_content, dtype=dtype).reshape(shape)
+
+    # small tensors may be returned through the typed repeated fields instead
+    if tensor.dtype == types_pb2.DT_HALF:
+        values = np.array(tensor.half_val, dtype=np.uint16).view(np.float16)
+    else:
+        field = {
+            types_pb2.DT_FLOAT: tensor.float_val,
+            types_pb2.DT_DOUBLE: tensor.double_val,
+            types_pb2.DT_INT64: tensor.int64_val,
+            types_pb2.DT_UINT32: tensor.uint32_val,
+            types_pb2.DT_UINT64: tensor.uint64_val,
+            types_pb2.DT_BOOL: tensor.bool_val,
+        }.get(tensor.dtype, tensor.int_val)
+        values = np.array(field, dtype=dtype)
+    if values.size == 1 and np.prod(shape) > 1:
+        values = np.full(shape, values[0], dtype=dtype)
+    return values.reshape(shape)
+
+
+def _decode_strings(value):
+    if isinstance(value, list):
+        return [_decode_strings(v) for v in value]
+    if isinstance(value, dict) and "b64" in value:
+        return base64.b64decode(value["b64"])
+    return value
+
+
+def _to_jsonable(array):
+    if array.dtype == np.object_:
+        return np.vectorize(lambda v: v.decode("utf-8", "replace"), otypes=[object])(array).tolist()
+    return array.tolist()
+
+
+class GrpcPredictHandler:
+    """Default handler that sends predict requests through the TFS gRPC channel.
+
+    JSON, NPY and serialized PredictRequest payloads are converted into TensorProtos straight
+    from numpy buffers, which avoids TFS re-parsing large JSON tensors. Any other request, and
+    requests to signatures with tensor types that have no numpy equivalent (e.g. DT_BFLOAT16),
+    are forwarded to the REST fallback handler.
+    """
+
+    def __init__(self, default_model_name, fallback_handler, timeout_seconds=60):
+        self._default_model_name = default_model_name
+        self._fallback_handler = fallback_handler
+        self._timeout_seconds = timeout_seconds
+        self._signatures = {}
+
+    def __call__(self, data, context):
+        content_type = context.request_content_type.split(";")[0].strip()
+        if (
+            context.channel is None
+            or content_type not in SUPPORTED_CONTENT_TYPES
+            or context.method not in (None, "predict")
+        ):
+            return self._fallback_handler(data, context)
+
+        stub = prediction_service_pb2_grpc.PredictionServiceStub(context.channel)
+        body = data.read()
+        with tfs_utils.profile_phase("serialization"):
+            request, row_format = self._make_predict_request(stub, body, content_type, context)
+        if request is None:
+            return self._fallback_handler(io.BytesIO(body), context)
+        with tfs_utils.profile_phase("upstream"):
+            response = stub.Predict(request, timeout=self._timeout_seconds)
+        with tfs_utils.profile_phase("serialization"):
+            return self._serialize_response(response, row_format, context.accept_header)
+
+    def _model_spec(self, context, signature_name):
+        request = predict_pb2.PredictRequest()
+        request.model_spec.name = context.model_name or self._default_model_name
+        if context.model_version:
+            request.model_spec.version.value = int(context.model_version)
+        request.model_spec.signature_name = signature_name
+        return request
+
+    def _signature(self, stub, request):
+        """
+        :return: tuple(dict, dict), dtypes of the inputs and of the outputs of the signature
+        """
+        key = (
+            request.model_spec.name,
+            request.model_spec.version.value,
+            request.model_spec.signature_name,
+        )
+        if key not in self._signatures:
+            metadata_request = get_model_metadata_pb2.GetModelMetadataRequest()
+            metadata_request.model_spec.CopyFrom(request.model_spec)
+            metadata_request.metadata_field.append("signature_def")
+            metadata = stub.GetModelMetadata(metadata_request, timeout=self._timeout_seconds)
+
+            signature_map = get_model_metadata_pb2.SignatureDefMap()
+            metadata.metadata["signature_def"].Unpack(signature_map)
+            if request.model_spec.signature_name not in signature_map.signature_def:
+                raise ValueError(
+                    "signature {} not found for model {}".format(
+                        request.model_spec.signature_name, request.model_spec.name
+                    )
+                )
+            signature = signature_map.signature_def[request.model_spec.signature_name]
+            self._signatures[key] = (
+                {name: info.dtype for name, info in signature.inputs.items()},
+                {name: info.dtype for name, info in signature.outputs.items()},
+            )
+        return self._signatures[key]
+
+    def _make_predict_request(self, stub, body, content_type, context):
+        if content_type == PROTOBUF_CONTENT_TYPE:
+            request = predict_pb2.PredictRequest.FromString(body)
+            signature_name = request.model_spec.signature_name or DEFAULT_SIGNATURE_NAME
+            request.model_spec.CopyFrom(self._model_spec(context, signature_name).model_spec)
+            return request, False
+
+        if content_type == NPY_CONTENT_TYPE:
+            loaded = np.load(io.BytesIO(body), allow_pickle=False)
+            inputs = dict(loaded) if isinstance(loaded, np.lib.npyio.NpzFile) else loaded
+            signature_name, row_format = DEFAULT_SIGNATURE_NAME, True
+        else:
+            payload = json.loads(body)
+            signature_name = payload.get("signature_name", DEFAULT_SIGNATURE_NAME)
+            row_format = "instances" in payload
+            if row_format:
+                instances = payload["instances"]
+                if instances and isinstance(instances[0], dict):
+                    inputs = {name: [i[name] for i in instances] for name in instances[0]}
+                else:
+                    inputs = instances
+            elif "inputs" in payload:
+                inputs = payload["inputs"]
+            else:
+                raise ValueError('JSON payload must contain "instances" or "inputs"')
+
+        request = self._model_spec(context, signature_name)
+        signature_inputs, signature_outputs = self._signature(stub, request)
+        unsupported = [
+            name
+            for name, dtype in list(signature_inputs.items()) + list(signature_outputs.items())
+            if dtype not in _NUMPY_DTYPES
+        ]
+        if unsupported:
+            log.info(
+                "signature {} has tensors without a numpy type: {}, using the REST API".format(
+                    signature_name, sorted(unsupported)
+                )
+            )
+            return None, row_format
+
+        if not isinstance(inputs, dict):
+            if len(signature_inputs) != 1:
+                raise ValueError(
+                    "inputs must be named, signature {} has inputs: {}".format(
+                        signature_name, sorted(signature_inputs)
+                    )
+                )
+            inputs = {next(iter(signature_inputs)): inputs}
+
+        for name, value in inputs.items():
+            if name not in signature_inputs:
+                raise ValueError(
+                    "input {} not found, signature {} has inputs: {}".format(
+                        name, signature_name, sorted(signature_inputs)
+                    )
+                )
+            dtype = signature_inputs[name]
+            if dtype == types_pb2.DT_STRING:
+                value = _decode_strings(value)
+            array = np.asarray(value, dtype=_NUMPY_DTYPES[dtype])
+            request.inputs[name].CopyFrom(make_tensor_proto(array, dtype))
+        return request, row_format
+
+    def _serialize_response(self, response, row_format, accept_header):
+        accept = accept_header.split(";")[0].strip()
+        if accept == PROTOBUF_CONTENT_TYPE:
+            return response.SerializeToString(), PROTOBUF_CONTENT_TYPE
+
+        outputs = {name: make_ndarray(tensor) for name, tensor in response.outputs.items()}
+        if accept == NPY_CONTENT_TYPE:
+            if len(outputs) != 1:
+                raise ValueError(
+                    "{} responses require a single output, model returned: {}".format(
+                        NPY_CONTENT_TYPE, sorted(outputs)
+                    )
+                )
+            buffer = io.BytesIO()
+            np.save(buffer, next(iter(outputs.values())), allow_pickle=False)
+            return buffer.getvalue(), NPY_CONTENT_TYPE
+
+        # mirror the layout of the TFS REST API responses
+        if len(outputs) == 1:
+            result = _to_jsonable(next(iter(outputs.values())))
+        elif row_format:
+            columns = {name: _to_jsonable(array) for name, array in outputs.items()}
+            batch_size = len(next(iter(columns.values())))
+            result = [
+                {name: column[i] for name, column in columns.items()} for i in range(batch_size)
+            ]
+        else:
+            result = {name: _to_jsonable(array) for name, array in outputs.items()}
+        body = json.dumps({"predictions" if row_format else "outputs": result})
+        return body, JSON_CONTENT_TYPE
@@ -0,0 +1,152 @@
+# Copyright 2020 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"). You
+# may not use this file except in compliance with the License. A copy of
+# the License is located at
+#
+#     http://aws.amazon.com/apache2.0/
+#
+# or in the "license" file accompanying this file. This file is
+# distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF
+# ANY KIND, either express or implied. See the License for the specific
+# language governing permissions and limitations under the License.
+import ctypes
+import ctypes.util
+import json
+import logging
+import os
+import select
+import socket
+import time
+
+log = logging.getLogger(__name__)
+
+# from <sys/inotify.h>
+_IN_MOVED_TO = 0x00000080
+_IN_CREATE = 0x00000100
+
+
+class ProcessExitedError(Exception):
+    def __init__(self, pid, name):
+        Exception.__init__(self, "{} (pid: {}) exited before it was ready".format(name, pid))
+        self.pid = pid
+
+
+class Backoff:
+    """Exponential sleep intervals, short at first so fast startups are noticed quickly"""
+
+    def __init__(self, initial_seconds=0.005, max_seconds=0.5, factor=2):
+        self._next_seconds = initial_seconds
+        self._max_seconds = max_seconds
+        self._factor = factor
+
+    def next(self, deadline=None):
+        seconds = self._next_seconds
+        self._next_seconds = min(self._next_seconds * self._factor, self._max_seconds)
+        if deadline is not None:
+            seconds = max(0, min(seconds, deadline - time.time()))
+        return seconds
+
+    def sleep(self, deadline=None):
+        time.sleep(self.next(deadline))
+
+
+def process_running(pid):
+    """Whether the process exists and is not a zombie. Does not reap the process, so the
+    caller's os.wait() still sees it exit."""
+    try:
+        with open("/proc/{}/stat".format(pid), "r", encoding="utf8") as f:
+            # the process name is in parentheses and may contain spaces
+            state = f.read().rsplit(")", 1)[1].split()[0]
+    except (FileNotFoundError, ProcessLookupError, IndexError):
+        return False
+    return state not in ("Z", "X")
+
+
+def _check_process(pid, name):
+    if pid is not None and not process_running(pid):
+        raise ProcessExitedError(pid, name)
+
+
+def _inotify_fd(directory):
+    """Non-blocking inotify fd reporting files created in the directory, None if unavailable"""
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+        fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+    except (OSError, AttributeError):
+        return None
+    if fd < 0:
+        return None
+    if libc.inotify_add_watch(fd, directory.encode("utf-8"), _IN_CREATE | _IN_MOVED_TO) < 0:
+        os.close(fd)
+        return None
+    return fd
+
+
+def wait_for_path(path, timeout_seconds, pid=None, name="process"):
+    """Wait until the file (e.g. a unix socket) exists, woken up by inotify when available.
+
+    Raises ProcessExitedError as soon as the process that should create it exits, and
+    TimeoutError after timeout_seconds.
+    """
+    deadline = time.time() + timeout_seconds
+    backoff = Backoff()
+    fd = _inotify_fd(os.path.dirname(path) or ".")
+    try:
+        while not os.path.exists(path):
+            _check_process(pid, name)
+            if time.time() >= deadline:
+                raise TimeoutError("{} not found after {} seconds".format(path, timeout_seconds))
+            if fd is None:
+                backoff.sleep(deadline)
+                continue
+            # the timeout still polls the process liveness every now and then
+            readable, _, _ = select.select([fd], [], [], backoff.next(deadline))
+            if readable:
+                try:
+                    os.read(fd, 4096)
+                except BlockingIOError:
+                    pass
+    finally:
+        if fd is not None:
+            os.close(fd)
+
+
+def wait_for_port(port, timeout_seconds, pid=None, name="process", host="localhost"):
+    """Wait until a TCP port accepts connections, see wait_for_path for the errors raised"""
+    deadline = time.time() + timeout_seconds
+    backoff = Backoff()
+    while True:
+        _check_process(pid, name)
+        try:
+            with socket.create_connection((host, int(port)), timeout=1):
+                return
+        except OSError:
+            pass
+        if time.time() >= deadline:
+            raise TimeoutError(
+                "port {} not accepting connections after {} seconds".format(port, timeout_seconds)
+            )
+        backoff.sleep(deadline)
+
+
+class StartupTimeline:
+    """Seconds elapsed since the container started serving for each startup milestone.
+
+    The summary is logged as a single JSON line so that cold starts can be extracted from the
+    logs, e.g. with a CloudWatch Logs metric filter on "startup timeline".
+    """
+
+    def __init__(self):
+        self._start = time.time()
+        self._events = {}
+
+    def mark(self, event):
+        self._events[event] = round(time.time() - self._start, 3)
+        log.info("startup event {} after {:.3f} seconds".format(event, self._events[event]))
+
+    def events(self):
+        return dict(self._events)
+
+    def log_summary(self):
+        log.info("startup timeline: {}".format(json.dumps(self._events)))
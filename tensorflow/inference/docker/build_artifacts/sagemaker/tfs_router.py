@@ -0,0 +1,147 @@
+# Copyright 2020 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"). You
+# may not use this file except in compliance with the License. A copy of
+# the License is located at
+#
+#     http://aws.amazon.com/apache2.0/
+#
+# or in the "license" file accompanying this file. This file is
+# distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF
+# ANY KIND, either express or implied. See the License for the specific
+# language governing permissions and limitations under the License.
+import itertools
+import logging
+import multiprocessing
+import os
+import random
+import threading
+
+from collections import namedtuple
+from contextlib import contextmanager
+
+log = logging.getLogger(__name__)
+
+LEAST_OUTSTANDING_REQUESTS = "least-outstanding-requests"
+POWER_OF_TWO_CHOICES = "power-of-two-choices"
+ROUND_ROBIN = "round-robin"
+RANDOM = "random"
+ROUTING_POLICIES = (LEAST_OUTSTANDING_REQUESTS, POWER_OF_TWO_CHOICES, ROUND_ROBIN, RANDOM)
+
+# REST and gRPC ports of the same tensorflow_model_server process
+TfsInstance = namedtuple("TfsInstance", "rest_port, grpc_port")
+
+
+class InFlightCounter:
+    """In-flight request counts per TFS instance, shared by all gunicorn workers.
+
+    The counters live in shared memory allocated before gunicorn forks its workers. Each
+    worker claims its own row and only ever writes to it, so workers never wait on each other.
+    Rows of workers that died are zeroed and reused, so their in-flight requests do not leak.
+    """
+
+    def __init__(self, rest_ports, max_workers):
+        self._columns = {int(port): column for column, port in enumerate(rest_ports)}
+        self._rows = max_workers
+        self._counts = multiprocessing.RawArray("q", self._rows * len(self._columns))
+        self._owners = multiprocessing.RawArray("q", self._rows)
+        self._claim_lock = multiprocessing.Lock()
+        # only needed to make += atomic with threaded gunicorn workers
+        self._add_lock = threading.Lock()
+        self._row = None
+        self._pid = None
+        self._local_counts = None
+
+    def _claim_row(self):
+        self._pid = os.getpid()
+        self._row = None
+        stride = len(self._columns)
+        with self._claim_lock:
+            # gunicorn replaces dead workers, so this also releases the rows they left behind
+            for row in range(self._rows):
+                owner = self._owners[row]
+                if owner and owner != self._pid and _is_alive(owner):
+                    continue
+                self._counts[row * stride : (row + 1) * stride] = [0] * stride
+                self._owners[row] = 0
+                if self._row is None:
+                    self._owners[row] = self._pid
+                    self._row = row
+        if self._row is None:
+            log.warning("no shared in-flight counter row left, counting requests per worker only")
+            self._local_counts = [0] * stride
+
+    def add(self, rest_port, delta):
+        with self._add_lock:
+            if self._pid != os.getpid():
+                self._claim_row()
+            column = self._columns[int(rest_port)]
+            if self._row is None:
+                self._local_counts[column] += delta
+            else:
+                self._counts[self._row * len(self._columns) + column] += delta
+
+    def get(self, rest_port):
+        column = self._columns[int(rest_port)]
+        if self._row is None and self._local_counts is not None:
+            return self._local_counts[column]
+        stride = len(self._columns)
+        return sum(self._counts[row * stride + column] for row in range(self._rows))
+
+
+def _is_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except OSError:
+        return False
+    return True
+
+
+class Router:
+    """Picks the TFS instance that serves a request according to a routing policy"""
+
+    def __init__(self, policy, counter):
+        if policy not in ROUTING_POLICIES:
+            raise ValueError(
+                "unknown routing policy {}, must be one of {}".format(policy, ROUTING_POLICIES)
+            )
+        self._policy = policy
+        self._counter = counter
+        self._round_robin = itertools.count()
+
+    def pick(self, instances):
+        if len(instances) == 1:
+            return instances[0]
+        if self._policy == LEAST_OUTSTANDING_REQUESTS:
+            # shuffle so that ties do not always go to the first instance
+            candidates = random.sample(instances, len(instances))
+            return min(candidates, key=lambda instance: self._counter.get(instance.rest_port))
+        if self._policy == POWER_OF_TWO_CHOICES:
+            candidates = random.sample(instances, 2)
+            return min(candidates, key=lambda instance: self._counter.get(instance.rest_port))
+        if self._policy == ROUND_ROBIN:
+            return instances[next(self._round_robin) % len(instances)]
+        return random.choice(instances)
+
+    def acquire(self, instance):
+        """Count a request as in flight on the instance, returns the callback that releases it.
+        Releasing more than once has no effect, so the callback can be handed over to whatever
+        finishes the request last."""
+        self._counter.add(instance.rest_port, 1)
+        released = threading.Event()
+
+        def release():
+            if not released.is_set():
+                released.set()
+                self._counter.add(instance.rest_port, -1)
+
+        return release
+
+    @contextmanager
+    def track(self, instance):
+        """Count the request as in flight on the instance while the block runs"""
+        release = self.acquire(instance)
+        try:
+            yield
+        finally:
+            release()
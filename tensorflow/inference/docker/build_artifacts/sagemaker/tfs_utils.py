@@ -17,12 +17,14 @@ import os
 import re
 import requests
 import json
+import threading
 import time
+import tfs_readiness
 
 from multi_model_utils import timeout
-from urllib3.util.retry import Retry
-from urllib3.exceptions import NewConnectionError, MaxRetryError
 from collections import namedtuple
+from contextlib import nullcontext
+from functools import lru_cache
 from multi_model_utils import MultiModelException
 
 logging.basicConfig(level=logging.INFO)
@@ -31,25 +33,232 @@ log = logging.getLogger(__name__)
 DEFAULT_CONTENT_TYPE = "application/json"
 DEFAULT_ACCEPT_HEADER = "application/json"
 CUSTOM_ATTRIBUTES_HEADER = "X-Amzn-SageMaker-Custom-Attributes"
+TFS_ATTRIBUTE_PATTERN = re.compile(r"(tfs-[a-z\-]+=[^,]+)")
+# distinct (custom attributes, model, port) combinations remembered by each worker
+REQUEST_CACHE_SIZE = 1024
+STREAM_CHUNK_SIZE = 64 * 1024
+# CloudWatch namespace of the metrics written by log_metrics
+METRICS_NAMESPACE = os.environ.get("SAGEMAKER_TFS_METRICS_NAMESPACE", "SageMaker/TensorFlowServing")
 
 Context = namedtuple(
     "Context",
     "model_name, model_version, method, rest_uri, grpc_port, channel, "
-    "custom_attributes, request_content_type, accept_header, content_length",
+    "custom_attributes, request_content_type, accept_header, content_length, session",
 )
 
 
-def parse_request(req, rest_port, grpc_port, default_model_name, model_name=None, channel=None):
-    tfs_attributes = parse_tfs_custom_attributes(req)
-    tfs_uri = make_tfs_uri(rest_port, tfs_attributes, default_model_name, model_name)
+class _PooledSession(requests.Session):
+    """A keep-alive session to a single TFS REST port that evicts itself from its pool
+    when the connection to the model server breaks (e.g. TFS was restarted)."""
 
-    if not model_name:
-        model_name = tfs_attributes.get("tfs-model-name")
+    def __init__(self, pool, port):
+        super().__init__()
+        self._pool = pool
+        self._port = port
+
+    def request(self, *args, **kwargs):
+        try:
+            with profile_phase("upstream"):
+                return super().request(*args, **kwargs)
+        except requests.exceptions.ConnectionError:
+            log.warning("evicting http session for tfs rest port: {}".format(self._port))
+            self._pool.evict(self._port)
+            raise
+
+
+class TfsSessionPool:
+    """Per-worker pool of keep-alive HTTP sessions, one per TFS REST port.
+
+    Sessions are created lazily so that every gunicorn worker owns its own connections,
+    even when the pool object itself was created before the worker was forked.
+    """
+
+    def __init__(self, pool_size=10, pool_block=False):
+        self._pool_size = pool_size
+        self._pool_block = pool_block
+        self._sessions = {}
+        self._pid = os.getpid()
+
+    def get(self, port):
+        if self._pid != os.getpid():
+            # connections must never be shared with the parent process
+            self._sessions = {}
+            self._pid = os.getpid()
+
+        session = self._sessions.get(port)
+        if session is None:
+            session = _PooledSession(self, port)
+            adapter = requests.adapters.HTTPAdapter(
+                pool_connections=1, pool_maxsize=self._pool_size, pool_block=self._pool_block
+            )
+            session.mount("http://", adapter)
+            self._sessions[port] = session
+        return session
+
+    def evict(self, port):
+        session = self._sessions.pop(port, None)
+        if session is not None:
+            session.close()
+
+    def close(self):
+        for port in list(self._sessions):
+            self.evict(port)
+
+
+class RequestBodyStream:
+    """Request body forwarded to TFS in chunks of STREAM_CHUNK_SIZE bytes.
+
+    requests sends Content-Length for objects with a length and reads them block by block,
+    so the body is never held in memory as a whole and TFS does not have to accept chunked
+    transfer encoding.
+    """
+
+    def __init__(self, stream, content_length):
+        self._stream = stream
+        self._remaining = content_length
+        self._length = content_length
+
+    def __len__(self):
+        return self._length
+
+    def read(self, size=STREAM_CHUNK_SIZE):
+        if self._remaining <= 0:
+            return b""
+        if size is None or size < 0 or size > self._remaining:
+            size = self._remaining
+        chunk = self._stream.read(min(size, STREAM_CHUNK_SIZE))
+        self._remaining -= len(chunk)
+        return chunk
+
+    def __iter__(self):
+        return iter(self.read, b"")
+
+
+class StreamingResponse:
+    """TFS response body relayed to the client as it arrives, set as the falcon response
+    stream. The connection goes back to the session pool once the body is consumed or closed,
+    and the callbacks added with on_close() run then, e.g. to release the in-flight slot of
+    the TFS instance.
+    """
+
+    def __init__(self, response):
+        self._response = response
+        self._close_callbacks = []
+
+    @property
+    def content_length(self):
+        content_length = self._response.headers.get("Content-Length")
+        return int(content_length) if content_length else None
+
+    def on_close(self, callback):
+        self._close_callbacks.append(callback)
+
+    def __iter__(self):
+        try:
+            yield from self._response.iter_content(chunk_size=STREAM_CHUNK_SIZE)
+        finally:
+            self.close()
+
+    def close(self):
+        self._response.close()
+        # the WSGI server closes the body after iterating over it, run the callbacks once
+        callbacks, self._close_callbacks = self._close_callbacks, []
+        for callback in callbacks:
+            callback()
+
+
+class RequestProfile:
+    """Time spent in each phase of an invocation (parse, handler, upstream, serialization),
+    logged when the request completes. Phases nest, e.g. upstream is part of handler.
+
+    Used as a context manager around the request. The active profile is greenlet-local under
+    gevent, so code deeper in the call stack records phases through profile_phase().
+    """
+
+    _active = threading.local()
+
+    def __init__(self, model_name=None):
+        self._model_name = model_name
+        self._phases = {}
+        self._start = None
+        self._deferred = False
+        self._finished = False
+
+    def __enter__(self):
+        self._start = time.perf_counter()
+        RequestProfile._active.profile = self
+        return self
+
+    def __exit__(self, *exc_info):
+        RequestProfile._active.profile = None
+        if not self._deferred:
+            self.finish()
+
+    def defer(self):
+        """Keep the request open past the with block, e.g. while its response body streams.
+        Returns the callback that ends it."""
+        self._deferred = True
+        return self.finish
+
+    def finish(self):
+        """Log the profile, once"""
+        if self._finished:
+            return
+        self._finished = True
+        total = time.perf_counter() - self._start
+        log.info(
+            "request profile: model={} total={:.3f}ms {}".format(
+                self._model_name,
+                total * 1000,
+                " ".join(
+                    "{}={:.3f}ms".format(name, seconds * 1000)
+                    for name, seconds in self._phases.items()
+                ),
+            )
+        )
+
+    def add(self, name, seconds):
+        self._phases[name] = self._phases.get(name, 0) + seconds
+
+    @classmethod
+    def active(cls):
+        return getattr(cls._active, "profile", None)
+
+
+class _ProfilePhase:
+    def __init__(self, profile, name):
+        self._profile = profile
+        self._name = name
+
+    def __enter__(self):
+        self._start = time.perf_counter()
+
+    def __exit__(self, *exc_info):
+        self._profile.add(self._name, time.perf_counter() - self._start)
+
+
+_NO_PROFILE = nullcontext()
+
+
+def profile_phase(name):
+    """Context manager timing a phase of the active RequestProfile, a no-op without one"""
+    profile = RequestProfile.active()
+    if profile is None:
+        return _NO_PROFILE
+    return _ProfilePhase(profile, name)
+
+
+def parse_request(
+    req, rest_port, grpc_port, default_model_name, model_name=None, channel=None, session=None
+):
+    model_name, model_version, method, tfs_uri = _request_template(
+        req.get_header(CUSTOM_ATTRIBUTES_HEADER), rest_port, default_model_name, model_name
+    )
 
     context = Context(
         model_name,
-        tfs_attributes.get("tfs-model-version"),
-        tfs_attributes.get("tfs-method"),
+        model_version,
+        method,
         tfs_uri,
         grpc_port,
         channel,
@@ -57,14 +266,31 @@ def parse_request(req, rest_port, grpc_port, default_model_name, model_name=None
         req.get_header("Content-Type") or DEFAULT_CONTENT_TYPE,
         req.get_header("Accept") or DEFAULT_ACCEPT_HEADER,
         req.content_length,
+        # fall back to one-shot connections when no pooled session was provided
+        session or requests,
     )
 
     data = req.stream
     return data, context
 
 
+@lru_cache(maxsize=REQUEST_CACHE_SIZE)
+def _request_template(header, rest_port, default_model_name, model_name):
+    """The request independent part of the Context: model name, version, method and TFS URI"""
+    tfs_attributes = _parse_tfs_attributes_header(header)
+    tfs_uri = make_tfs_uri(rest_port, tfs_attributes, default_model_name, model_name)
+    if not model_name:
+        model_name = tfs_attributes.get("tfs-model-name")
+    return (
+        model_name,
+        tfs_attributes.get("tfs-model-version"),
+        tfs_attributes.get("tfs-method"),
+        tfs_uri,
+    )
+
+
 def make_tfs_uri(port, attributes, default_model_name, model_name=None):
-    log.info("sagemaker tfs attributes: \n{}".format(attributes))
+    log.debug("sagemaker tfs attributes: \n{}".format(attributes))
 
     tfs_model_name = model_name or attributes.get("tfs-model-name", default_model_name)
     tfs_model_version = attributes.get("tfs-model-version")
@@ -78,10 +304,15 @@ def make_tfs_uri(port, attributes, default_model_name, model_name=None):
 
 
 def parse_tfs_custom_attributes(req):
+    # copied, the cached dict is shared by all requests with the same header
+    return dict(_parse_tfs_attributes_header(req.get_header(CUSTOM_ATTRIBUTES_HEADER)))
+
+
+@lru_cache(maxsize=REQUEST_CACHE_SIZE)
+def _parse_tfs_attributes_header(header):
     attributes = {}
-    header = req.get_header(CUSTOM_ATTRIBUTES_HEADER)
     if header:
-        matches = re.findall(r"(tfs-[a-z\-]+=[^,]+)", header)
+        matches = TFS_ATTRIBUTE_PATTERN.findall(header)
         attributes = dict(attribute.split("=") for attribute in matches)
     return attributes
 
@@ -192,7 +423,10 @@ def get_tfs_gpu_mem_args(enable_gpu_memory_fraction, gpu_memory_fraction):
         return ""
 
 
-def create_batching_config(batching_config_file):
+def create_batching_config(batching_config_file, tuned_parameters=None):
+    """Write the TFS batching parameters file. Environment variables take precedence over
+    tuned_parameters (e.g. chosen by tfs_batching_tuner), which take precedence over defaults."""
+
     class _BatchingParameter:
         def __init__(self, key, env_var, value, defaulted_message):
             self.key = key
@@ -234,10 +468,13 @@ def create_batching_config(batching_config_file):
         ),
     ]
 
+    tuned_parameters = tuned_parameters or {}
     warning_message = ""
     for batching_parameter in batching_parameters:
         if batching_parameter.env_var in os.environ:
             batching_parameter.value = os.environ[batching_parameter.env_var]
+        elif batching_parameter.key in tuned_parameters:
+            batching_parameter.value = tuned_parameters[batching_parameter.key]
         else:
             warning_message += batching_parameter.defaulted_message.format(
                 batching_parameter.value, batching_parameter.env_var
@@ -256,44 +493,50 @@ def create_batching_config(batching_config_file):
 
 
 def wait_for_model(rest_port, model_name, timeout_seconds, pid=None):
-    """
-    Notice:
-    The calculation for retry count based on timeout_seconds might introduce a small delta (0.1s) for each retry
-    which might cause total timeout longer than timeout_seconds
+    """Wait until all versions of the model are AVAILABLE in tensorflow serving.
+
+    The model status is polled with an adaptive backoff, so a model that loads quickly is
+    noticed within milliseconds. When the pid of the TFS process is given, its exit is
+    reported right away instead of after the timeout.
     """
     tfs_url = "http://localhost:{}/v1/models/{}".format(rest_port, model_name)
-    start = time.time()
-    try:
-        session = requests.Session()
-        backoff_factor = 0.1
-        # sleep = {backoff factor} * (2 ^ ({number of retries so far} - 1))
-        retry_count = retry_from_timeout(timeout_seconds, backoff_factor)
-        retries = Retry(total=retry_count, backoff_factor=backoff_factor)
-        session.mount("http://", requests.adapters.HTTPAdapter(max_retries=retries))
-        log.info(
-            "Trying to connect with model server: {} with timeout : {} and retry : {}".format(
-                tfs_url, timeout_seconds, retry_count
-            )
-        )
-        response = session.get(tfs_url, timeout=0.1)
-        log.info(
-            f"tfs response status_code: {response.status_code} with content : {json.loads(response.content)}"
-        )
-        end = time.time()
-        if response.status_code == 200:
-            if is_model_ready(response):
-                return
-            elif wait_for_model_ready(tfs_url, timeout_seconds - int(end - start)):
-                return
-
-        raise MultiModelException(408, "Timed out after {} seconds".format(timeout_seconds), pid)
-    except (
-        ConnectionRefusedError,
-        NewConnectionError,
-        MaxRetryError,
-        requests.exceptions.ConnectionError,
-    ):
-        raise MultiModelException(408, "Timed out after {} seconds".format(timeout_seconds), pid)
+    deadline = time.time() + timeout_seconds
+    backoff = tfs_readiness.Backoff()
+    log.info(
+        "Trying to connect with model server: {} with timeout : {}".format(tfs_url, timeout_seconds)
+    )
+    with requests.Session() as session:
+        while True:
+            if pid is not None and not tfs_readiness.process_running(pid):
+                raise MultiModelException(
+                    500,
+                    "tensorflow serving (pid: {}) exited while loading model {}".format(
+                        pid, model_name
+                    ),
+                    pid,
+                )
+            try:
+                response = session.get(tfs_url, timeout=1)
+            except requests.exceptions.RequestException:
+                # the REST port only opens once TFS is up
+                response = None
+            if response is not None:
+                log.debug(
+                    f"tfs response status_code: {response.status_code} "
+                    f"with content : {response.content}"
+                )
+                if response.status_code != 200:
+                    raise MultiModelException(
+                        408, "Timed out after {} seconds".format(timeout_seconds), pid
+                    )
+                if is_model_ready(response):
+                    log.info("model {} is available on rest port {}".format(model_name, rest_port))
+                    return
+            if time.time() >= deadline:
+                raise MultiModelException(
+                    408, "Timed out after {} seconds".format(timeout_seconds), pid
+                )
+            backoff.sleep(deadline)
 
 
 def is_model_ready(response):
@@ -303,35 +546,104 @@ def is_model_ready(response):
     return False
 
 
-def wait_for_model_ready(url, timeout_seconds):
-    try:
-        while timeout_seconds > 0:
-            response = requests.get(url, timeout=0.1)
-            log.info(
-                f"wait_for_model_ready response status_code : {response.status_code} "
-                f"response : {json.loads(response.content)} timeout in : {timeout_seconds}s"
-            )
-            if response.status_code != 200:
-                return False
-            if is_model_ready(response):
-                return True
-            timeout_seconds -= 1
-        return False
-    except requests.exceptions.RequestException:
-        return False
-
+def log_metrics(metrics, dimensions=None, properties=None, unit="Seconds"):
+    """Write the metrics to stdout as one line in the CloudWatch embedded metric format.
 
-def retry_from_timeout(timeout_seconds, backoff_factor):
-    retry_count = 1
-    retry_time = 0
-    while retry_time < timeout_seconds:
-        retry_count += 1
-        retry_time += backoff_factor * (2 ** (retry_count + 1))
-    return retry_count
+    The line is a bare JSON document, without the logging prefix, so that CloudWatch can extract
+    the values as metrics of METRICS_NAMESPACE. Dimensions must have a low cardinality, values
+    such as model names go to properties.
+    """
+    dimensions = dimensions or {}
+    document = {
+        "_aws": {
+            "Timestamp": int(time.time() * 1000),
+            "CloudWatchMetrics": [
+                {
+                    "Namespace": METRICS_NAMESPACE,
+                    "Dimensions": [sorted(dimensions)],
+                    "Metrics": [{"Name": name, "Unit": unit} for name in metrics],
+                }
+            ],
+        }
+    }
+    document.update(properties or {})
+    document.update(dimensions)
+    document.update(metrics)
+    print(json.dumps(document), flush=True)
+
+
+def get_memory_info():
+    """Return (total, available) memory in bytes, read from /proc/meminfo without forking"""
+    meminfo = {}
+    with open("/proc/meminfo", "r", encoding="utf8") as f:
+        for line in f:
+            key, value = line.split(":", 1)
+            meminfo[key] = int(value.split()[0]) * 1024
+    total = meminfo["MemTotal"]
+    # MemAvailable accounts for reclaimable page cache, unlike MemFree
+    available = meminfo.get("MemAvailable", meminfo["MemFree"])
+    return total, available
 
 
 def get_cpu_memory_util():
-    total_memory, used_memory, free_memory = map(
-        int, os.popen("free -t -m").readlines()[-1].split()[1:]
-    )
-    return round((used_memory / total_memory) * 100, 2)
+    total_memory, available_memory = get_memory_info()
+    return round(((total_memory - available_memory) / total_memory) * 100, 2)
+
+
+def get_process_rss_bytes(pid):
+    """Resident set size of a process in bytes, 0 if it already exited"""
+    try:
+        with open("/proc/{}/status".format(pid), "r", encoding="utf8") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) * 1024
+    except (FileNotFoundError, ProcessLookupError):
+        pass
+    return 0
+
+
+def plan_model_admission(
+    required_bytes, required_ports, free_ports, candidates, max_memory_utilization=None
+):
+    """Pick the idle models to evict so that a new model fits in memory and ports.
+
+    :param required_bytes: estimated memory of the TFS instances of the new model
+    :param required_ports: (rest, grpc) port pairs the new model needs
+    :param free_ports: (rest, grpc) port pairs available without evicting
+    :param candidates: list of (model name, TFS pids) that may be evicted, least recently
+        used first. Each evicted model frees one port pair per pid and the RSS of its pids.
+    :param max_memory_utilization: memory usage limit in percent, None to only check ports
+    :return: list of the model names to evict, empty if the model fits already, None if it
+        does not fit even after evicting every candidate
+    """
+    if max_memory_utilization is None:
+        excess_bytes = 0
+    else:
+        total_bytes, available_bytes = get_memory_info()
+        limit_bytes = total_bytes * max_memory_utilization / 100
+        excess_bytes = total_bytes - available_bytes + required_bytes - limit_bytes
+    missing_ports = required_ports - free_ports
+
+    victims = []
+    for model_name, pids in candidates:
+        if excess_bytes <= 0 and missing_ports <= 0:
+            break
+        victims.append(model_name)
+        if excess_bytes > 0:
+            excess_bytes -= sum(get_process_rss_bytes(pid) for pid in pids)
+        missing_ports -= len(pids)
+    if excess_bytes > 0 or missing_ports > 0:
+        return None
+    return victims
+
+
+def get_model_size_bytes(model_path):
+    """Size of the model files on disk, used to estimate the memory a TFS instance needs"""
+    size = 0
+    for root, _, files in os.walk(model_path):
+        for name in files:
+            try:
+                size += os.path.getsize(os.path.join(root, name))
+            except OSError:
+                pass
+    return size
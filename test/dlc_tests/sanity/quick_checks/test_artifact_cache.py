@@ -0,0 +1,129 @@
+import hashlib
+import json
+import os
+import threading
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from src import artifact_cache
+
+ARTIFACT = bytes(range(256)) * 12 * 1024
+
+
+class ArtifactHandler(BaseHTTPRequestHandler):
+    """
+    Serves ARTIFACT with an ETag and range requests. The server can be told to drop the
+    connection half way through the next download, and to ignore range requests.
+    """
+
+    protocol_version = "HTTP/1.1"
+
+    def do_HEAD(self):  # pylint: disable=C0103
+        self.server.requests.append(("HEAD", None, None))
+        self.send_response(200)
+        self.send_header("ETag", self.server.etag)
+        self.send_header("Content-Length", str(len(ARTIFACT)))
+        self.end_headers()
+
+    def do_GET(self):  # pylint: disable=C0103
+        requested_range = self.headers.get("Range")
+        if_range = self.headers.get("If-Range")
+        self.server.requests.append(("GET", requested_range, if_range))
+        offset = 0
+        if requested_range and if_range == self.server.etag and self.server.supports_ranges:
+            offset = int(requested_range[len("bytes=") : -1])
+            self.send_response(206)
+            self.send_header("Content-Range", f"bytes {offset}-{len(ARTIFACT) - 1}/{len(ARTIFACT)}")
+        else:
+            self.send_response(200)
+        self.send_header("ETag", self.server.etag)
+        self.send_header("Content-Length", str(len(ARTIFACT) - offset))
+        self.end_headers()
+        if self.server.interrupt:
+            self.server.interrupt = False
+            self.wfile.write(ARTIFACT[offset : len(ARTIFACT) // 2])
+            self.close_connection = True
+            return
+        self.wfile.write(ARTIFACT[offset:])
+
+    def log_message(self, format, *args):  # pylint: disable=W0622
+        pass
+
+
+@pytest.fixture
+def artifact_server():
+    server = ThreadingHTTPServer(("localhost", 0), ArtifactHandler)
+    server.daemon_threads = True
+    server.requests = []
+    server.etag = '"v1"'
+    server.supports_ranges = True
+    server.interrupt = False
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def _get_requests(server):
+    return [request for request in server.requests if request[0] == "GET"]
+
+
+@pytest.mark.quick_checks
+@pytest.mark.model("N/A")
+@pytest.mark.integration("artifact_cache")
+def test_artifact_cache_index_and_blobs(tmp_path, artifact_server):
+    uri = f"http://localhost:{artifact_server.server_address[1]}/artifact.whl"
+    cache = artifact_cache.ArtifactCache(cache_dir=str(tmp_path))
+
+    path = cache.fetch(uri, "pypi")
+    sha256 = hashlib.sha256(ARTIFACT).hexdigest()
+    assert path == os.path.join(str(tmp_path), "blobs", sha256)
+    with open(path, "rb") as artifact_file:
+        assert artifact_file.read() == ARTIFACT
+    (index_file_name,) = os.listdir(tmp_path / "index")
+    with open(tmp_path / "index" / index_file_name) as index_file:
+        assert json.load(index_file) == {
+            "uri": uri,
+            "etag": '"v1"',
+            "sha256": sha256,
+            "size": len(ARTIFACT),
+        }
+
+    # a known ETag is served from the cache
+    assert cache.fetch(uri, "pypi") == path
+    assert len(_get_requests(artifact_server)) == 1
+    assert (cache.downloads, cache.hits) == (1, 1)
+
+    # a new ETag is downloaded again, identical content is stored once
+    artifact_server.etag = '"v2"'
+    assert cache.fetch(uri, "pypi") == path
+    assert len(_get_requests(artifact_server)) == 2
+    assert len(os.listdir(tmp_path / "index")) == 2
+    assert os.listdir(tmp_path / "blobs") == [sha256]
+
+
+@pytest.mark.quick_checks
+@pytest.mark.model("N/A")
+@pytest.mark.integration("artifact_cache")
+@pytest.mark.parametrize("supports_ranges", [True, False])
+def test_artifact_cache_resumes_partial_downloads(tmp_path, artifact_server, supports_ranges):
+    uri = f"http://localhost:{artifact_server.server_address[1]}/artifact.tar.gz"
+    cache = artifact_cache.ArtifactCache(cache_dir=str(tmp_path))
+    artifact_server.interrupt = True
+    with pytest.raises(IOError, match="will be resumed"):
+        cache.fetch(uri, "pypi")
+    (partial_file_name,) = os.listdir(tmp_path / "partial")
+    offset = os.path.getsize(tmp_path / "partial" / partial_file_name)
+    assert 0 < offset < len(ARTIFACT)
+
+    # a server that ignores the range sends the whole artifact, the partial content is dropped
+    artifact_server.supports_ranges = supports_ranges
+    path = cache.fetch(uri, "pypi")
+
+    with open(path, "rb") as artifact_file:
+        assert artifact_file.read() == ARTIFACT
+    assert _get_requests(artifact_server)[-1] == ("GET", f"bytes={offset}-", '"v1"')
+    assert cache.resumed_bytes == (offset if supports_ranges else 0)
+    assert not os.listdir(tmp_path / "partial")
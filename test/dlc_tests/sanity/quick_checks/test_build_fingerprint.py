@@ -0,0 +1,187 @@
+import os
+
+import pytest
+
+from docker.errors import APIError, ImageNotFound
+
+from src import build_fingerprint, context, image
+
+FINGERPRINT_LABEL = "com.amazonaws.ml.dlc.build-fingerprint"
+
+
+class FakeDockerClient:
+    """
+    Images by URI with their id and labels, only local images can be inspected.
+    """
+
+    def __init__(self, local_images, remote_images=None):
+        self.local_images = dict(local_images)
+        self.remote_images = dict(remote_images or {})
+        self.pulls = []
+        self.tags = []
+
+    def inspect_image(self, image_uri):
+        if image_uri not in self.local_images:
+            raise ImageNotFound(f"No such image: {image_uri}")
+        image_id, labels = self.local_images[image_uri]
+        return {"Id": image_id, "Config": {"Labels": labels}}
+
+    def pull(self, repository, tag):
+        self.pulls.append(f"{repository}:{tag}")
+        self.local_images[f"{repository}:{tag}"] = self.remote_images[f"{repository}:{tag}"]
+
+    def tag(self, image_uri, repository, tag):
+        self.tags.append((image_uri, f"{repository}:{tag}"))
+
+
+@pytest.fixture
+def docker_image(tmp_path, monkeypatch):
+    """
+    A DockerImage built from tmp_path, with a fake docker client
+    """
+    monkeypatch.setattr(image, "APIClient", lambda **kwargs: FakeDockerClient({}))
+    monkeypatch.setattr(image.constants, "BUILD_LOG_DIR", str(tmp_path / "logs"))
+    (tmp_path / "Dockerfile").write_text("ARG BASE_IMAGE\nFROM $BASE_IMAGE\nCOPY context /\n")
+    os.makedirs(tmp_path / "context")
+    (tmp_path / "context" / "setup.sh").write_text("echo setup\n")
+    docker_image = image.DockerImage(
+        info={"name": "pytorch-training", "root": str(tmp_path)},
+        dockerfile="Dockerfile",
+        repository="123456789012.dkr.ecr.us-west-2.amazonaws.com/pr-pytorch-training",
+        tag="2.0-cpu",
+        to_build=True,
+        stage="pre_push",
+        context=context.Context(
+            {"context": {"source": "context", "target": "context"}},
+            context_path=str(tmp_path / "out" / "context.tar"),
+            artifact_root=str(tmp_path),
+            cache_dir=str(tmp_path / "cache"),
+        ),
+    )
+    docker_image.build_args = {"BASE_IMAGE": "base:latest", "PYTHON_VERSION": "3.10"}
+    docker_image.labels = {"framework": "pytorch"}
+    return docker_image
+
+
+@pytest.mark.quick_checks
+@pytest.mark.model("N/A")
+@pytest.mark.integration("build_fingerprint")
+def test_compute_fingerprint_inputs(tmp_path):
+    dockerfile = tmp_path / "Dockerfile"
+    dockerfile.write_text("FROM ubuntu:20.04\n")
+    build_args = {"BASE_IMAGE": "sha256:base", "PYTHON_VERSION": "3.10"}
+    labels = {"framework": "pytorch", "build-date": "2024-01-31-10-00-00"}
+
+    def fingerprint(**kwargs):
+        arguments = {
+            "dockerfile": str(dockerfile),
+            "build_args": build_args,
+            "labels": labels,
+            "target": None,
+            "context_digest": "context",
+        }
+        arguments.update(kwargs)
+        return build_fingerprint.compute_fingerprint(**arguments)
+
+    reference = fingerprint()
+    assert fingerprint() == reference
+    # datetime labels and the fingerprint label itself are left out
+    assert fingerprint(labels={"framework": "pytorch"}) == reference
+    assert fingerprint(labels=dict(labels, **{"build-date": "2024-02-01-10-00-00"})) == reference
+    assert fingerprint(labels=dict(labels, **{FINGERPRINT_LABEL: reference})) == reference
+    # any other input changes the fingerprint
+    assert fingerprint(labels=dict(labels, framework="tensorflow")) != reference
+    assert fingerprint(build_args=dict(build_args, BASE_IMAGE="sha256:other")) != reference
+    assert fingerprint(target="final") != reference
+    assert fingerprint(context_digest="other") != reference
+    dockerfile.write_text("FROM ubuntu:22.04\n")
+    assert fingerprint() != reference
+
+
+@pytest.mark.quick_checks
+@pytest.mark.model("N/A")
+@pytest.mark.integration("build_fingerprint")
+def test_build_fingerprint_of_image(tmp_path, docker_image):
+    docker_image.client.local_images["base:latest"] = ("sha256:base-1", {})
+    reference = docker_image.get_build_fingerprint()
+    assert reference
+
+    # fresh checkouts and downloads only change the mtimes of the context
+    os.utime(tmp_path / "context" / "setup.sh", (0, 0))
+    assert docker_image.get_build_fingerprint() == reference
+
+    # a new image behind the same base image tag
+    docker_image.client.local_images["base:latest"] = ("sha256:base-2", {})
+    assert docker_image.get_build_fingerprint() != reference
+    docker_image.client.local_images["base:latest"] = ("sha256:base-1", {})
+
+    (tmp_path / "context" / "setup.sh").write_text("echo changed\n")
+    assert docker_image.get_build_fingerprint() != reference
+
+    # the base image is not available
+    del docker_image.client.local_images["base:latest"]
+    assert docker_image.get_build_fingerprint() is None
+
+
+@pytest.mark.quick_checks
+@pytest.mark.model("N/A")
+@pytest.mark.integration("build_fingerprint")
+def test_local_fingerprint_index(tmp_path, monkeypatch):
+    index = build_fingerprint.LocalFingerprintIndex(
+        str(tmp_path / "index" / "fingerprints.json"), max_age_days=1
+    )
+    assert index.lookup("abc") is None
+
+    now = 1_700_000_000
+    monkeypatch.setattr(build_fingerprint.time, "time", lambda: now)
+    index.record("abc", "repo:abc")
+    index.record("def", "repo:def")
+    assert index.lookup("abc") == "repo:abc"
+
+    # another index on the same file sees the records
+    other_index = build_fingerprint.LocalFingerprintIndex(index.path, max_age_days=1)
+    assert other_index.lookup("def") == "repo:def"
+    index.record("abc", "repo:abc-2")
+    assert other_index.lookup("abc") == "repo:abc-2"
+
+    now += 2 * 24 * 60 * 60
+    assert index.lookup("abc") is None
+    # recording again renews the entry
+    index.record("abc", "repo:abc-3")
+    assert index.lookup("abc") == "repo:abc-3"
+    assert index.lookup("def") is None
+
+
+@pytest.mark.quick_checks
+@pytest.mark.model("N/A")
+@pytest.mark.integration("build_fingerprint")
+def test_reuse_fingerprinted_image(tmp_path, docker_image):
+    index = build_fingerprint.LocalFingerprintIndex(str(tmp_path / "fingerprints.json"))
+    docker_image.fingerprint = "abc"
+    client = docker_image.client
+
+    # nothing recorded for the fingerprint
+    assert not docker_image.reuse_fingerprinted_image(index)
+
+    # the recorded tag was moved to an image with another fingerprint
+    index.record("abc", "repo:old")
+    client.local_images["repo:old"] = ("sha256:old", {FINGERPRINT_LABEL: "def"})
+    assert not docker_image.reuse_fingerprinted_image(index)
+    assert not client.tags
+
+    # the recorded image is pulled and tagged instead of being built
+    index.record("abc", "repo:reused")
+    client.remote_images["repo:reused"] = ("sha256:reused", {FINGERPRINT_LABEL: "abc"})
+    assert docker_image.reuse_fingerprinted_image(index)
+    assert client.pulls == ["repo:reused"]
+    assert client.tags == [("repo:reused", docker_image.ecr_url)]
+    assert docker_image.build_status == image.constants.SUCCESS
+    assert docker_image.summary["reused_image"] == "repo:reused"
+
+    # the recorded image cannot be pulled
+    def pull(repository, tag):
+        raise APIError("pull access denied")
+
+    index.record("abc", "repo:missing")
+    client.pull = pull
+    assert not docker_image.reuse_fingerprinted_image(index)
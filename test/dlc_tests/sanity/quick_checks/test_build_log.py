@@ -0,0 +1,104 @@
+import pytest
+
+from src import build_log
+
+# "stream" values of a docker build response, each chunk may hold several lines
+BUILD_STREAM = [
+    "Step 1/4 : FROM ubuntu:20.04\n",
+    " ---> 3bc6e9f30f51\n",
+    "Step 2/4 : RUN apt-get update\n ---> Using cache\n ---> 5d1b2c4e6f7a\n",
+    "Step 3/4 : RUN pip install torch\n",
+    " ---> Running in 0a1b2c3d4e5f\n",
+    "Collecting torch\n\n",
+    "Successfully installed torch-2.0.0\n",
+    "Step 4/4 : ENV PATH=/opt/conda/bin:$PATH\n",
+    "Successfully built 6e7f8a9b0c1d\n",
+]
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    """Build log time, advanced by the test"""
+    clock = {"now": 1_700_000_000.0}
+    monkeypatch.setattr(build_log.time, "time", lambda: clock["now"])
+    return clock
+
+
+@pytest.mark.quick_checks
+@pytest.mark.model("N/A")
+@pytest.mark.integration("build_log")
+def test_build_log_steps(tmp_path, clock):
+    log = build_log.BuildLog(str(tmp_path / "logs" / "image.ndjson"), tail_size=3)
+    log.write("Starting the Build Process for pr-pytorch-training:2.0-cpu")
+    # seconds spent on each chunk until the next one is streamed
+    for chunk, seconds in zip(BUILD_STREAM, (2, 8, 100, 1, 2, 3, 4, 5, 2)):
+        log.write(chunk)
+        clock["now"] += seconds
+    log.end_step()
+    log.close()
+
+    assert [(step.number, step.total, step.instruction) for step in log.steps] == [
+        (1, 4, "FROM ubuntu:20.04"),
+        (2, 4, "RUN apt-get update"),
+        (3, 4, "RUN pip install torch"),
+        (4, 4, "ENV PATH=/opt/conda/bin:$PATH"),
+    ]
+    assert [step.seconds for step in log.steps] == [10, 100, 10, 7]
+    assert [step.cached for step in log.steps] == [False, True, False, False]
+
+    # ending again does not extend the last step
+    clock["now"] += 5
+    log.end_step()
+    assert log.steps[-1].seconds == 7
+
+    # blank lines are skipped, only the last tail_size lines are kept
+    assert log.tail() == [
+        "Successfully installed torch-2.0.0",
+        "Step 4/4 : ENV PATH=/opt/conda/bin:$PATH",
+        "Successfully built 6e7f8a9b0c1d",
+    ]
+    assert log.tail(1) == ["Successfully built 6e7f8a9b0c1d"]
+
+    records = list(log.records())
+    assert len(records) == 12
+    assert records[0]["step"] is None
+    assert [record["step"] for record in records[3:6]] == ["2/4"] * 3
+    assert records[-1] == {
+        "time": 1_700_000_125.0,
+        "step": "4/4",
+        "line": "Successfully built 6e7f8a9b0c1d",
+    }
+
+
+@pytest.mark.quick_checks
+@pytest.mark.model("N/A")
+@pytest.mark.integration("build_log")
+def test_build_log_rotation(tmp_path, clock):
+    path = tmp_path / "image.ndjson"
+    # a record of "line NN" is 56 bytes, 2 records fit in a file
+    log = build_log.BuildLog(str(path), max_bytes=150, backup_count=2)
+    log.append([f"line {number:02d}" for number in range(10)])
+
+    assert sorted(file.name for file in tmp_path.iterdir()) == [
+        "image.ndjson",
+        "image.ndjson.1",
+        "image.ndjson.2",
+    ]
+    assert all(file.stat().st_size <= 150 for file in tmp_path.iterdir())
+    # the oldest lines are dropped with the last backup
+    assert [record["line"] for record in log.records()] == [
+        f"line {number:02d}" for number in range(4, 10)
+    ]
+
+    # a closed log is reopened for appending
+    log.close()
+    log.write("line 10")
+    assert [record["line"] for record in log.records()][-2:] == ["line 09", "line 10"]
+    log.close()
+
+    # a new log on the same path overwrites the logs of the previous run
+    log = build_log.BuildLog(str(path), max_bytes=150, backup_count=2)
+    log.write("rebuilt")
+    assert [record["line"] for record in log.records()] == ["rebuilt"]
+    assert sorted(file.name for file in tmp_path.iterdir()) == ["image.ndjson"]
+    log.close()
@@ -0,0 +1,171 @@
+from types import SimpleNamespace
+
+import pytest
+
+from src import build_profiler
+
+MB = 1024 * 1024
+
+
+def _step(number, instruction, seconds, cached=False):
+    return {"number": number, "instruction": instruction, "seconds": seconds, "cached": cached}
+
+
+def _layer(created_by, size, step=None):
+    layer = {"created_by": created_by, "size": size}
+    if step:
+        layer["step"] = step
+    return layer
+
+
+def _profile(steps, layers=()):
+    return {"steps": list(steps), "layers": list(layers)}
+
+
+class FakeImage:
+    """
+    Built image with the steps of its build log and the history of its layers, newest first
+    """
+
+    def __init__(self, steps, history):
+        self.repository = "123456789012.dkr.ecr.us-west-2.amazonaws.com/pr-pytorch-training"
+        self.name = "pytorch-training"
+        self.stage = "pre_push"
+        self.ecr_url = f"{self.repository}:2.0-cpu"
+        self.summary = {"image_size": 1000}
+        self.log = SimpleNamespace(
+            steps=[
+                SimpleNamespace(
+                    number=number, instruction=instruction, seconds=seconds, cached=cached
+                )
+                for number, instruction, seconds, cached in steps
+            ]
+        )
+        self.client = SimpleNamespace(
+            history=lambda image_uri: [
+                {"CreatedBy": created_by, "Size": size} for created_by, size in history
+            ]
+        )
+
+
+@pytest.mark.quick_checks
+@pytest.mark.model("N/A")
+@pytest.mark.integration("build_profiler")
+def test_attribute_layers_to_steps():
+    steps = [
+        _step(1, "FROM ubuntu:20.04 AS builder", 1),
+        _step(2, "RUN make", 1),
+        _step(3, "FROM ubuntu:20.04", 1),
+        _step(4, "COPY --from=builder /out /out", 1),
+        _step(5, "RUN pip install torch", 1),
+    ]
+    # the base image layers come first in the history
+    layers = [_layer("ADD file:base", 70 * MB), _layer("COPY /out", MB), _layer("RUN pip", MB)]
+
+    build_profiler.attribute_layers_to_steps(steps, layers)
+
+    assert [layer.get("step") for layer in layers] == [None, 4, 5]
+
+    # more steps in the last stage than layers, nothing is attributed
+    layers = [_layer("RUN pip", MB)]
+    build_profiler.attribute_layers_to_steps(steps, layers)
+    assert "step" not in layers[0]
+
+
+@pytest.mark.quick_checks
+@pytest.mark.model("N/A")
+@pytest.mark.integration("build_profiler")
+def test_build_profiler_diff_steps():
+    previous = _profile(
+        [
+            _step(1, "FROM ubuntu:20.04", 0),
+            _step(2, "RUN apt-get update", 100, cached=True),
+            _step(3, "RUN pip install torch", 200),
+            _step(4, "RUN pip install numpy", 100),
+        ]
+    )
+    current = _profile(
+        [
+            _step(1, "FROM ubuntu:20.04", 0),
+            # a new step shifts the numbers of the following ones
+            _step(2, "RUN curl -O https://example.com/big.tar", 45),
+            _step(3, "RUN apt-get update", 140),
+            # slower, but below the 20% ratio
+            _step(4, "RUN pip install torch", 235),
+            # slower, but below 30s
+            _step(5, "RUN pip install numpy", 125),
+            # new and fast
+            _step(6, "RUN echo done", 1),
+        ]
+    )
+
+    assert build_profiler.BuildProfiler.diff(previous, current) == [
+        "Step 2 (RUN curl -O https://example.com/big.tar) is new and took 45s",
+        "Step 3 (RUN apt-get update) took 140s instead of 100s, it no longer hits the build cache",
+    ]
+    assert build_profiler.BuildProfiler.diff(current, current) == []
+
+
+@pytest.mark.quick_checks
+@pytest.mark.model("N/A")
+@pytest.mark.integration("build_profiler")
+def test_build_profiler_diff_layers():
+    long_instruction = "RUN " + "pip install package && " * 10
+    previous = _profile(
+        [],
+        [
+            _layer("RUN pip install torch", 1000 * MB, step=2),
+            _layer("RUN pip install numpy", 50 * MB, step=3),
+            _layer(long_instruction, 10 * MB, step=4),
+        ],
+    )
+    current = _profile(
+        [],
+        [
+            _layer("RUN pip install torch", 1050 * MB, step=2),
+            _layer("RUN pip install numpy", 80 * MB, step=3),
+            _layer(long_instruction, 45 * MB, step=4),
+            _layer("RUN pip install scipy", 20 * MB, step=5),
+            _layer("ENV PATH=/opt/conda/bin", 0),
+        ],
+    )
+
+    regressions = build_profiler.BuildProfiler.diff(previous, current)
+
+    # largest regressions first, torch grew by less than 10%
+    assert regressions[0] == "Layer of step 4 ({}) grew from 10.0 MB to 45.0 MB".format(
+        long_instruction[: build_profiler.MAX_INSTRUCTION_LENGTH - 3] + "..."
+    )
+    assert regressions[1:] == [
+        "Layer of step 3 (RUN pip install numpy) grew from 50.0 MB to 80.0 MB",
+        "Layer of step 5 (RUN pip install scipy) is new, 20.0 MB",
+    ]
+
+
+@pytest.mark.quick_checks
+@pytest.mark.model("N/A")
+@pytest.mark.integration("build_profiler")
+def test_build_profiler_record_history(tmp_path):
+    profiler = build_profiler.BuildProfiler(profile_dir=str(tmp_path), history_size=3)
+    history = [("ADD file:base", 70 * MB), ("RUN pip install torch", 100 * MB)]
+
+    for seconds in (100, 110, 120, 200):
+        image = FakeImage(
+            [(1, "FROM ubuntu:20.04", 0, False), (2, "RUN pip install torch", seconds, False)],
+            list(reversed(history)),
+        )
+        profile, regressions = profiler.record(image)
+
+    assert regressions == ["Step 2 (RUN pip install torch) took 200s instead of 120s"]
+    assert profile["build_seconds"] == 200
+    assert profile["layers"][-1] == {
+        "created_by": "RUN pip install torch",
+        "size": 100 * MB,
+        "step": 2,
+    }
+    # only the last history_size profiles are kept
+    profiles = profiler.load(image)
+    assert [profile["steps"][1]["seconds"] for profile in profiles] == [110, 120, 200]
+    assert profiler.get_path(image) == str(
+        tmp_path / "pr-pytorch-training-pytorch-training-pre_push.ndjson"
+    )
@@ -0,0 +1,122 @@
+import threading
+import time
+
+import pytest
+
+from src import build_scheduler, constants
+
+
+class ConcurrencyRecorder:
+    """
+    Task functions that record the highest number of tasks of each resource running at once.
+    """
+
+    def __init__(self):
+        self.running = {}
+        self.max_running = {}
+        self._lock = threading.Lock()
+
+    def task(self, resource, seconds=0.05, status=constants.SUCCESS):
+        def function():
+            with self._lock:
+                self.running[resource] = self.running.get(resource, 0) + 1
+                self.max_running[resource] = max(
+                    self.max_running.get(resource, 0), self.running[resource]
+                )
+            time.sleep(seconds)
+            with self._lock:
+                self.running[resource] -= 1
+            return status
+
+        return function
+
+
+@pytest.mark.quick_checks
+@pytest.mark.model("N/A")
+@pytest.mark.integration("build_scheduler")
+def test_build_scheduler_resource_limits():
+    recorder = ConcurrencyRecorder()
+    scheduler = build_scheduler.BuildScheduler({"build": 3, "push": 1})
+    for index in range(8):
+        build = scheduler.add_task(f"build-{index}", recorder.task("build"), "build")
+        scheduler.add_task(f"push-{index}", recorder.task("push"), "push", [build])
+
+    tasks = scheduler.run()
+
+    assert recorder.max_running == {"build": 3, "push": 1}
+    assert all(task.status == constants.SUCCESS and not task.failed for task in tasks.values())
+    for index in range(8):
+        assert tasks[f"push-{index}"].start_time >= tasks[f"build-{index}"].end_time
+
+
+@pytest.mark.quick_checks
+@pytest.mark.model("N/A")
+@pytest.mark.integration("build_scheduler")
+@pytest.mark.parametrize("failure", ["raise", "status"])
+def test_build_scheduler_skips_dependents_of_failed_tasks(failure):
+    def failed_build():
+        if failure == "raise":
+            raise RuntimeError("build failed")
+        return constants.FAIL
+
+    executed = []
+
+    def record(name):
+        return lambda: executed.append(name) or constants.SUCCESS
+
+    scheduler = build_scheduler.BuildScheduler({"build": 2, "push": 2})
+    scheduler.add_task("parent-build", failed_build, "build")
+    scheduler.add_task("child-build", record("child-build"), "build", ["parent-build"])
+    scheduler.add_task("child-push", record("child-push"), "push", ["child-build"])
+    scheduler.add_task("child-retag", record("child-retag"), "push", ["child-push"])
+    scheduler.add_task("other-build", record("other-build"), "build")
+    done = []
+
+    tasks = scheduler.run(on_task_done=lambda task: done.append(task.name))
+
+    assert executed == ["other-build"]
+    assert sorted(done) == sorted(tasks)
+    assert tasks["parent-build"].failed
+    assert (tasks["parent-build"].error is not None) == (failure == "raise")
+    assert tasks["child-build"].skipped_by == "parent-build"
+    assert tasks["child-push"].skipped_by == "child-build"
+    assert tasks["child-retag"].skipped_by == "child-push"
+    assert all(tasks[name].start_time is None for name in ("child-build", "child-push"))
+    assert not tasks["other-build"].failed
+
+
+@pytest.mark.quick_checks
+@pytest.mark.model("N/A")
+@pytest.mark.integration("build_scheduler")
+def test_build_scheduler_add_task_validation():
+    scheduler = build_scheduler.BuildScheduler({"build": 1})
+    scheduler.add_task("build", lambda: constants.SUCCESS, "build")
+
+    with pytest.raises(ValueError, match="already added"):
+        scheduler.add_task("build", lambda: constants.SUCCESS, "build")
+    with pytest.raises(ValueError, match="Unknown resource push"):
+        scheduler.add_task("push", lambda: constants.SUCCESS, "push", ["build"])
+    with pytest.raises(ValueError, match="unknown task common-build"):
+        scheduler.add_task("retag", lambda: constants.SUCCESS, "build", ["common-build"])
+    assert list(scheduler.tasks) == ["build"]
+
+
+@pytest.mark.quick_checks
+@pytest.mark.model("N/A")
+@pytest.mark.integration("build_scheduler")
+def test_build_scheduler_critical_path():
+    """
+    Diamond graph: base -> (fast, slow) -> final. The critical path goes through the slow task.
+    """
+    recorder = ConcurrencyRecorder()
+    scheduler = build_scheduler.BuildScheduler({"build": 2})
+    scheduler.add_task("base", recorder.task("build", 0.05), "build")
+    scheduler.add_task("fast", recorder.task("build", 0.01), "build", ["base"])
+    scheduler.add_task("slow", recorder.task("build", 0.2), "build", ["base"])
+    scheduler.add_task("final", recorder.task("build", 0.01), "build", ["fast", "slow"])
+    assert scheduler.critical_path() == []
+
+    scheduler.run()
+
+    assert [task.name for task in scheduler.critical_path()] == ["base", "slow", "final"]
+    assert scheduler.tasks["final"].start_time >= scheduler.tasks["slow"].end_time
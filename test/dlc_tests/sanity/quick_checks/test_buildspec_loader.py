@@ -0,0 +1,117 @@
+import copy
+import os
+import re
+import time
+
+import pytest
+
+from src import buildspec
+from test.test_utils import get_repository_local_path
+
+
+def _get_buildspec_paths():
+    buildspec_pattern = re.compile(r"buildspec\S*\.yml")
+    dlc_base_dir = get_repository_local_path()
+    buildspec_paths = []
+    for root, _, filenames in os.walk(dlc_base_dir):
+        if ".git" in root.split(os.sep):
+            continue
+        for filename in filenames:
+            if buildspec_pattern.match(filename):
+                buildspec_paths.append(os.path.join(root, filename))
+    return sorted(buildspec_paths)
+
+
+def _to_plain(value):
+    """
+    Converts ruamel round-trip and read-only buildspec values to comparable python values
+    """
+    if isinstance(value, dict):
+        return {str(key): _to_plain(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_to_plain(item) for item in value]
+    for value_type in (bool, int, float, str):
+        if isinstance(value, value_type):
+            return value_type(value)
+    return value
+
+
+def _load(load_function, buildspec_path):
+    """
+    Pointer buildspecs are only supported in PRs, both loaders must reject them outside of PRs
+    """
+    try:
+        return load_function(buildspec_path)
+    except RuntimeError as e:
+        assert "Detected pointer in buildspec" in str(e)
+        return None
+
+
+def _load_round_trip(buildspec_path):
+    round_trip_buildspec = buildspec.Buildspec(round_trip=True)
+    round_trip_buildspec.load(buildspec_path)
+    return round_trip_buildspec._buildspec
+
+
+@pytest.mark.quick_checks
+@pytest.mark.model("N/A")
+@pytest.mark.integration("buildspecs")
+def test_buildspec_loader_matches_round_trip(monkeypatch):
+    """
+    Every buildspec of the repository must resolve to the same values with the cached loader as
+    with the round-trip loader. Also reports the load times of both loaders.
+    """
+    monkeypatch.delenv("BUILD_CONTEXT", raising=False)
+    monkeypatch.setenv("ACCOUNT_ID", "123456789012")
+    monkeypatch.setenv("REGION", "us-west-2")
+    buildspec_paths = _get_buildspec_paths()
+    assert buildspec_paths, "No buildspecs found"
+
+    start_time = time.perf_counter()
+    round_trip_buildspecs = {path: _load(_load_round_trip, path) for path in buildspec_paths}
+    round_trip_seconds = time.perf_counter() - start_time
+
+    start_time = time.perf_counter()
+    buildspecs = {path: _load(buildspec.load_buildspec, path) for path in buildspec_paths}
+    first_load_seconds = time.perf_counter() - start_time
+
+    start_time = time.perf_counter()
+    for path in buildspec_paths:
+        assert _load(buildspec.load_buildspec, path) is buildspecs[path]
+    cached_load_seconds = time.perf_counter() - start_time
+
+    print(
+        f"Loaded {len(buildspec_paths)} buildspecs: round-trip {round_trip_seconds:.2f}s, "
+        f"first load {first_load_seconds:.2f}s, cached load {cached_load_seconds:.4f}s"
+    )
+    for path in buildspec_paths:
+        assert _to_plain(buildspecs[path]) == _to_plain(round_trip_buildspecs[path]), path
+
+
+@pytest.mark.quick_checks
+@pytest.mark.model("N/A")
+@pytest.mark.integration("buildspecs")
+def test_buildspec_loader_cache(tmp_path, monkeypatch):
+    buildspec_path = tmp_path / "buildspec.yml"
+    buildspec_path.write_text(
+        "framework: &FRAMEWORK pytorch\n"
+        "images:\n"
+        "  image:\n"
+        "    repository: !join [ pr-, *FRAMEWORK ]\n"
+        "    context: {}\n"
+    )
+    monkeypatch.delenv("FRAMEWORK", raising=False)
+    loaded = buildspec.load_buildspec(str(buildspec_path))
+    assert loaded["images"]["image"]["repository"] == "pr-pytorch"
+    assert buildspec.load_buildspec(str(buildspec_path)) is loaded
+
+    with pytest.raises(TypeError):
+        loaded["framework"] = "tensorflow"
+    context = copy.deepcopy(loaded["images"]["image"]["context"])
+    context.update({"artifact": {}})
+
+    # Changing an environment variable the buildspec refers to resolves it again
+    monkeypatch.setenv("FRAMEWORK", "tensorflow")
+    reloaded = buildspec.load_buildspec(str(buildspec_path))
+    assert reloaded["framework"] == "tensorflow"
+    assert reloaded["images"]["image"]["repository"] == "pr-tensorflow"
@@ -0,0 +1,82 @@
+import io
+import os
+import tarfile
+
+import pytest
+
+from src import context
+
+
+def _write_tree(root):
+    os.makedirs(root / "context" / "scripts")
+    (root / "context" / "scripts" / "setup.sh").write_text("#!/bin/bash\necho setup\n")
+    (root / "context" / "requirements.txt").write_text("numpy\n" * 1000)
+    (root / "Dockerfile").write_text("FROM ubuntu:20.04\nCOPY context /context\n")
+    return {
+        "dockerfile": {"source": "Dockerfile", "target": "Dockerfile"},
+        "context": {"source": "context", "target": "context"},
+    }
+
+
+@pytest.mark.quick_checks
+@pytest.mark.model("N/A")
+@pytest.mark.integration("build_context")
+@pytest.mark.parametrize("compression", context.COMPRESSIONS)
+def test_context_fragments_form_a_valid_tar(tmp_path, compression):
+    artifacts = _write_tree(tmp_path)
+    build_context = context.Context(
+        artifacts,
+        context_path=str(tmp_path / "out" / "context.tar"),
+        artifact_root=str(tmp_path),
+        compression=compression,
+        cache_dir=str(tmp_path / "cache"),
+    )
+
+    with build_context.open() as context_stream:
+        size = len(context_stream)
+        data = context_stream.read()
+    assert len(data) == size
+    with tarfile.open(fileobj=io.BytesIO(data), mode="r:*") as tar:
+        assert sorted(tar.getnames()) == [
+            "Dockerfile",
+            "context",
+            "context/requirements.txt",
+            "context/scripts",
+            "context/scripts/setup.sh",
+        ]
+        assert tar.extractfile("context/scripts/setup.sh").read() == b"#!/bin/bash\necho setup\n"
+
+    with open(build_context.write(), "rb") as context_file:
+        assert context_file.read() == data
+
+
+@pytest.mark.quick_checks
+@pytest.mark.model("N/A")
+@pytest.mark.integration("build_context")
+def test_context_reuses_fragments_of_unchanged_trees(tmp_path):
+    artifacts = _write_tree(tmp_path)
+
+    def make_context():
+        return context.Context(
+            artifacts,
+            context_path=str(tmp_path / "context.tar"),
+            artifact_root=str(tmp_path),
+            compression="none",
+            cache_dir=str(tmp_path / "cache"),
+        )
+
+    first = make_context()
+    assert not any(fragment.reused for fragment in first.fragments.values())
+
+    second = make_context()
+    assert all(fragment.reused for fragment in second.fragments.values())
+    assert second.digest == first.digest
+    assert second.stats["bytes_reused"] == second.stats["bytes"]
+
+    # only the fragment of the changed tree is archived again
+    (tmp_path / "context" / "requirements.txt").write_text("pandas\n")
+    third = make_context()
+    assert third.fragments["dockerfile"].reused
+    assert not third.fragments["context"].reused
+    assert third.fragments["context"].path != first.fragments["context"].path
+    assert third.digest != first.digest
@@ -0,0 +1,98 @@
+import os
+import shutil
+import subprocess
+import time
+
+import pytest
+
+from miscellaneous_scripts import extract_apt_patch_data
+
+DPKG_STATUS = """Package: libcups2
+Status: install ok installed
+Architecture: amd64
+Source: cups (2.3.1-9ubuntu1.6)
+Version: 2.3.1-9ubuntu1.6
+Description: Common UNIX Printing System(tm) - Core library
+ The Common UNIX Printing System (or CUPS(tm)) is a printing system and
+ general replacement for lpd and the like.
+
+Package: xxd
+Status: install ok installed
+Architecture: amd64
+Source: vim
+Version: 2:8.1.2269-1ubuntu5.7
+
+Package: curl
+Status: install ok installed
+Architecture: amd64
+Version: 7.68.0-1ubuntu2.21
+"""
+
+
+@pytest.mark.quick_checks
+@pytest.mark.model("N/A")
+@pytest.mark.integration("autopatch")
+def test_dpkg_status_parser(tmp_path):
+    status_path = tmp_path / "status"
+    status_path.write_text(DPKG_STATUS)
+    dpkg_status_data = extract_apt_patch_data.get_dpkg_status_data(str(status_path))
+    assert dpkg_status_data == {
+        "libcups2": {"source": "cups", "version": "2.3.1-9ubuntu1.6"},
+        "xxd": {"source": "vim", "version": "2:8.1.2269-1ubuntu5.7"},
+        "curl": {"source": "", "version": "7.68.0-1ubuntu2.21"},
+    }
+    assert extract_apt_patch_data.get_dpkg_status_data(str(tmp_path / "missing")) == {}
+
+    (
+        patch_package_list,
+        upgradable_packages_data_for_impacted_packages,
+    ) = extract_apt_patch_data.update_patch_package_list_and_upgradable_packages_data(
+        installed_packages=["libcups2", "xxd", "curl"],
+        impacted_packages=["cups", "curl", "xxd"],
+        upgradable_packages=["libcups2", "curl"],
+        patch_package_list=[],
+        upgradable_packages_data_for_impacted_packages={},
+        dpkg_status_data=dpkg_status_data,
+    )
+    assert patch_package_list == ["libcups2", "curl"]
+    assert upgradable_packages_data_for_impacted_packages == {
+        "cups": ["libcups2"],
+        "curl": ["curl"],
+    }
+
+
+@pytest.mark.quick_checks
+@pytest.mark.model("N/A")
+@pytest.mark.integration("autopatch")
+@pytest.mark.skipif(
+    not (shutil.which("dpkg") and os.path.exists(extract_apt_patch_data.DPKG_STATUS_PATH)),
+    reason="dpkg is not available",
+)
+def test_dpkg_status_parser_matches_dpkg():
+    """
+    The source packages read from the dpkg status file must be the ones `dpkg -s` reports for every
+    installed package. Also reports the time of both approaches.
+    """
+    packages = subprocess.run(
+        "dpkg-query -W -f '${Package}\\n'", shell=True, capture_output=True, text=True, check=True
+    ).stdout.split()
+
+    start_time = time.perf_counter()
+    dpkg_sources = {}
+    for package in packages:
+        output = subprocess.run(
+            f"dpkg -s {package} | grep ^Source", shell=True, capture_output=True, text=True
+        )
+        dpkg_sources[package] = output.stdout.strip().split()[1] if output.returncode == 0 else ""
+    dpkg_seconds = time.perf_counter() - start_time
+
+    start_time = time.perf_counter()
+    dpkg_status_data = extract_apt_patch_data.get_dpkg_status_data()
+    parser_seconds = time.perf_counter() - start_time
+
+    print(
+        f"Resolved the source of {len(packages)} packages: dpkg -s per package "
+        f"{dpkg_seconds:.2f}s, status file parser {parser_seconds:.4f}s"
+    )
+    for package in packages:
+        assert dpkg_status_data[package]["source"] == dpkg_sources[package], package
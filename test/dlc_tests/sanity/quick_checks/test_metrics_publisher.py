@@ -0,0 +1,140 @@
+import threading
+
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+
+import pytest
+
+from botocore.exceptions import ClientError
+
+from src import metrics
+
+
+class StubCloudWatchClient:
+    """
+    Records the PutMetricData requests, failing the first ones with the given error code.
+    """
+
+    def __init__(self, failures=0, error_code="Throttling"):
+        self.requests = []
+        self.failures = failures
+        self.error_code = error_code
+        self._lock = threading.Lock()
+
+    def put_metric_data(self, MetricData, Namespace):
+        with self._lock:
+            if self.failures > 0:
+                self.failures -= 1
+                raise ClientError(
+                    {"Error": {"Code": self.error_code, "Message": "stub"}}, "PutMetricData"
+                )
+            self.requests.append((Namespace, list(MetricData)))
+        return {"ResponseMetadata": {"HTTPStatusCode": 200}}
+
+
+@pytest.mark.quick_checks
+@pytest.mark.model("N/A")
+@pytest.mark.integration("metrics")
+def test_metrics_publisher_batches():
+    client = StubCloudWatchClient()
+    publisher = metrics.MetricsPublisher("test", client=client)
+    for value in range(metrics.MAX_METRIC_DATA_PER_REQUEST * 2 + 1):
+        publisher.add("metric", value, dimensions=[{"Name": "index", "Value": str(value)}])
+
+    assert not client.requests, "Metrics must not be published before flush"
+    publisher.flush()
+
+    assert sorted(len(metric_data) for _, metric_data in client.requests) == [
+        1,
+        metrics.MAX_METRIC_DATA_PER_REQUEST,
+        metrics.MAX_METRIC_DATA_PER_REQUEST,
+    ]
+    assert all(namespace == "test" for namespace, _ in client.requests)
+    assert publisher.flush() == [], "Flushed metrics must not be published again"
+    assert len(client.requests) == 3
+
+
+@pytest.mark.quick_checks
+@pytest.mark.model("N/A")
+@pytest.mark.integration("metrics")
+def test_metrics_publisher_statistic_sets():
+    client = StubCloudWatchClient()
+    with metrics.MetricsPublisher("test", client=client) as publisher:
+        for value in (3, 1, 2):
+            publisher.add("metric", value, unit="Seconds", aggregate=True)
+        publisher.add(
+            "metric", 5, unit="Seconds", dimensions=[{"Name": "a", "Value": "b"}], aggregate=True
+        )
+
+    ((_, metric_data),) = client.requests
+    assert metric_data[0]["StatisticValues"] == {
+        "SampleCount": 3,
+        "Sum": 6,
+        "Minimum": 1,
+        "Maximum": 3,
+    }
+    assert metric_data[1]["StatisticValues"]["SampleCount"] == 1
+
+
+@pytest.mark.quick_checks
+@pytest.mark.model("N/A")
+@pytest.mark.integration("metrics")
+def test_metrics_publisher_retries():
+    client = StubCloudWatchClient(failures=2)
+    publisher = metrics.MetricsPublisher("test", client=client, backoff_seconds=0)
+    publisher.add("metric", 1)
+    publisher.flush()
+    assert len(client.requests) == 1
+
+    client = StubCloudWatchClient(failures=1, error_code="InvalidParameterValue")
+    publisher = metrics.MetricsPublisher("test", client=client, backoff_seconds=0)
+    publisher.add("metric", 1)
+    with pytest.raises(Exception, match="1 of 1 metric batches could not be published"):
+        publisher.flush()
+    assert not client.requests
+
+
+@pytest.mark.quick_checks
+@pytest.mark.model("N/A")
+@pytest.mark.integration("metrics")
+def test_push_image_metrics_step_times():
+    client = StubCloudWatchClient()
+    image_metrics = metrics.Metrics(context="PR")
+    image_metrics.publisher = metrics.MetricsPublisher("test", client=client)
+    start_time = datetime(2024, 1, 31, 10, 0, 0)
+    image = SimpleNamespace(
+        framework="pytorch",
+        version="2.0",
+        device_type="cpu",
+        python_version="py310",
+        image_type="training",
+        stage="pre_push",
+        build_status=metrics.constants.SUCCESS,
+        summary={
+            "start_time": start_time,
+            "end_time": start_time + timedelta(seconds=360),
+            "image_size": 1000,
+        },
+        log=SimpleNamespace(
+            steps=[
+                SimpleNamespace(number=number, seconds=seconds)
+                for number, seconds in enumerate((10, 300, 50), 1)
+            ]
+        ),
+    )
+
+    image_metrics.push_image_metrics(image)
+    image_metrics.flush()
+
+    ((_, metric_data),) = client.requests
+    metric_data = {datum["MetricName"]: datum for datum in metric_data}
+    assert sorted(metric_data) == ["build_status", "build_step_time", "build_time", "image_size"]
+    assert metric_data["build_time"]["Value"] == 360
+    # the steps of an image are published as a single statistic set
+    assert metric_data["build_step_time"]["StatisticValues"] == {
+        "SampleCount": 3,
+        "Sum": 360,
+        "Minimum": 10,
+        "Maximum": 300,
+    }
+    assert metric_data["build_step_time"]["Dimensions"] == metric_data["build_time"]["Dimensions"]
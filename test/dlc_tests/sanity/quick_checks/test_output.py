@@ -0,0 +1,139 @@
+import json
+
+from concurrent.futures import Future
+from contextlib import contextmanager
+from types import SimpleNamespace
+
+import pytest
+
+from src import output
+
+
+def _future(result=None, exception=None):
+    future = Future()
+    if exception is not None:
+        future.set_exception(exception)
+    else:
+        future.set_result(result)
+    return future
+
+
+@pytest.fixture
+def tty(capsys, monkeypatch):
+    """stdout is a terminal, reprint redraws a plain list"""
+    stdout = SimpleNamespace(isatty=lambda: True, flush=lambda: None)
+    monkeypatch.setattr(output, "sys", SimpleNamespace(stdout=stdout))
+
+    @contextmanager
+    def reprint_output(output_type, initial_len, interval):
+        yield [""] * initial_len
+
+    monkeypatch.setattr(output.reprint, "output", reprint_output)
+    return capsys
+
+
+@pytest.mark.quick_checks
+@pytest.mark.model("N/A")
+@pytest.mark.integration("output")
+def test_task_event_status_line(tty):
+    formatter = output.OutputFormatter()
+
+    formatter.task_event("pytorch-training", "Success", 12.34, done=1, total=2)
+    formatter.task_event(
+        "pytorch-inference", "Success", 4, transferred_bytes=8 * 1024 * 1024, done=2, total=2
+    )
+    formatter.task_event("tensorflow-training", "Error")
+
+    assert tty.readouterr().out.splitlines() == [
+        f"[1/2] pytorch-training{'.' * 10}Success (12.3s)",
+        f"[2/2] pytorch-inference{'.' * 10}Success (4.0s, 8.0 MB at 2.0 MB/s)",
+        f"tensorflow-training{'.' * 10}Error",
+    ]
+
+
+@pytest.mark.quick_checks
+@pytest.mark.model("N/A")
+@pytest.mark.integration("output")
+def test_task_event_json(capsys):
+    formatter = output.OutputFormatter()
+
+    formatter.task_event(
+        "pytorch-inference", "Success", 4, transferred_bytes=8 * 1024 * 1024, done=2, total=2
+    )
+    formatter.task_event("tensorflow-training", "Error", transferred_bytes=1024)
+
+    assert [json.loads(line) for line in capsys.readouterr().out.splitlines()] == [
+        {
+            "event": "progress",
+            "name": "pytorch-inference",
+            "status": "Success",
+            "done": 2,
+            "total": 2,
+            "elapsed_seconds": 4,
+            "bytes": 8 * 1024 * 1024,
+            "bytes_per_second": 2 * 1024 * 1024,
+        },
+        {
+            "event": "progress",
+            "name": "tensorflow-training",
+            "status": "Error",
+            "done": None,
+            "total": None,
+            "bytes": 1024,
+        },
+    ]
+
+
+@pytest.mark.quick_checks
+@pytest.mark.model("N/A")
+@pytest.mark.integration("output")
+def test_progress_json(capsys):
+    formatter = output.OutputFormatter()
+
+    formatter.progress({"pytorch-training": _future(0), "pytorch-inference": _future("built")})
+
+    events = [json.loads(line) for line in capsys.readouterr().out.splitlines()]
+    assert sorted((event["name"], event["status"]) for event in events) == [
+        ("pytorch-inference", "built"),
+        ("pytorch-training", output.constants.STATUS_MESSAGE[0]),
+    ]
+    assert sorted(event["done"] for event in events) == [1, 2]
+    assert all(event["total"] == 2 and "elapsed_seconds" not in event for event in events)
+
+
+@pytest.mark.quick_checks
+@pytest.mark.model("N/A")
+@pytest.mark.integration("output")
+def test_progress_status_lines(tty):
+    formatter = output.OutputFormatter()
+
+    formatter.progress({"pytorch-training": _future(0), "pytorch-inference": _future("built")})
+
+    assert tty.readouterr().out.splitlines() == [
+        f"pytorch-training{'.' * 10}{output.constants.STATUS_MESSAGE[0]}",
+        f"pytorch-inference{'.' * 10}built",
+    ]
+
+
+@pytest.mark.quick_checks
+@pytest.mark.model("N/A")
+@pytest.mark.integration("output")
+def test_progress_raises_first_error(capsys):
+    formatter = output.OutputFormatter()
+    error = RuntimeError("build failed")
+
+    with pytest.raises(RuntimeError) as raised:
+        formatter.progress(
+            {
+                "pytorch-training": _future(exception=error),
+                "pytorch-inference": _future(0),
+            }
+        )
+
+    assert raised.value is error
+    events = [json.loads(line) for line in capsys.readouterr().out.splitlines()]
+    # every task is reported before the error is raised
+    assert sorted((event["name"], event["status"]) for event in events) == [
+        ("pytorch-inference", output.constants.STATUS_MESSAGE[0]),
+        ("pytorch-training", "Error"),
+    ]
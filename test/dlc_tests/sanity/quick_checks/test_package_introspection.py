@@ -0,0 +1,126 @@
+import json
+import os
+import subprocess
+import sys
+
+import pytest
+
+from src import package_introspection
+
+IMAGE_URI = "123456789012.dkr.ecr.us-west-2.amazonaws.com/pr-pytorch-training:2.0-cpu"
+
+
+class LocalContext:
+    """
+    invoke Context running the collector of "docker exec" and "docker run" commands with the local
+    python, and answering image inspections with a fixed image id.
+    """
+
+    def __init__(self, image_id="sha256:abc"):
+        self.image_id = image_id
+        self.collections = []
+
+    def run(self, command, in_stream=None, hide=False, warn=False):
+        if command.startswith("docker image inspect"):
+            return subprocess.CompletedProcess(command, 0, stdout=f"{self.image_id}\n")
+        self.collections.append(command)
+        patch_details_dir = command.split()[-1]
+        process = subprocess.run(
+            [sys.executable, "-", patch_details_dir],
+            input=in_stream.read(),
+            capture_output=True,
+            text=True,
+        )
+        process.exited = process.returncode
+        return process
+
+
+@pytest.fixture
+def local_image(tmp_path, monkeypatch):
+    monkeypatch.setattr(package_introspection, "_cache", {})
+    monkeypatch.setattr(
+        package_introspection.constants, "PACKAGE_INFORMATION_CACHE_DIR", str(tmp_path / "cache")
+    )
+    monkeypatch.setattr(
+        package_introspection.constants, "PATCHING_INFO_PATH_WITHIN_DLC", str(tmp_path / "patch")
+    )
+    os.makedirs(tmp_path / "patch" / "patch-details")
+    (tmp_path / "patch" / "patch-details" / "vuln_deactivation_data.json").write_text("{}")
+    return tmp_path
+
+
+@pytest.mark.quick_checks
+@pytest.mark.model("N/A")
+@pytest.mark.integration("package_introspection")
+def test_collector_script(local_image):
+    package_information = package_introspection.get_package_information(
+        IMAGE_URI, container_id="container", ctx=LocalContext()
+    )
+
+    assert package_information["image_id"] == "sha256:abc"
+    python_packages = {
+        package["name"]: package["version"] for package in package_information["python_packages"]
+    }
+    assert python_packages["pytest"] == pytest.__version__
+    assert list(package_information["commands"]) == list(package_introspection.PACKAGE_COMMANDS)
+    assert all(
+        set(result) == {"exit_code", "output", "error"}
+        for result in package_information["commands"].values()
+    )
+    assert package_information["patch_details"] == {"vuln_deactivation_data.json": "{}"}
+
+
+@pytest.mark.quick_checks
+@pytest.mark.model("N/A")
+@pytest.mark.integration("package_introspection")
+def test_package_information_cache(local_image, monkeypatch):
+    ctx = LocalContext()
+    package_information = package_introspection.get_package_information(IMAGE_URI, ctx=ctx)
+    assert package_introspection.get_package_information(IMAGE_URI, ctx=ctx) is package_information
+    assert len(ctx.collections) == 1
+    assert "docker run --rm -i --entrypoint python" in ctx.collections[0]
+
+    # another process loads the document from the cache directory
+    monkeypatch.setattr(package_introspection, "_cache", {})
+    assert package_introspection.get_package_information(IMAGE_URI, ctx=ctx) == package_information
+    assert len(ctx.collections) == 1
+
+    # a corrupt cache file is collected again and replaced
+    cache_path = local_image / "cache" / "sha256-abc.json"
+    cache_path.write_text('{"python_packages": [')
+    monkeypatch.setattr(package_introspection, "_cache", {})
+    assert package_introspection.get_package_information(IMAGE_URI, ctx=ctx) == package_information
+    assert len(ctx.collections) == 2
+    with open(cache_path) as cache_file:
+        assert json.load(cache_file) == package_information
+
+    # another image id is collected separately
+    other_ctx = LocalContext(image_id="sha256:def")
+    package_introspection.get_package_information(IMAGE_URI, ctx=other_ctx)
+    assert len(other_ctx.collections) == 1
+    assert sorted(os.listdir(local_image / "cache")) == ["sha256-abc.json", "sha256-def.json"]
+
+
+@pytest.mark.quick_checks
+@pytest.mark.model("N/A")
+@pytest.mark.integration("package_introspection")
+def test_scanned_package_information(local_image, monkeypatch):
+    ctx = LocalContext()
+    image_package_information = package_introspection.get_package_information(IMAGE_URI, ctx=ctx)
+    image_package_information["python_packages"] = [
+        {"name": "pytest", "version": "0.1"},
+        {"name": "removed", "version": "1.0"},
+    ]
+
+    # the scanner upgraded pytest and installed its own requirements
+    package_information = package_introspection.get_scanned_package_information(
+        IMAGE_URI, "container", ctx=ctx
+    )
+
+    assert ctx.collections[-1].startswith("docker exec -i container python -")
+    assert package_information["python_packages"] == [
+        {"name": "pytest", "version": pytest.__version__}
+    ]
+    assert package_information["patch_details"] == image_package_information["patch_details"]
+    # the cached document of the image is left unchanged
+    assert image_package_information["python_packages"][0]["version"] == "0.1"
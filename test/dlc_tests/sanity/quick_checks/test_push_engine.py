@@ -0,0 +1,166 @@
+import collections
+import threading
+import time
+
+import pytest
+
+from src import constants, push_engine
+
+REGISTRY = "123456789012.dkr.ecr.us-west-2.amazonaws.com"
+
+
+class FakeRegistry:
+    """
+    Layers in the registry, with the number of times each one was uploaded.
+    """
+
+    def __init__(self):
+        self.layers = set()
+        self.uploads = collections.Counter()
+        self.tags = {}
+        self.lock = threading.Lock()
+
+
+class FakeDockerClient:
+    def __init__(self, images):
+        self.images = images
+
+    def inspect_image(self, image_uri):
+        image_id, layers = self.images[image_uri]
+        return {"Id": image_id, "RootFS": {"Layers": layers}, "Size": 100 * len(layers)}
+
+    def history(self, image_uri):
+        _, layers = self.images[image_uri]
+        # newest entry first, with an ENV entry that does not create a layer
+        return [{"Size": 0}] + [{"Size": 100} for _ in layers]
+
+
+class FakeImage:
+    def __init__(self, registry, client, repository, tag, fail=False):
+        self.registry = registry
+        self.client = client
+        self.repository = repository
+        self.tag = tag
+        self.ecr_url = f"{repository}:{tag}"
+        self.fail = fail
+        self.pushed_bytes = 0
+        self.docker_pushes = []
+        self.recorded_tags = []
+
+    def push_image(self, tag_value=None):
+        self.docker_pushes.append(tag_value or self.tag)
+        time.sleep(0.05)
+        if self.fail:
+            raise RuntimeError("push failed")
+        _, layers = self.client.images[self.ecr_url]
+        with self.registry.lock:
+            new_layers = [layer for layer in layers if layer not in self.registry.layers]
+            self.registry.layers.update(new_layers)
+            self.registry.uploads.update(new_layers)
+            self.registry.tags[(self.repository, tag_value or self.tag)] = self.ecr_url
+        self.pushed_bytes = 100 * len(new_layers)
+        return constants.SUCCESS
+
+    def record_pushed_tag(self, tag, message):
+        self.recorded_tags.append(tag)
+        return constants.SUCCESS
+
+
+class FakeECRClient:
+    def __init__(self, registry):
+        self.registry = registry
+
+    def batch_get_image(self, imageIds, repositoryName, registryId, acceptedMediaTypes):
+        image_uri = self.registry.tags[(f"{REGISTRY}/{repositoryName}", imageIds[0]["imageTag"])]
+        return {"images": [{"imageManifest": image_uri}]}
+
+    def put_image(self, imageTag, imageManifest, repositoryName, registryId):
+        with self.registry.lock:
+            self.registry.tags[(f"{REGISTRY}/{repositoryName}", imageTag)] = imageManifest
+
+
+def _push_all(engine, images):
+    statuses = {}
+    errors = {}
+
+    def push(image):
+        try:
+            statuses[image.ecr_url] = engine.push(image)
+        except Exception as e:
+            errors[image.ecr_url] = e
+
+    threads = [threading.Thread(target=push, args=(image,)) for image in images]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(timeout=30)
+    assert not any(thread.is_alive() for thread in threads), "A push never finished"
+    return statuses, errors
+
+
+@pytest.mark.quick_checks
+@pytest.mark.model("N/A")
+@pytest.mark.integration("push_engine")
+def test_push_engine_pushes_images_and_layers_once():
+    registry = FakeRegistry()
+    repository = f"{REGISTRY}/pr-pytorch-training"
+    client = FakeDockerClient(
+        {
+            f"{repository}:cpu": ("sha256:cpu", ["base-0", "base-1", "cpu"]),
+            f"{repository}:cpu-example": ("sha256:cpu-example", ["base-0", "base-1", "cpu", "ex"]),
+            f"{repository}:gpu": ("sha256:gpu", ["base-0", "base-1", "gpu"]),
+            # same image id as cpu, only its tag must be added
+            f"{repository}:cpu-latest": ("sha256:cpu", ["base-0", "base-1", "cpu"]),
+        }
+    )
+    images = [
+        FakeImage(registry, client, repository, tag)
+        for tag in ("cpu", "cpu-example", "gpu", "cpu-latest")
+    ]
+    engine = push_engine.PushEngine(max_bytes_in_flight=10 * 1024)
+    engine._ecr_clients["us-west-2"] = FakeECRClient(registry)
+
+    statuses, errors = _push_all(engine, images)
+
+    assert not errors
+    assert set(statuses.values()) == {constants.SUCCESS}
+    # every layer is uploaded exactly once
+    assert registry.uploads == {layer: 1 for layer in ("base-0", "base-1", "cpu", "gpu", "ex")}
+    # one of cpu and cpu-latest is pushed, the other one is tagged in the registry
+    docker_pushes = [tag for image in images for tag in image.docker_pushes]
+    recorded_tags = [tag for image in images for tag in image.recorded_tags]
+    assert len(docker_pushes) == 3 and engine.docker_pushes == 3
+    assert len(recorded_tags) == 1 and recorded_tags[0] in ("cpu", "cpu-latest")
+    assert sorted(docker_pushes + recorded_tags) == ["cpu", "cpu-example", "cpu-latest", "gpu"]
+    assert registry.tags[(repository, "cpu-latest")] == registry.tags[(repository, "cpu")]
+    assert engine.manifest_tags == 1
+    assert engine.transferred_bytes == 500
+    assert engine.naive_bytes == 1300
+
+
+@pytest.mark.quick_checks
+@pytest.mark.model("N/A")
+@pytest.mark.integration("push_engine")
+def test_push_engine_failed_push_releases_waiters():
+    registry = FakeRegistry()
+    repository = f"{REGISTRY}/pr-tensorflow-inference"
+    client = FakeDockerClient(
+        {
+            f"{repository}:broken": ("sha256:broken", ["base-0", "base-1", "broken"]),
+            f"{repository}:cpu": ("sha256:cpu", ["base-0", "base-1", "cpu"]),
+            f"{repository}:gpu": ("sha256:gpu", ["base-0", "base-1", "gpu"]),
+        }
+    )
+    broken = FakeImage(registry, client, repository, "broken", fail=True)
+    images = [FakeImage(registry, client, repository, tag) for tag in ("cpu", "gpu")]
+    engine = push_engine.PushEngine()
+    engine._ecr_clients["us-west-2"] = FakeECRClient(registry)
+
+    # the broken image holds the shared base layers while the others wait for them
+    statuses, errors = _push_all(engine, [broken] + images)
+
+    assert list(errors) == [broken.ecr_url]
+    assert statuses == {image.ecr_url: constants.SUCCESS for image in images}
+    assert registry.uploads == {layer: 1 for layer in ("base-0", "base-1", "cpu", "gpu")}
+    assert engine._bytes_in_flight == 0
+    assert not engine._uploading_layers and not engine._pushing_images
@@ -0,0 +1,116 @@
+import json
+import os
+import threading
+import time
+
+import pytest
+
+from src import vulnerability_db
+
+
+def _write_fixture_database(mirror_dir, vulnerabilities):
+    os.makedirs(mirror_dir, exist_ok=True)
+    insecure = dict({"$meta": {"timestamp": 0}}, **vulnerabilities)
+    for file_name in vulnerability_db.SAFETY_DB_FILES:
+        with open(os.path.join(mirror_dir, file_name), "w") as db_file:
+            json.dump(insecure, db_file)
+
+
+@pytest.mark.quick_checks
+@pytest.mark.model("N/A")
+@pytest.mark.integration("safety")
+def test_safety_database_snapshot_versions(tmp_path):
+    mirror_dir = str(tmp_path / "mirror")
+    _write_fixture_database(mirror_dir, {"numpy": ["<1.22.0"]})
+    snapshot = vulnerability_db.SafetyDatabaseSnapshot(
+        snapshot_dir=str(tmp_path / "snapshot"), mirror=mirror_dir, max_age_hours=1
+    )
+
+    first_path = snapshot.refresh()
+    with open(os.path.join(first_path, "insecure.json")) as db_file:
+        assert json.load(db_file)["numpy"] == ["<1.22.0"]
+
+    # The snapshot is not refreshed while it is recent, even if the database changed
+    _write_fixture_database(mirror_dir, {"numpy": ["<1.22.0"], "pillow": ["<9.0.1"]})
+    assert snapshot.refresh() == first_path
+
+    second_path = snapshot.refresh(force=True)
+    assert second_path != first_path
+    assert snapshot.get_delta(os.path.basename(first_path), os.path.basename(second_path)) == {
+        "added": ["pillow"],
+        "removed": [],
+        "changed": [],
+    }
+
+    # Unchanged content keeps its version
+    assert snapshot.refresh(force=True) == second_path
+    assert snapshot.get_docker_volume_argument().endswith(
+        f"{second_path}:{vulnerability_db.constants.SAFETY_DB_PATH_WITHIN_CONTAINER}:ro"
+    )
+
+
+@pytest.mark.quick_checks
+@pytest.mark.model("N/A")
+@pytest.mark.integration("safety")
+def test_package_metadata_cache(tmp_path):
+    index_dir = tmp_path / "index"
+    os.makedirs(index_dir / "pyyaml")
+    with open(index_dir / "pyyaml" / "json", "w") as metadata_file:
+        json.dump(
+            {"info": {"version": "6.0.1"}, "releases": {"6.0": [], "6.0.1": []}}, metadata_file
+        )
+    cache = vulnerability_db.PackageMetadataCache(
+        cache_dir=str(tmp_path / "cache"), ttl_hours=1, index_url=index_dir.as_uri()
+    )
+
+    assert cache.get_latest_version("PyYAML") == "6.0.1"
+
+    # Entries are served from the cache within the TTL
+    os.remove(index_dir / "pyyaml" / "json")
+    assert cache.get_latest_version("pyyaml") == "6.0.1"
+
+    # and expired entries are still used when the index cannot be reached
+    entry_path = tmp_path / "cache" / "pyyaml.json"
+    with open(entry_path) as entry_file:
+        entry = json.load(entry_file)
+    entry["fetched_at"] = time.time() - 2 * 3600
+    with open(entry_path, "w") as entry_file:
+        json.dump(entry, entry_file)
+    assert cache.get_latest_version("pyyaml") == "6.0.1"
+
+    # a corrupt entry is a cache miss
+    with open(entry_path, "w") as entry_file:
+        entry_file.write('{"fetched_at": ')
+    with open(index_dir / "pyyaml" / "json", "w") as metadata_file:
+        json.dump({"info": {"version": "6.0.2"}, "releases": {"6.0.2": []}}, metadata_file)
+    assert cache.get_latest_version("pyyaml") == "6.0.2"
+    assert sorted(os.listdir(tmp_path / "cache")) == ["pyyaml.json"]
+
+    with pytest.raises(OSError):
+        cache.get_latest_version("numpy")
+
+
+@pytest.mark.quick_checks
+@pytest.mark.model("N/A")
+@pytest.mark.integration("safety")
+def test_concurrent_cache_writes(tmp_path):
+    entry_path = str(tmp_path / "pyyaml.json")
+    errors = []
+
+    def write(writer):
+        try:
+            for index in range(50):
+                vulnerability_db._write_json(entry_path, {"writer": writer, "index": index})
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=write, args=(writer,)) for writer in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert not errors
+    with open(entry_path) as entry_file:
+        assert json.load(entry_file)["index"] == 49
+    assert os.listdir(tmp_path) == ["pyyaml.json"]
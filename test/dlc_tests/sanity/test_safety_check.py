@@ -13,10 +13,10 @@ from packaging.specifiers import SpecifierSet
 from packaging.version import Version
 
 import pytest
-import requests
 
 from invoke import run
 
+from src.vulnerability_db import PackageMetadataCache
 from test.test_utils import (
     CONTAINER_TESTS_PREFIX,
     is_dlc_cicd_context,
@@ -1040,10 +1040,7 @@ def _get_latest_package_version(package):
     :param package: str Name of the package whose latest version must be retrieved
     :return: tuple(command_success: bool, latest_version_value: str)
     """
-    # safe
-    pypi_package_info = requests.get(f"https://pypi.org/pypi/{package}/json")
-    data = json.loads(pypi_package_info.text)
-    versions = data["releases"].keys()
+    versions = PackageMetadataCache().get(package)["releases"].keys()
     return str(max(Version(v) for v in versions))
 
 
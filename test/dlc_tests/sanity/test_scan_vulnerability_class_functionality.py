@@ -1,15 +1,26 @@
+import fcntl
 import os
 import json
+import threading
+import time
 
 import pytest
 
-from test.test_utils import LOGGER, EnhancedJSONEncoder, is_huggingface_image
+from test.test_utils import (
+    LOGGER,
+    EnhancedJSONEncoder,
+    is_huggingface_image,
+    uniquify_list_of_dict,
+)
 
 # Required to prevent circular dependency while importing
 from test.test_utils import ecr as ecr_utils
 from test.test_utils.security import (
     CVESeverity,
     ECREnhancedScanVulnerabilityList,
+    ECRScanCoordinator,
+    ECRScanFailureException,
+    ECRScanStatusCache,
     generate_future_allowlist,
 )
 
@@ -304,3 +315,418 @@ def test_future_allowlist_generation():
     assert (
         future_allowlist == stored_future_allowlist_for_comparison
     ), "Incorrect Future Allowlist generated"
+
+
+def _generate_synthetic_ecr_scan_results(number_of_findings, number_of_packages, seed):
+    """
+    Generates ECR Enhanced Scan findings in the format of ecr_scan_result1.json, spread over number_of_packages packages.
+    Findings with the same index are identical for every seed, the other ones differ in their CVE ids.
+    """
+    findings = []
+    for index in range(number_of_findings):
+        vulnerability_id = f"CVE-{index}" if index % 10 else f"CVE-{seed}-{index}"
+        package_name = f"package{index % number_of_packages}"
+        findings.append(
+            {
+                "description": f"description of {vulnerability_id}",
+                "packageVulnerabilityDetails": {
+                    "cvss": [{"baseScore": 7.5, "source": "NVD", "version": "3.1"}],
+                    "source": "NVD",
+                    "sourceUrl": f"https://nvd.nist.gov/vuln/detail/{vulnerability_id}",
+                    "vulnerabilityId": vulnerability_id,
+                    "vulnerablePackages": [
+                        {
+                            "filePath": "usr/lib",
+                            "name": package_name,
+                            "packageManager": "OS",
+                            "version": f"1.{seed}",
+                        }
+                    ],
+                },
+                "remediation": {"recommendation": {"text": "None Provided"}},
+                "severity": "HIGH",
+                "status": "ACTIVE",
+                "title": f"{vulnerability_id} - {package_name}",
+            }
+        )
+    return findings
+
+
+def _reference_subtraction(vulnerability_list_1, vulnerability_list_2):
+    """
+    Pairwise implementation of ScanVulnerabilityList.__sub__ before the vulnerability lists were indexed
+    """
+    missing_vulnerabilities = []
+    for package_vulnerabilities in vulnerability_list_1.vulnerability_list.values():
+        for vulnerability in package_vulnerabilities:
+            package_name = vulnerability.package_name
+            if not any(
+                vulnerability_list_2.are_vulnerabilities_equivalent(vulnerability, allowed)
+                for allowed in vulnerability_list_2.vulnerability_list.get(package_name, [])
+            ):
+                missing_vulnerabilities.append(vulnerability)
+    difference = ECREnhancedScanVulnerabilityList(
+        minimum_severity=vulnerability_list_1.minimum_severity
+    )
+    difference.construct_allowlist_from_allowlist_formatted_vulnerabilities(missing_vulnerabilities)
+    return difference
+
+
+def _reference_addition(vulnerability_list_1, vulnerability_list_2):
+    """
+    Implementation of ScanVulnerabilityList.__add__ before uniquify_list_of_complex_datatypes
+    serialized each vulnerability only once
+    """
+    all_vulnerabilities = (
+        vulnerability_list_1.get_flattened_vulnerability_list()
+        + vulnerability_list_2.get_flattened_vulnerability_list()
+    )
+    union = ECREnhancedScanVulnerabilityList(minimum_severity=vulnerability_list_1.minimum_severity)
+    union.construct_allowlist_from_allowlist_formatted_vulnerabilities(
+        [
+            type(all_vulnerabilities[0])(**vulnerability)
+            for vulnerability in uniquify_list_of_dict(
+                get_object_after_serialization(all_vulnerabilities)
+            )
+        ]
+    )
+    return union
+
+
+@pytest.mark.usefixtures("sagemaker", "functionality_sanity")
+@pytest.mark.model("N/A")
+@pytest.mark.integration("Benchmark ScanVulnerabilityList operations on large scan results")
+def test_vulnerability_list_operations_on_large_scan_results():
+    """
+    Benchmarks the subtraction, addition and comparison of ECREnhancedScanVulnerabilityList objects constructed from
+    2 synthetic scans of 10000 findings each, and checks that the results are the same as the ones of the pairwise
+    implementations.
+    """
+    vulnerability_lists = []
+    for seed in range(2):
+        vulnerability_list = ECREnhancedScanVulnerabilityList(minimum_severity=CVESeverity["HIGH"])
+        vulnerability_list.construct_allowlist_from_ecr_scan_result(
+            _generate_synthetic_ecr_scan_results(10000, 500, seed)
+        )
+        vulnerability_lists.append(vulnerability_list)
+    vulnerability_list_1, vulnerability_list_2 = vulnerability_lists
+
+    timings = {}
+    for operation, function in (
+        ("subtraction", lambda: vulnerability_list_1 - vulnerability_list_2),
+        ("pairwise subtraction", lambda: _reference_subtraction(*vulnerability_lists)),
+        ("addition", lambda: vulnerability_list_1 + vulnerability_list_2),
+        ("pairwise addition", lambda: _reference_addition(*vulnerability_lists)),
+    ):
+        start_time = time.perf_counter()
+        timings[operation] = (function(), time.perf_counter() - start_time)
+    difference, _ = timings["subtraction"]
+    reference_difference, _ = timings["pairwise subtraction"]
+    union, _ = timings["addition"]
+    reference_union, _ = timings["pairwise addition"]
+    LOGGER.info(
+        "Operations on 10000 findings: "
+        + ", ".join(f"{operation} {seconds:.2f}s" for operation, (_, seconds) in timings.items())
+    )
+
+    assert get_object_after_serialization(
+        difference.vulnerability_list
+    ) == get_object_after_serialization(reference_difference.vulnerability_list)
+    assert len(difference.get_flattened_vulnerability_list()) == 1000
+    assert get_object_after_serialization(
+        union.vulnerability_list
+    ) == get_object_after_serialization(reference_union.vulnerability_list)
+    assert vulnerability_list_1 == vulnerability_list_1
+    assert vulnerability_list_1 != vulnerability_list_2
+    assert (
+        timings["subtraction"][1] < timings["pairwise subtraction"][1]
+    ), "Indexed subtraction is slower than the pairwise one"
+
+
+class FakeECRClient:
+    """
+    Fake ECR client whose image scans complete after a given duration. Images can stay invisible to
+    describe_images for some time, as newly pushed images do.
+    """
+
+    class exceptions:
+        class ImageNotFoundException(Exception):
+            response = {"Error": {"Code": "ImageNotFoundException"}}
+
+    class meta:
+        region_name = "us-west-2"
+
+    def __init__(self, scans):
+        """
+        :param scans: dict, tag -> (scan duration, final status, seconds before the image is visible)
+        """
+        self.start_time = time.monotonic()
+        self.scans = scans
+        self.describe_images_calls = 0
+        self.queried_tags = set()
+
+    def describe_images(self, repositoryName, imageIds):
+        self.describe_images_calls += 1
+        self.queried_tags.update(image_id["imageTag"] for image_id in imageIds)
+        elapsed = time.monotonic() - self.start_time
+        image_details = []
+        for image_id in imageIds:
+            duration, final_status, visible_after = self.scans[image_id["imageTag"]]
+            if elapsed < visible_after:
+                raise self.exceptions.ImageNotFoundException(image_id["imageTag"])
+            status = final_status if elapsed >= duration else "IN_PROGRESS"
+            image_details.append(
+                {
+                    "imageTags": [image_id["imageTag"]],
+                    "imageScanStatus": {"status": status, "description": status},
+                }
+            )
+        return {"imageDetails": image_details}
+
+
+def _wait_with_fixed_interval(ecr_client, image_uri, poll_seconds):
+    """
+    Waits for a scan the way each test did before ECRScanCoordinator: on its own, polled at a fixed
+    interval
+    """
+    repository, tag = image_uri.split("/")[-1].split(":")
+    while True:
+        image_details = ecr_client.describe_images(
+            repositoryName=repository, imageIds=[{"imageTag": tag}]
+        )["imageDetails"]
+        if image_details[0]["imageScanStatus"]["status"] == "ACTIVE":
+            return
+        time.sleep(poll_seconds)
+
+
+def _get_wake_up_delays(ecr_client, wait_function, image_uris):
+    """
+    Waits for every image in its own thread, as concurrent tests do, and returns the time between
+    the end of the scan of each image and the end of its wait
+    """
+    delays = {}
+
+    def wait(image_uri):
+        wait_function(image_uri)
+        duration = ecr_client.scans[image_uri.split(":")[-1]][0]
+        delays[image_uri] = time.monotonic() - ecr_client.start_time - duration
+
+    threads = [threading.Thread(target=wait, args=(image_uri,)) for image_uri in image_uris]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return delays
+
+
+@pytest.mark.usefixtures("sagemaker", "functionality_sanity")
+@pytest.mark.model("N/A")
+@pytest.mark.integration("ECR scan coordinator")
+def test_ecr_scan_coordinator_waits_for_many_images():
+    """
+    Waits for the enhanced scans of 20 images with ECRScanCoordinator, and with an independent fixed
+    interval poll per image. Timings are those of enhanced scans (5 to 10 minutes, polled every
+    minute) scaled down 200 times. Compares the time the waits take past the end of the scans and
+    the number of describe_images calls.
+    """
+    scans = {f"tag-{index}": (1.5 + 0.075 * index, "ACTIVE", 0) for index in range(20)}
+    image_uris = [f"123456789012.dkr.ecr.us-west-2.amazonaws.com/repo:{tag}" for tag in scans]
+
+    fixed_interval_client = FakeECRClient(scans)
+    fixed_interval_delays = _get_wake_up_delays(
+        fixed_interval_client,
+        lambda image_uri: _wait_with_fixed_interval(fixed_interval_client, image_uri, 0.3),
+        image_uris,
+    )
+
+    coordinator_client = FakeECRClient(scans)
+    coordinator = ECRScanCoordinator(
+        min_poll_seconds=0.025, max_poll_seconds=0.3, clock=time.monotonic
+    )
+    coordinator_delays = _get_wake_up_delays(
+        coordinator_client,
+        lambda image_uri: coordinator.wait(coordinator_client, image_uri, scan_type="enhanced"),
+        image_uris,
+    )
+
+    fixed_interval_seconds = sum(fixed_interval_delays.values())
+    coordinator_seconds = sum(coordinator_delays.values())
+    LOGGER.info(
+        f"Waited for {len(image_uris)} scans: fixed interval {fixed_interval_seconds:.2f}s past "
+        f"the end of the scans with {fixed_interval_client.describe_images_calls} describe_images "
+        f"calls, coordinator {coordinator_seconds:.2f}s with "
+        f"{coordinator_client.describe_images_calls} calls"
+    )
+    assert coordinator_seconds < fixed_interval_seconds
+    assert coordinator_client.describe_images_calls < fixed_interval_client.describe_images_calls
+
+
+@pytest.mark.usefixtures("sagemaker", "functionality_sanity")
+@pytest.mark.model("N/A")
+@pytest.mark.integration("ECR scan coordinator")
+def test_ecr_scan_coordinator_failures():
+    """
+    A failed scan raises ECRScanFailureException and an unfinished scan raises TimeoutError, without
+    affecting the other images waited for at the same time. Images that are not visible yet are
+    waited for.
+    """
+    ecr_client = FakeECRClient(
+        {
+            "failed": (0.1, "FAILED", 0),
+            "slow": (60, "COMPLETE", 0),
+            "late": (0.2, "COMPLETE", 0.1),
+            "enhanced": (0.2, "ACTIVE", 0),
+        }
+    )
+    coordinator = ECRScanCoordinator(
+        min_poll_seconds=0.05, max_poll_seconds=0.1, clock=time.monotonic
+    )
+    repository_uri = "123456789012.dkr.ecr.us-west-2.amazonaws.com/repo"
+    results = {}
+
+    def wait(tag, scan_type, timeout_seconds):
+        try:
+            results[tag] = coordinator.wait(
+                ecr_client,
+                f"{repository_uri}:{tag}",
+                scan_type=scan_type,
+                timeout_seconds=timeout_seconds,
+            )
+        except (ECRScanFailureException, TimeoutError) as e:
+            results[tag] = e
+
+    threads = [
+        threading.Thread(target=wait, args=arguments)
+        for arguments in (
+            ("failed", "basic", 5),
+            ("slow", "basic", 0.3),
+            ("late", "basic", 5),
+            ("enhanced", "enhanced", 5),
+        )
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(timeout=10)
+
+    assert isinstance(results["failed"], ECRScanFailureException)
+    assert isinstance(results["slow"], TimeoutError)
+    assert results["late"] == ("COMPLETE", "COMPLETE")
+    assert results["enhanced"] == ("ACTIVE", "ACTIVE")
+
+
+@pytest.mark.usefixtures("sagemaker", "functionality_sanity")
+@pytest.mark.model("N/A")
+@pytest.mark.integration("ECR scan coordinator")
+def test_ecr_scan_coordinator_shares_statuses_between_processes(tmp_path):
+    """
+    Two coordinators, as in two pytest-xdist workers, wait for 10 images each of the same
+    repository. With a shared ECRScanStatusCache, a poll of one queries the images of both, and the
+    other reads their statuses from the cache instead of calling describe_images.
+    """
+    scans = {f"tag-{index}": (0.5 + 0.05 * index, "ACTIVE", 0) for index in range(20)}
+    image_uris = [f"123456789012.dkr.ecr.us-west-2.amazonaws.com/repo:{tag}" for tag in scans]
+
+    def wait_in_two_processes(status_cache):
+        clients = [FakeECRClient(scans), FakeECRClient(scans)]
+        threads = []
+        for index, ecr_client in enumerate(clients):
+            coordinator = ECRScanCoordinator(
+                min_poll_seconds=0.025,
+                max_poll_seconds=0.3,
+                clock=time.monotonic,
+                status_cache=status_cache,
+            )
+            threads.append(
+                threading.Thread(
+                    target=_get_wake_up_delays,
+                    args=(
+                        ecr_client,
+                        lambda image_uri, coordinator=coordinator, ecr_client=ecr_client: (
+                            coordinator.wait(ecr_client, image_uri, scan_type="enhanced")
+                        ),
+                        image_uris[index::2],
+                    ),
+                )
+            )
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join(timeout=10)
+        assert not any(thread.is_alive() for thread in threads), "A wait never finished"
+        return clients
+
+    separate_clients = wait_in_two_processes(None)
+    shared_clients = wait_in_two_processes(
+        ECRScanStatusCache(cache_dir=str(tmp_path), max_age_seconds=0.3)
+    )
+
+    separate_calls = sum(ecr_client.describe_images_calls for ecr_client in separate_clients)
+    shared_calls = sum(ecr_client.describe_images_calls for ecr_client in shared_clients)
+    LOGGER.info(
+        f"Waited for {len(image_uris)} scans in 2 processes with {separate_calls} describe_images "
+        f"calls, {shared_calls} calls with a shared status cache"
+    )
+    assert shared_calls < separate_calls
+    # the images of a process were queried by the other one
+    assert any(ecr_client.queried_tags == set(scans) for ecr_client in shared_clients)
+
+
+@pytest.mark.usefixtures("sagemaker", "functionality_sanity")
+@pytest.mark.model("N/A")
+@pytest.mark.integration("ECR scan coordinator")
+def test_ecr_scan_status_cache_does_not_lock_during_queries(tmp_path):
+    """
+    The file lock is released while a process queries the statuses, the other processes neither
+    wait for it nor query the same images until the query is done or its claim expires.
+    """
+    status_cache = ECRScanStatusCache(cache_dir=str(tmp_path), query_lease_seconds=60)
+    registry = "123456789012.dkr.ecr.us-west-2.amazonaws.com"
+    image_uris = [f"{registry}/repo:tag-{index}" for index in range(2)]
+    queries = []
+
+    def query(query_image_uris):
+        queries.append(query_image_uris)
+        return {image_uri: ("COMPLETE", "COMPLETE") for image_uri in query_image_uris}
+
+    def query_while_another_process_polls(query_image_uris):
+        with open(os.path.join(str(tmp_path), f"{registry}.json.lock"), "a") as lock_file:
+            # raises BlockingIOError if the lock was held
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+        # another process polls its image meanwhile
+        statuses = status_cache.get_statuses(registry, image_uris[1:], {}, query, now=100)
+        assert statuses == {image_uris[1]: (None, "Scan status queried by another process")}
+        return query(query_image_uris)
+
+    statuses = status_cache.get_statuses(
+        registry, image_uris[:1], {}, query_while_another_process_polls, now=100
+    )
+
+    assert statuses == {image_uris[0]: ("COMPLETE", "COMPLETE")}
+    assert queries == [image_uris[:1]]
+    # the other process queries its image on its next poll, without the fresh status of the first
+    assert status_cache.get_statuses(registry, image_uris[1:], {}, query, now=101) == {
+        image_uris[1]: ("COMPLETE", "COMPLETE")
+    }
+    assert queries == [image_uris[:1], image_uris[1:]]
+
+    # a failed query releases its claim
+    def fail(query_image_uris):
+        raise RuntimeError("throttled")
+
+    cache_path = os.path.join(str(tmp_path), f"{registry}.json")
+    with pytest.raises(RuntimeError):
+        status_cache.get_statuses(registry, image_uris[:1], {}, fail, now=200)
+    with open(cache_path) as cache_file:
+        cache = json.load(cache_file)
+    assert "query" not in cache
+
+    # the claim of a process that died while querying expires
+    cache["query"] = {"pid": 0, "time": 200}
+    with open(cache_path, "w") as cache_file:
+        json.dump(cache, cache_file)
+    status_cache.get_statuses(registry, image_uris[:1], {}, query, now=210)
+    assert len(queries) == 2
+    status_cache.get_statuses(registry, image_uris[:1], {}, query, now=260)
+    assert len(queries) == 3 and queries[-1] == image_uris[:1]
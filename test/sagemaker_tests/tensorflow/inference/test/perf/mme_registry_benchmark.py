@@ -0,0 +1,145 @@
+# Copyright 2018-2020 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"). You
+# may not use this file except in compliance with the License. A copy of
+# the License is located at
+#
+#     http://aws.amazon.com/apache2.0/
+#
+# or in the "license" file accompanying this file. This file is
+# distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF
+# ANY KIND, either express or implied. See the License for the specific
+# language governing permissions and limitations under the License.
+"""Benchmark of the MME instance status lookup done by every invocation while models load.
+
+Compares the previous pickle file + lock() approach against the memory-mapped
+TfsInstanceRegistry, with one process loading models and several gunicorn-like worker
+processes invoking the models that have been loaded so far.
+
+Usage (from test/sagemaker_tests/tensorflow/inference):
+    python test/perf/mme_registry_benchmark.py --loads 10 --workers 4
+"""
+
+import argparse
+import fcntl
+import multiprocessing
+import os
+import pickle
+import random
+import sys
+import tempfile
+import time
+
+from contextlib import contextmanager
+
+from stub_tfs import import_service_module, percentile
+
+
+@contextmanager
+def legacy_lock(path):
+    """lock() as it was used with the pickle file, sleeping a second before releasing"""
+    with open(path, "w", encoding="utf8") as f:
+        fcntl.lockf(f.fileno(), fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            time.sleep(1)
+            fcntl.lockf(f.fileno(), fcntl.LOCK_UN)
+
+
+def _instances(i):
+    return [{"rest_port": 10000 + i, "grpc_port": 20000 + i, "pid": os.getpid()}]
+
+
+def load_models(mode, workdir, loads, load_seconds, loaded):
+    multi_model_utils = import_service_module("multi_model_utils")
+    lock_file = os.path.join(workdir, "lock-file.lock")
+    registry = multi_model_utils.TfsInstanceRegistry(os.path.join(workdir, "registry.mmap"))
+    table = {}
+    for i in range(loads):
+        model_lock = legacy_lock if mode == "pickle" else multi_model_utils.lock
+        with model_lock(lock_file):
+            time.sleep(load_seconds)  # tensorflow_model_server startup
+            table["model-{}".format(i)] = _instances(i)
+            if mode == "pickle":
+                with open(os.path.join(workdir, "status.pickle"), "wb") as handle:
+                    pickle.dump(table, handle, protocol=pickle.HIGHEST_PROTOCOL)
+            else:
+                registry.write(table)
+        loaded.value = i + 1
+
+
+def invoke_models(mode, workdir, loads, loaded, latencies):
+    multi_model_utils = import_service_module("multi_model_utils")
+    lock_file = os.path.join(workdir, "lock-file.lock")
+    registry = multi_model_utils.TfsInstanceRegistry(os.path.join(workdir, "registry.mmap"))
+    local_status, generation = {}, 0
+    while loaded.value < loads:
+        if not loaded.value:
+            time.sleep(0.001)
+            continue
+        model_name = "model-{}".format(random.randrange(loaded.value))
+        start = time.perf_counter()
+        if mode == "pickle":
+            if model_name not in local_status:
+                with legacy_lock(lock_file):
+                    with open(os.path.join(workdir, "status.pickle"), "rb") as handle:
+                        local_status = pickle.load(handle)
+        elif registry.generation() != generation:
+            generation, local_status = registry.read()
+        latencies.append(time.perf_counter() - start)
+        assert model_name in local_status
+        time.sleep(0.001)  # the request to TFS
+
+
+def run(mode, args):
+    with tempfile.TemporaryDirectory() as workdir:
+        manager = multiprocessing.Manager()
+        latencies = manager.list()
+        loaded = multiprocessing.Value("i", 0)
+        processes = [
+            multiprocessing.Process(
+                target=load_models, args=(mode, workdir, args.loads, args.load_seconds, loaded)
+            )
+        ]
+        for _ in range(args.workers):
+            processes.append(
+                multiprocessing.Process(
+                    target=invoke_models, args=(mode, workdir, args.loads, loaded, latencies)
+                )
+            )
+        for process in processes:
+            process.start()
+        for process in processes:
+            process.join()
+        return list(latencies)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--loads", type=int, default=10, help="number of models to load")
+    parser.add_argument("--load-seconds", type=float, default=0.5, help="time to start TFS")
+    parser.add_argument("--workers", type=int, default=4, help="number of gunicorn workers")
+    args = parser.parse_args()
+
+    print(
+        "{:<10}{:>12}{:>12}{:>12}{:>12}{:>12}".format(
+            "mode", "requests", "p50 (ms)", "p99 (ms)", "max (ms)", "> 100 ms"
+        )
+    )
+    for mode in ("pickle", "registry"):
+        latencies = run(mode, args)
+        print(
+            "{:<10}{:>12}{:>12.3f}{:>12.3f}{:>12.3f}{:>12}".format(
+                mode,
+                len(latencies),
+                percentile(latencies, 50) * 1000,
+                percentile(latencies, 99) * 1000,
+                max(latencies) * 1000,
+                len([latency for latency in latencies if latency > 0.1]),
+            )
+        )
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,132 @@
+# Copyright 2018-2020 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"). You
+# may not use this file except in compliance with the License. A copy of
+# the License is located at
+#
+#     http://aws.amazon.com/apache2.0/
+#
+# or in the "license" file accompanying this file. This file is
+# distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF
+# ANY KIND, either express or implied. See the License for the specific
+# language governing permissions and limitations under the License.
+"""Helpers shared by the Python service microbenchmarks: a stub TFS REST server and
+access to the modules under tensorflow/inference/docker/build_artifacts/sagemaker."""
+
+import importlib
+import json
+import multiprocessing
+import os
+import sys
+import threading
+import time
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+SERVICE_DIR = os.path.abspath(
+    os.path.join(
+        os.path.dirname(__file__),
+        "..",
+        "..",
+        "..",
+        "..",
+        "..",
+        "..",
+        "tensorflow",
+        "inference",
+        "docker",
+        "build_artifacts",
+        "sagemaker",
+    )
+)
+
+
+class _StubTfsHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+    latency_seconds = 0
+    latency_seconds_per_kb = 0
+    compute_slots = None
+    echo = False
+
+    def _reply(self, body):
+        body = json.dumps(body).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):  # pylint: disable=C0103
+        self._reply({"model_version_status": [{"version": "1", "state": "AVAILABLE"}]})
+
+    def do_POST(self):  # pylint: disable=C0103
+        length = int(self.headers.get("Content-Length", 0))
+        body = self.rfile.read(length)
+        if self.echo:
+            # a prediction as large as the request, sent back in chunks
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(length))
+            self.end_headers()
+            for offset in range(0, length, 64 * 1024):
+                self.wfile.write(body[offset : offset + 64 * 1024])
+            return
+        latency = self.latency_seconds + self.latency_seconds_per_kb * length / 1024
+        if latency:
+            if self.compute_slots:
+                # like a busy model server, requests queue up for a limited number of threads
+                with self.compute_slots:
+                    time.sleep(latency)
+            else:
+                time.sleep(latency)
+        self._reply({"predictions": [3.5, 4.0, 5.5]})
+
+    def log_message(self, format, *args):  # pylint: disable=W0622
+        pass
+
+
+def start_stub_tfs(
+    port=0, latency_seconds=0, latency_seconds_per_kb=0, compute_threads=None, echo=False
+):
+    """Start a stub tensorflow_model_server REST endpoint in a background thread."""
+    handler = type(
+        "StubTfsHandler",
+        (_StubTfsHandler,),
+        {
+            "latency_seconds": latency_seconds,
+            "latency_seconds_per_kb": latency_seconds_per_kb,
+            "compute_slots": threading.Semaphore(compute_threads) if compute_threads else None,
+            "echo": echo,
+        },
+    )
+    server = ThreadingHTTPServer(("localhost", port), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def _serve_stub_tfs(ports, kwargs):
+    server = start_stub_tfs(**kwargs)
+    ports.put(server.server_address[1])
+    threading.Event().wait()
+
+
+def start_stub_tfs_process(**kwargs):
+    """Start a stub TFS in its own process, so it does not compete with the load generator
+    for the GIL. Returns the process and the port it listens on."""
+    ports = multiprocessing.Queue()
+    process = multiprocessing.Process(target=_serve_stub_tfs, args=(ports, kwargs), daemon=True)
+    process.start()
+    return process, ports.get()
+
+
+def import_service_module(name):
+    if SERVICE_DIR not in sys.path:
+        sys.path.insert(0, SERVICE_DIR)
+    return importlib.import_module(name)
+
+
+def percentile(values, pct):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * pct / 100))]
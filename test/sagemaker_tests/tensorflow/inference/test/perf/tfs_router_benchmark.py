@@ -0,0 +1,96 @@
+# Copyright 2018-2020 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"). You
+# may not use this file except in compliance with the License. A copy of
+# the License is located at
+#
+#     http://aws.amazon.com/apache2.0/
+#
+# or in the "license" file accompanying this file. This file is
+# distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF
+# ANY KIND, either express or implied. See the License for the specific
+# language governing permissions and limitations under the License.
+"""Load generation benchmark of the Python service routing policies across TFS instances.
+
+Every stub TFS instance serves a limited number of requests at a time and takes longer for
+larger payloads, so a few large requests are enough to build a queue on an instance.
+
+Usage (from test/sagemaker_tests/tensorflow/inference):
+    python test/perf/tfs_router_benchmark.py --instances 4 -n 4000 -c 16
+"""
+
+import argparse
+import random
+import sys
+import threading
+import time
+
+from concurrent.futures import ThreadPoolExecutor
+
+from stub_tfs import start_stub_tfs_process, import_service_module, percentile
+
+
+def run(policy, instances, payloads, concurrency, tfs_router, tfs_utils):
+    counter = tfs_router.InFlightCounter([i.rest_port for i in instances], max_workers=1)
+    router = tfs_router.Router(policy, counter)
+    sessions = tfs_utils.TfsSessionPool(pool_size=concurrency)
+    latencies = []
+    lock = threading.Lock()
+
+    def send(payload):
+        start = time.perf_counter()
+        instance = router.pick(instances)
+        with router.track(instance):
+            uri = "http://localhost:{}/v1/models/m:predict".format(instance.rest_port)
+            sessions.get(instance.rest_port).post(uri, data=payload).raise_for_status()
+        with lock:
+            latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        for _ in executor.map(send, payloads):
+            pass
+    elapsed = time.perf_counter() - start
+    sessions.close()
+    return len(latencies) / elapsed, percentile(latencies, 50), percentile(latencies, 99)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--instances", type=int, default=4, help="number of stub TFS instances")
+    parser.add_argument("-n", "--count", type=int, default=4000, help="total number of requests")
+    parser.add_argument("-c", "--concurrency", type=int, default=16)
+    parser.add_argument("--large-ratio", type=float, default=0.05, help="share of large requests")
+    parser.add_argument("--latency-ms", type=float, default=10, help="stub TFS latency")
+    parser.add_argument(
+        "--latency-ms-per-kb", type=float, default=4, help="stub TFS latency per KB"
+    )
+    args = parser.parse_args()
+
+    tfs_router = import_service_module("tfs_router")
+    tfs_utils = import_service_module("tfs_utils")
+    servers = [
+        start_stub_tfs_process(
+            latency_seconds=args.latency_ms / 1000,
+            latency_seconds_per_kb=args.latency_ms_per_kb / 1000,
+            compute_threads=2,
+        )
+        for _ in range(args.instances)
+    ]
+    instances = [tfs_router.TfsInstance(port, None) for _, port in servers]
+
+    random.seed(0)
+    small, large = b"0" * 1024, b"0" * 50 * 1024
+    payloads = [large if random.random() < args.large_ratio else small for _ in range(args.count)]
+
+    print("{:<28}{:>10}{:>12}{:>12}".format("policy", "rps", "p50 (ms)", "p99 (ms)"))
+    for policy in tfs_router.ROUTING_POLICIES:
+        rps, p50, p99 = run(policy, instances, payloads, args.concurrency, tfs_router, tfs_utils)
+        print("{:<28}{:>10.0f}{:>12.2f}{:>12.2f}".format(policy, rps, p50 * 1000, p99 * 1000))
+
+    for process, _ in servers:
+        process.terminate()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
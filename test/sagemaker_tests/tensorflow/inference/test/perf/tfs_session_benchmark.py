@@ -0,0 +1,79 @@
+# Copyright 2018-2020 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"). You
+# may not use this file except in compliance with the License. A copy of
+# the License is located at
+#
+#     http://aws.amazon.com/apache2.0/
+#
+# or in the "license" file accompanying this file. This file is
+# distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF
+# ANY KIND, either express or implied. See the License for the specific
+# language governing permissions and limitations under the License.
+"""Microbenchmark of one-shot requests.post vs pooled keep-alive sessions against a stub TFS.
+
+Usage (from test/sagemaker_tests/tensorflow/inference):
+    python test/perf/tfs_session_benchmark.py -n 5000 -c 16
+"""
+
+import argparse
+import sys
+import threading
+import time
+
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+from stub_tfs import start_stub_tfs, import_service_module, percentile
+
+
+def run(post, uri, payload, count, concurrency):
+    latencies = []
+    lock = threading.Lock()
+
+    def worker(n):
+        local = []
+        for _ in range(n):
+            start = time.perf_counter()
+            response = post(uri, data=payload)
+            response.raise_for_status()
+            local.append(time.perf_counter() - start)
+        with lock:
+            latencies.extend(local)
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        for _ in executor.map(worker, [count // concurrency] * concurrency):
+            pass
+    elapsed = time.perf_counter() - start
+    return len(latencies) / elapsed, percentile(latencies, 50), percentile(latencies, 99)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-n", "--count", type=int, default=5000, help="total number of requests")
+    parser.add_argument("-c", "--concurrency", type=int, default=16)
+    parser.add_argument("-p", "--pool-size", type=int, default=16)
+    args = parser.parse_args()
+
+    tfs_utils = import_service_module("tfs_utils")
+    server = start_stub_tfs()
+    port = server.server_address[1]
+    uri = "http://localhost:{}/v1/models/half_plus_three:predict".format(port)
+    payload = '{"instances": [1.0, 2.0, 5.0]}'
+
+    pool = tfs_utils.TfsSessionPool(pool_size=args.pool_size)
+    results = {
+        "requests.post": run(requests.post, uri, payload, args.count, args.concurrency),
+        "TfsSessionPool": run(pool.get(port).post, uri, payload, args.count, args.concurrency),
+    }
+    server.shutdown()
+
+    print("{:<16}{:>10}{:>12}{:>12}".format("mode", "rps", "p50 (ms)", "p99 (ms)"))
+    for mode, (rps, p50, p99) in results.items():
+        print("{:<16}{:>10.0f}{:>12.2f}{:>12.2f}".format(mode, rps, p50 * 1000, p99 * 1000))
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,103 @@
+# Copyright 2018-2020 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"). You
+# may not use this file except in compliance with the License. A copy of
+# the License is located at
+#
+#     http://aws.amazon.com/apache2.0/
+#
+# or in the "license" file accompanying this file. This file is
+# distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF
+# ANY KIND, either express or implied. See the License for the specific
+# language governing permissions and limitations under the License.
+"""Benchmark of the buffered vs streaming default handler with large JSON lines payloads.
+
+The stub TFS echoes the request body back, like a prediction as large as its input. Peak
+memory is the Python heap allocated while one request goes through the handler and its
+response body is consumed chunk by chunk the way the WSGI server does.
+
+Usage (from test/sagemaker_tests/tensorflow/inference):
+    python test/perf/tfs_streaming_benchmark.py --sizes-mb 8 32 128
+"""
+
+# python_service monkey patches with gevent, which must happen before threads are started
+import gevent.monkey
+
+gevent.monkey.patch_all()
+
+import argparse
+import io
+import json
+import os
+import sys
+import time
+import tracemalloc
+
+from stub_tfs import start_stub_tfs_process, import_service_module
+
+
+def json_lines_payload(size_bytes):
+    line = (json.dumps({"features": [0.5] * 64}) + "\n").encode("utf-8")
+    return line * max(1, size_bytes // len(line))
+
+
+def run(handler, payload, port, falcon, tfs_utils):
+    environ = falcon.testing.create_environ(
+        path="/invocations",
+        method="POST",
+        headers={"Content-Type": "application/jsonlines", "Content-Length": str(len(payload))},
+    )
+    environ["wsgi.input"] = io.BytesIO(payload)
+    data, context = tfs_utils.parse_request(
+        falcon.Request(environ), port, None, "model", session=tfs_utils.TfsSessionPool().get(port)
+    )
+
+    tracemalloc.start()
+    start = time.perf_counter()
+    body, _ = handler(data, context)
+    first_byte, received = None, 0
+    for chunk in [body] if isinstance(body, bytes) else body:
+        if first_byte is None:
+            first_byte = time.perf_counter() - start
+        received += len(chunk)
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    assert received == len(payload)
+    return peak, first_byte, elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes-mb", type=int, nargs="+", default=[8, 32, 128])
+    args = parser.parse_args()
+
+    process, port = start_stub_tfs_process(echo=True)
+    os.environ["TFS_REST_PORTS"] = str(port)
+    os.environ["TFS_GRPC_PORTS"] = "9000"
+    python_service = import_service_module("python_service")
+    tfs_utils = import_service_module("tfs_utils")
+    import falcon.testing
+
+    print(
+        "{:<12}{:>12}{:>18}{:>18}{:>12}".format(
+            "mode", "size (MB)", "peak heap (MB)", "first byte (ms)", "total (ms)"
+        )
+    )
+    for size_mb in args.sizes_mb:
+        payload = json_lines_payload(size_mb * 1024 * 1024)
+        for mode, handler in (
+            ("buffered", python_service.default_handler),
+            ("streaming", python_service.streaming_default_handler),
+        ):
+            peak, first_byte, elapsed = run(handler, payload, port, falcon, tfs_utils)
+            print(
+                "{:<12}{:>12}{:>18.1f}{:>18.1f}{:>12.1f}".format(
+                    mode, size_mb, peak / 1024 / 1024, first_byte * 1000, elapsed * 1000
+                )
+            )
+    process.terminate()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
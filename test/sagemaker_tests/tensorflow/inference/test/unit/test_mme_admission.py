@@ -0,0 +1,85 @@
+# Copyright 2018-2020 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"). You
+# may not use this file except in compliance with the License. A copy of
+# the License is located at
+#
+#     http://aws.amazon.com/apache2.0/
+#
+# or in the "license" file accompanying this file. This file is
+# distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF
+# ANY KIND, either express or implied. See the License for the specific
+# language governing permissions and limitations under the License.
+
+import pytest
+
+import tfs_router
+import tfs_utils
+
+GIB = 1024**3
+
+# least recently used first, with the RSS of each TFS pid
+MODELS = [("oldest", [101]), ("older", [102, 103]), ("newest", [104])]
+RSS_BYTES = {101: 1 * GIB, 102: 1 * GIB, 103: 1 * GIB, 104: 4 * GIB}
+
+
+@pytest.fixture
+def memory(monkeypatch):
+    """16 GiB host, set memory["available"] to change the available memory"""
+    memory = {"total": 16 * GIB, "available": 8 * GIB}
+    monkeypatch.setattr(
+        tfs_utils, "get_memory_info", lambda: (memory["total"], memory["available"])
+    )
+    monkeypatch.setattr(tfs_utils, "get_process_rss_bytes", lambda pid: RSS_BYTES[pid])
+    return memory
+
+
+@pytest.mark.model("N/A")
+@pytest.mark.integration("multi-model")
+@pytest.mark.team("inference-toolkit")
+def test_model_fits_without_eviction(memory):
+    # 8 GiB used, 4 more stay under 90% of 16 GiB
+    assert tfs_utils.plan_model_admission(4 * GIB, 1, 1, MODELS, 90) == []
+    # memory is not checked without a limit
+    assert tfs_utils.plan_model_admission(64 * GIB, 1, 1, MODELS) == []
+
+
+@pytest.mark.model("N/A")
+@pytest.mark.integration("multi-model")
+@pytest.mark.team("inference-toolkit")
+def test_model_fits_after_partial_eviction(memory):
+    # 8 + 7.5 GiB is 1.1 GiB over the 14.4 GiB limit, the two least recently used models free 3
+    assert tfs_utils.plan_model_admission(7.5 * GIB, 1, 1, MODELS, 90) == ["oldest", "older"]
+    # 2 more ports are needed, "older" frees 2 of them
+    assert tfs_utils.plan_model_admission(0, 2, 0, MODELS, 90) == ["oldest", "older"]
+    assert tfs_utils.plan_model_admission(0, 1, 0, MODELS) == ["oldest"]
+
+
+@pytest.mark.model("N/A")
+@pytest.mark.integration("multi-model")
+@pytest.mark.team("inference-toolkit")
+def test_model_does_not_fit(memory):
+    # evicting every candidate only frees 7 GiB
+    assert tfs_utils.plan_model_admission(14 * GIB, 1, 1, MODELS, 90) is None
+    # enough memory, but the candidates only hold 4 ports
+    assert tfs_utils.plan_model_admission(0, 6, 1, MODELS, 90) is None
+    assert tfs_utils.plan_model_admission(0, 1, 0, [], 90) is None
+    memory["available"] = 0
+    assert tfs_utils.plan_model_admission(8 * GIB, 1, 1, MODELS, 90) is None
+
+
+@pytest.mark.model("N/A")
+@pytest.mark.integration("multi-model")
+@pytest.mark.team("inference-toolkit")
+def test_router_acquire_releases_once():
+    instance = tfs_router.TfsInstance(8501, 9000)
+    counter = tfs_router.InFlightCounter([8501], max_workers=2)
+    router = tfs_router.Router(tfs_router.LEAST_OUTSTANDING_REQUESTS, counter)
+
+    release = router.acquire(instance)
+    with router.track(instance):
+        assert counter.get(8501) == 2
+    assert counter.get(8501) == 1
+    release()
+    release()
+    assert counter.get(8501) == 0
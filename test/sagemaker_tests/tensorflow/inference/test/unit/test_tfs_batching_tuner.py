@@ -0,0 +1,164 @@
+# Copyright 2018-2020 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"). You
+# may not use this file except in compliance with the License. A copy of
+# the License is located at
+#
+#     http://aws.amazon.com/apache2.0/
+#
+# or in the "license" file accompanying this file. This file is
+# distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF
+# ANY KIND, either express or implied. See the License for the specific
+# language governing permissions and limitations under the License.
+
+import json
+import types
+
+import pytest
+
+import tfs_batching_tuner
+
+
+def _tensor_info(dtype, *dims):
+    return {"dtype": dtype, "tensor_shape": {"dim": [{"size": str(size)} for size in dims]}}
+
+
+def _metadata(inputs):
+    return {
+        "metadata": {"signature_def": {"signature_def": {"serving_default": {"inputs": inputs}}}}
+    }
+
+
+def _result(rps, p99_ms, errors=0, **parameters):
+    return dict(parameters, rps=rps, p50_ms=p99_ms / 2, p99_ms=p99_ms, errors=errors)
+
+
+def _make_tuner(tmp_path, **kwargs):
+    return tfs_batching_tuner.BatchingTuner(
+        start_tfs=None,
+        rest_port=8501,
+        model_name="model",
+        batching_config_file=str(tmp_path / "batching.config"),
+        results_file=str(tmp_path / "results.json"),
+        **kwargs
+    )
+
+
+@pytest.mark.model("N/A")
+@pytest.mark.integration("batching")
+@pytest.mark.team("inference-toolkit")
+def test_synthetic_request():
+    request = tfs_batching_tuner.synthetic_request(
+        _metadata({"x": _tensor_info("DT_FLOAT", -1, 2, -1)})
+    )
+    assert request == {"signature_name": "serving_default", "instances": [[[0.0], [0.0]]]}
+
+    request = tfs_batching_tuner.synthetic_request(
+        _metadata(
+            {
+                "text": _tensor_info("DT_STRING", -1),
+                "ids": _tensor_info("DT_INT64", -1, 3),
+                "mask": {"dtype": "DT_BOOL"},
+            }
+        )
+    )
+    assert request == {
+        "signature_name": "serving_default",
+        "instances": [{"text": "", "ids": [0, 0, 0], "mask": False}],
+    }
+
+
+@pytest.mark.model("N/A")
+@pytest.mark.integration("batching")
+@pytest.mark.team("inference-toolkit")
+def test_choose(tmp_path):
+    tuner = _make_tuner(tmp_path, p99_budget_ms=50)
+
+    # the highest throughput within the p99 budget, among the results without errors
+    chosen = tuner._choose(
+        [
+            _result(100, 20, max_batch_size=8),
+            _result(300, 45, max_batch_size=16),
+            _result(500, 40, errors=3, max_batch_size=32),
+            _result(900, 80, max_batch_size=64),
+        ]
+    )
+    assert chosen["max_batch_size"] == 16
+
+    # the lowest p99 if no result is within the budget
+    chosen = tuner._choose(
+        [_result(900, 80, max_batch_size=64), _result(800, 60, max_batch_size=32)]
+    )
+    assert chosen["max_batch_size"] == 32
+
+    # results with errors are only used if every result has errors
+    chosen = tuner._choose([_result(100, 20, errors=1, max_batch_size=8)])
+    assert chosen["max_batch_size"] == 8
+
+
+@pytest.mark.model("N/A")
+@pytest.mark.integration("batching")
+@pytest.mark.team("inference-toolkit")
+def test_candidates(tmp_path, monkeypatch):
+    monkeypatch.setattr(tfs_batching_tuner.multiprocessing, "cpu_count", lambda: 4)
+    monkeypatch.delenv("SAGEMAKER_BATCH", raising=False)
+    monkeypatch.setenv("SAGEMAKER_TFS_BATCH_TIMEOUT_MICROS", "2000")
+    tuner = _make_tuner(tmp_path)
+
+    assert tuner.candidates() == [
+        {"max_batch_size": size, "batch_timeout_micros": 2000}
+        for size in tfs_batching_tuner.MAX_BATCH_SIZES
+    ]
+    chosen = {"max_batch_size": 32, "batch_timeout_micros": 2000}
+    assert tuner.candidates(1, chosen) == [
+        dict(chosen, num_batch_threads=threads, max_enqueued_batches=enqueued)
+        for threads in (2, 4, 8)
+        for enqueued in (4, 16)
+    ]
+
+    monkeypatch.setenv("SAGEMAKER_BATCH", "true")
+    assert tuner.candidates(1, chosen) == [
+        dict(chosen, num_batch_threads=threads) for threads in (2, 4, 8)
+    ]
+
+
+@pytest.mark.model("N/A")
+@pytest.mark.integration("batching")
+@pytest.mark.team("inference-toolkit")
+def test_tune_stops_at_the_time_budget(tmp_path, monkeypatch):
+    monkeypatch.setattr(tfs_batching_tuner.multiprocessing, "cpu_count", lambda: 4)
+    monkeypatch.delenv("SAGEMAKER_BATCH", raising=False)
+    clock = types.SimpleNamespace(now=0.0)
+    monkeypatch.setattr(
+        tfs_batching_tuner, "time", types.SimpleNamespace(perf_counter=lambda: clock.now)
+    )
+    measured = []
+
+    def run_candidate(parameters):
+        # every candidate takes 10 seconds, larger batches have a higher throughput
+        clock.now += 10
+        measured.append(parameters)
+        return _result(
+            parameters["max_batch_size"] + parameters.get("num_batch_threads", 0), 10, **parameters
+        )
+
+    tuner = _make_tuner(tmp_path, max_seconds=35)
+    monkeypatch.setattr(tuner, "_run_candidate", run_candidate)
+    assert tuner.tune() == {"max_batch_size": 8, "batch_timeout_micros": 1000}
+    assert len(measured) == 3
+    with open(tmp_path / "results.json") as f:
+        results = json.load(f)
+    assert results["stopped_early"]
+    assert len(results["results"]) == 3
+
+    # without a budget, the second stage sweeps the threads with the best batch size
+    measured.clear()
+    tuner = _make_tuner(tmp_path)
+    monkeypatch.setattr(tuner, "_run_candidate", run_candidate)
+    assert tuner.tune() == {
+        "max_batch_size": 64,
+        "batch_timeout_micros": 1000,
+        "num_batch_threads": 8,
+        "max_enqueued_batches": 4,
+    }
+    assert len(measured) == 12 + 6
@@ -0,0 +1,155 @@
+# Copyright 2018-2020 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"). You
+# may not use this file except in compliance with the License. A copy of
+# the License is located at
+#
+#     http://aws.amazon.com/apache2.0/
+#
+# or in the "license" file accompanying this file. This file is
+# distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF
+# ANY KIND, either express or implied. See the License for the specific
+# language governing permissions and limitations under the License.
+
+import io
+import json
+import types
+
+import pytest
+
+tfs_grpc = pytest.importorskip("tfs_grpc")
+
+if not tfs_grpc.GRPC_PREDICT_AVAILABLE:
+    pytest.skip("tensorflow is not installed", allow_module_level=True)
+
+import numpy as np
+
+from tensorflow.core.framework import types_pb2
+from tensorflow.core.protobuf import meta_graph_pb2
+from tensorflow_serving.apis import get_model_metadata_pb2, predict_pb2
+
+
+class FakePredictionServiceStub:
+    """Serves the metadata of a single signature and doubles every input in Predict"""
+
+    def __init__(self, inputs, outputs):
+        self.inputs = inputs
+        self.outputs = outputs
+        self.predict_requests = []
+
+    def GetModelMetadata(self, request, timeout=None):  # pylint: disable=C0103
+        signature = meta_graph_pb2.SignatureDef()
+        for name, dtype in self.inputs.items():
+            signature.inputs[name].dtype = dtype
+        for name, dtype in self.outputs.items():
+            signature.outputs[name].dtype = dtype
+        signature_map = get_model_metadata_pb2.SignatureDefMap()
+        signature_map.signature_def[tfs_grpc.DEFAULT_SIGNATURE_NAME].CopyFrom(signature)
+        response = get_model_metadata_pb2.GetModelMetadataResponse()
+        response.metadata["signature_def"].Pack(signature_map)
+        return response
+
+    def Predict(self, request, timeout=None):  # pylint: disable=C0103
+        self.predict_requests.append(request)
+        response = predict_pb2.PredictResponse()
+        for name, tensor in request.inputs.items():
+            array = tfs_grpc.make_ndarray(tensor) * 2
+            response.outputs[name].CopyFrom(tfs_grpc.make_tensor_proto(array, tensor.dtype))
+        return response
+
+
+def _make_handler(monkeypatch, inputs, outputs=None):
+    stub = FakePredictionServiceStub(inputs, outputs if outputs is not None else inputs)
+    monkeypatch.setattr(
+        tfs_grpc.prediction_service_pb2_grpc, "PredictionServiceStub", lambda channel: stub
+    )
+    fallback_requests = []
+
+    def fallback_handler(data, context):
+        fallback_requests.append(data.read())
+        return "rest", context.accept_header
+
+    return tfs_grpc.GrpcPredictHandler("model", fallback_handler), stub, fallback_requests
+
+
+def _context():
+    return types.SimpleNamespace(
+        channel=object(),
+        request_content_type="application/json",
+        accept_header="application/json",
+        method="predict",
+        model_name=None,
+        model_version=None,
+    )
+
+
+@pytest.mark.model("N/A")
+@pytest.mark.integration("grpc-predict")
+@pytest.mark.team("inference-toolkit")
+def test_grpc_predict_json_instances(monkeypatch):
+    handler, stub, fallback_requests = _make_handler(
+        monkeypatch, {"x": types_pb2.DT_FLOAT, "ids": types_pb2.DT_INT64}
+    )
+    body = json.dumps({"instances": [{"x": [1.5, 2.0], "ids": 1}, {"x": [3.0, 4.0], "ids": 2}]})
+
+    response, content_type = handler(io.BytesIO(body.encode("utf-8")), _context())
+
+    assert content_type == "application/json"
+    assert json.loads(response) == {
+        "predictions": [{"x": [3.0, 4.0], "ids": 2}, {"x": [6.0, 8.0], "ids": 4}]
+    }
+    request = stub.predict_requests[0]
+    assert request.model_spec.name == "model"
+    assert request.inputs["x"].dtype == types_pb2.DT_FLOAT
+    assert not fallback_requests
+
+
+@pytest.mark.model("N/A")
+@pytest.mark.integration("grpc-predict")
+@pytest.mark.team("inference-toolkit")
+def test_grpc_predict_unknown_input(monkeypatch):
+    handler, stub, _ = _make_handler(
+        monkeypatch, {"x": types_pb2.DT_FLOAT, "ids": types_pb2.DT_INT64}
+    )
+    body = json.dumps({"inputs": {"x": [1.0], "idx": [1]}})
+
+    with pytest.raises(ValueError, match=r"input idx not found.*\['ids', 'x'\]"):
+        handler(io.BytesIO(body.encode("utf-8")), _context())
+    assert not stub.predict_requests
+
+
+@pytest.mark.model("N/A")
+@pytest.mark.integration("grpc-predict")
+@pytest.mark.team("inference-toolkit")
+@pytest.mark.parametrize(
+    "inputs, outputs",
+    [
+        ({"x": types_pb2.DT_BFLOAT16}, {"y": types_pb2.DT_FLOAT}),
+        ({"x": types_pb2.DT_FLOAT}, {"y": types_pb2.DT_COMPLEX64}),
+    ],
+)
+def test_grpc_predict_falls_back_to_rest_for_unsupported_dtypes(monkeypatch, inputs, outputs):
+    handler, stub, fallback_requests = _make_handler(monkeypatch, inputs, outputs)
+    body = json.dumps({"instances": [[1.0, 2.0]]}).encode("utf-8")
+
+    assert handler(io.BytesIO(body), _context()) == ("rest", "application/json")
+    assert fallback_requests == [body]
+    assert not stub.predict_requests
+
+
+@pytest.mark.model("N/A")
+@pytest.mark.integration("grpc-predict")
+@pytest.mark.team("inference-toolkit")
+def test_grpc_predict_npy(monkeypatch):
+    handler, _, _ = _make_handler(monkeypatch, {"x": types_pb2.DT_HALF})
+    buffer = io.BytesIO()
+    np.save(buffer, np.arange(6, dtype=np.float16).reshape(2, 3), allow_pickle=False)
+    context = _context()
+    context.request_content_type = context.accept_header = "application/x-npy"
+
+    response, content_type = handler(io.BytesIO(buffer.getvalue()), context)
+
+    assert content_type == "application/x-npy"
+    result = np.load(io.BytesIO(response), allow_pickle=False)
+    assert result.dtype == np.float16
+    assert result.tolist() == [[0.0, 2.0, 4.0], [6.0, 8.0, 10.0]]
@@ -0,0 +1,110 @@
+# Copyright 2018-2020 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"). You
+# may not use this file except in compliance with the License. A copy of
+# the License is located at
+#
+#     http://aws.amazon.com/apache2.0/
+#
+# or in the "license" file accompanying this file. This file is
+# distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF
+# ANY KIND, either express or implied. See the License for the specific
+# language governing permissions and limitations under the License.
+
+import json
+
+import pytest
+
+import tfs_router
+import tfs_utils
+
+
+class FakeResponse:
+    headers = {"Content-Length": "6"}
+
+    def __init__(self):
+        self.closed = 0
+
+    def iter_content(self, chunk_size):
+        yield b"abc"
+        yield b"def"
+
+    def close(self):
+        self.closed += 1
+
+
+@pytest.mark.model("N/A")
+@pytest.mark.integration("streaming")
+@pytest.mark.team("inference-toolkit")
+def test_streaming_response_releases_in_flight_slot_once_relayed():
+    instance = tfs_router.TfsInstance(8501, 9000)
+    counter = tfs_router.InFlightCounter([8501], max_workers=2)
+    router = tfs_router.Router(tfs_router.LEAST_OUTSTANDING_REQUESTS, counter)
+    response = FakeResponse()
+    body = tfs_utils.StreamingResponse(response)
+    body.on_close(router.acquire(instance))
+    assert body.content_length == 6
+
+    chunks = iter(body)
+    assert next(chunks) == b"abc"
+    # still relaying the TFS response
+    assert counter.get(8501) == 1
+    assert list(chunks) == [b"def"]
+    assert counter.get(8501) == 0
+    # the WSGI server closes the body after iterating over it
+    body.close()
+    assert counter.get(8501) == 0
+    assert response.closed == 2
+
+
+@pytest.mark.model("N/A")
+@pytest.mark.integration("streaming")
+@pytest.mark.team("inference-toolkit")
+def test_deferred_request_profile_ends_when_the_body_is_closed(caplog):
+    body = tfs_utils.StreamingResponse(FakeResponse())
+    with caplog.at_level("INFO"), tfs_utils.RequestProfile("model") as profile:
+        with tfs_utils.profile_phase("handler"):
+            pass
+        body.on_close(profile.defer())
+    assert tfs_utils.RequestProfile.active() is None
+    assert "request profile" not in caplog.text
+
+    with caplog.at_level("INFO"):
+        body.close()
+        body.close()
+    assert caplog.text.count("request profile: model=model") == 1
+
+
+@pytest.mark.model("N/A")
+@pytest.mark.integration("metrics")
+@pytest.mark.team("inference-toolkit")
+def test_log_metrics_embedded_metric_format(capsys, monkeypatch):
+    monkeypatch.setattr(tfs_utils.time, "time", lambda: 1700000000.5)
+
+    tfs_utils.log_metrics(
+        {"ModelLoadLatency": 1.25}, dimensions={"Status": "200"}, properties={"Model": "half"}
+    )
+    tfs_utils.log_metrics({"tfs_spawned": 0.5, "nginx_ready": 2.0})
+
+    first, second = [json.loads(line) for line in capsys.readouterr().out.splitlines()]
+    assert first == {
+        "_aws": {
+            "Timestamp": 1700000000500,
+            "CloudWatchMetrics": [
+                {
+                    "Namespace": tfs_utils.METRICS_NAMESPACE,
+                    "Dimensions": [["Status"]],
+                    "Metrics": [{"Name": "ModelLoadLatency", "Unit": "Seconds"}],
+                }
+            ],
+        },
+        "Model": "half",
+        "Status": "200",
+        "ModelLoadLatency": 1.25,
+    }
+    assert second["_aws"]["CloudWatchMetrics"][0]["Dimensions"] == [[]]
+    assert [metric["Name"] for metric in second["_aws"]["CloudWatchMetrics"][0]["Metrics"]] == [
+        "tfs_spawned",
+        "nginx_ready",
+    ]
+    assert second["nginx_ready"] == 2.0
@@ -2161,24 +2161,33 @@ def uniquify_list_of_dict(list_of_dict):
 
 
 def uniquify_list_of_complex_datatypes(list_of_complex_datatypes):
+    """
+    Takes a list of dicts or of dataclass objects of a single type, and returns each distinct
+    element once, sorted by their JSON representation. Each element is serialized and
+    deserialized only once.
+
+    :param list_of_complex_datatypes: List(dict) or List(dataclass)
+    :return: List(dict) or List(dataclass)
+    """
+    if not list_of_complex_datatypes:
+        return list_of_complex_datatypes
+    type_of_elements = type(list_of_complex_datatypes[0])
     assert all(
-        type(element) == type(list_of_complex_datatypes[0]) for element in list_of_complex_datatypes
+        type(element) == type_of_elements for element in list_of_complex_datatypes
     ), f"{list_of_complex_datatypes} has multiple types"
-    if list_of_complex_datatypes:
-        if isinstance(list_of_complex_datatypes[0], dict):
-            return uniquify_list_of_dict(list_of_complex_datatypes)
-        if dataclasses.is_dataclass(list_of_complex_datatypes[0]):
-            type_of_dataclass = type(list_of_complex_datatypes[0])
-            list_of_dict = json.loads(
-                json.dumps(list_of_complex_datatypes, cls=EnhancedJSONEncoder)
-            )
-            uniquified_list = uniquify_list_of_dict(list_of_dict=list_of_dict)
-            return [
-                type_of_dataclass(**uniquified_list_dict_element)
-                for uniquified_list_dict_element in uniquified_list
-            ]
-        raise "Not implemented"
-    return list_of_complex_datatypes
+    is_dataclass = dataclasses.is_dataclass(list_of_complex_datatypes[0])
+    if not is_dataclass and not isinstance(list_of_complex_datatypes[0], dict):
+        raise NotImplementedError(f"Cannot uniquify a list of {type_of_elements}")
+    unique_list_of_string = sorted(
+        {
+            json.dumps(element, cls=EnhancedJSONEncoder, sort_keys=True)
+            for element in list_of_complex_datatypes
+        }
+    )
+    unique_list_of_dict = [json.loads(str_element) for str_element in unique_list_of_string]
+    if is_dataclass:
+        return [type_of_elements(**dict_element) for dict_element in unique_list_of_dict]
+    return unique_list_of_dict
 
 
 def check_if_two_dictionaries_are_equal(dict1, dict2, ignore_keys=[]):
@@ -2,7 +2,7 @@ import os
 
 from datetime import datetime
 
-import boto3
+from src.metrics import MetricsPublisher
 
 
 def construct_duration_metrics_data(start_time, test_path):
@@ -41,7 +41,6 @@ def send_test_duration_metrics(start_time):
     send custom metrics about test duration to cloudwatch
     :param start_time: <datetime> start time of the test execution
     """
-    cloudwatch_client = boto3.client("cloudwatch")
     use_scheduler = os.getenv("USE_SCHEDULER", "False").lower() == "true"
     executor_mode = os.getenv("EXECUTOR_MODE", "False").lower() == "true"
     if not executor_mode:  # metrics should only be sent by the test CB
@@ -51,7 +50,8 @@ def send_test_duration_metrics(start_time):
         else:
             metric_data = construct_duration_metrics_data(start_time, "Without Scheduler")
 
-        cloudwatch_client.put_metric_data(Namespace="DLCCI", MetricData=[metric_data])
+        with MetricsPublisher("DLCCI") as publisher:
+            publisher.add_metric_data(metric_data)
 
 
 def send_test_result_metrics(stdout):
@@ -59,7 +59,6 @@ def send_test_result_metrics(stdout):
     Send custom metrics about test results to cloudwatch.
     :param stdout: <int> 0/1. 0 indicates no error during test execution, 1 indicates errors occurred
     """
-    cloudwatch_client = boto3.client("cloudwatch")
     use_scheduler = os.getenv("USE_SCHEDULER", "False").lower() == "true"
     executor_mode = os.getenv("EXECUTOR_MODE", "False").lower() == "true"
     if not executor_mode:  # metrics should only be sent by the test CB
@@ -69,4 +68,5 @@ def send_test_result_metrics(stdout):
         else:
             metric_data = construct_test_result_metrics_data(stdout, "Without Scheduler")
 
-        cloudwatch_client.put_metric_data(Namespace="DLCCI", MetricData=[metric_data])
+        with MetricsPublisher("DLCCI") as publisher:
+            publisher.add_metric_data(metric_data)
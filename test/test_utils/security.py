@@ -2,9 +2,12 @@ from abc import abstractmethod
 import os
 import json
 import copy, collections
+import contextlib
+import fcntl
+import tempfile
+import threading
 import boto3
 import json
-import requests
 
 from invoke import run, Context
 from time import sleep, time
@@ -28,6 +31,24 @@ from tenacity import (
     wait_random_exponential,
 )
 
+from src.vulnerability_db import PackageMetadataCache
+
+PYPI_METADATA_CACHE = PackageMetadataCache()
+ECR_SCAN_STATUS_CACHE_DIR = os.path.join(tempfile.gettempdir(), "dlc-ecr-scan-status")
+
+
+def _get_dataclass_fields(dataclass_object):
+    """
+    Shallow equivalent of dataclasses.asdict
+
+    :param dataclass_object: dataclass instance
+    :return: dict, field name -> value
+    """
+    return {
+        field.name: getattr(dataclass_object, field.name)
+        for field in dataclasses.fields(dataclass_object)
+    }
+
 
 @dataclass
 class VulnerablePackageDetails:
@@ -155,17 +176,19 @@ class AllowListFormatVulnerabilityForEnhancedScan:
         ## and might differ from  image to image, even when the vulnerability is same.
         ## Also ignore the title key of the vulnerablitiy, because, sometimes, 1 vulnerability impacts multiple packages.
         ## In that case, the title key is generated by ECR scans by mentioning the name of all packages in a random order. This fails during comparison.
+        ## The fields are compared without dataclasses.asdict, which deep copies them, as vulnerability lists compare
+        ## thousands of vulnerabilities. Nested values are compared with == either way.
         if test_utils.check_if_two_dictionaries_are_equal(
-            dataclasses.asdict(self.package_details),
-            dataclasses.asdict(other.package_details),
+            _get_dataclass_fields(self.package_details),
+            _get_dataclass_fields(other.package_details),
             ignore_keys=["version", "file_path"],
         ):
             ignore_keys = ["package_details", "title", "reason_to_ignore"]
             if is_huggingface_image():
                 ignore_keys.extend(["description"])
             return test_utils.check_if_two_dictionaries_are_equal(
-                dataclasses.asdict(self),
-                dataclasses.asdict(other),
+                _get_dataclass_fields(self),
+                _get_dataclass_fields(other),
                 ignore_keys=ignore_keys,
             )
         return False
@@ -261,6 +284,52 @@ class ScanVulnerabilityList:
     ):
         pass
 
+    def get_vulnerability_index_key(self, vulnerability):
+        """
+        Returns a hashable key that is the same for any two equivalent vulnerabilities. Vulnerabilities are looked up by
+        this key instead of being compared pairwise, and only the vulnerabilities with the same key are then compared
+        with are_vulnerabilities_equivalent. The key can thus be coarser than the equivalence, but never finer.
+
+        :param vulnerability: vulnerability in the Allowlist format
+        :return: hashable key, None by default, i.e. every vulnerability of a package is compared
+        """
+        return None
+
+    def get_vulnerability_index(self):
+        """
+        Indexes the vulnerability list by package name and index key, so that looking up a vulnerability takes constant
+        time instead of comparing it with every vulnerability of its package.
+
+        :return: dict, {package_name: {index_key: [vulnerabilities]}}
+        """
+        index = {}
+        for package_name, package_vulnerabilities in self.vulnerability_list.items():
+            package_index = index.setdefault(package_name, {})
+            for vulnerability in package_vulnerabilities:
+                package_index.setdefault(
+                    self.get_vulnerability_index_key(vulnerability), []
+                ).append(vulnerability)
+        return index
+
+    def is_vulnerability_in_index(self, vulnerability, index):
+        """
+        Check if an input vulnerability exists in an index returned by get_vulnerability_index
+
+        :param vulnerability: vulnerability in the Allowlist format
+        :param index: dict, index of the vulnerability list
+        :return: bool True if an equivalent vulnerability is in the index
+        """
+        package_name = self.get_vulnerability_package_name_from_allowlist_formatted_vulnerability(
+            vulnerability
+        )
+        candidates = index.get(package_name, {}).get(
+            self.get_vulnerability_index_key(vulnerability), []
+        )
+        return any(
+            self.are_vulnerabilities_equivalent(vulnerability, allowed_vulnerability)
+            for allowed_vulnerability in candidates
+        )
+
     def get_flattened_vulnerability_list(self):
         """
         Returns the vulnerability list in the flattened format. For eg., if a vulnerability list looks like
@@ -291,20 +360,12 @@ class ScanVulnerabilityList:
                 {"name":"cve-id2", "uri":"http.." ..}
             ]
         }
-        We want to first sort the innermost list of dicts based on the "name" of each dict and then we sort the
-        outermost dict based on keys i.e. package_name1 and package_name2.
+        We sort the outermost dict based on keys i.e. package_name1 and package_name2. The innermost lists keep their
+        order, the saved allowlists and the comparisons in __cmp__ rely on it.
         Note: We do not change the actual vulnerability list.
         :return: dict, sorted vulnerability list
         """
-        copy_dict = copy.deepcopy(self.vulnerability_list)
-        for key, list_of_complex_types in copy_dict.items():
-            uniquified_list = test_utils.uniquify_list_of_complex_datatypes(list_of_complex_types)
-            uniquified_list.sort(
-                key=lambda dict_element: dict_element["name"]
-                if isinstance(dict_element, dict)
-                else dict_element.name
-            )
-        return dict(sorted(copy_dict.items()))
+        return dict(sorted(copy.deepcopy(self.vulnerability_list).items()))
 
     def save_vulnerability_list(self, path):
         if self.vulnerability_list:
@@ -327,7 +388,11 @@ class ScanVulnerabilityList:
         )
         if package_name not in self.vulnerability_list:
             return False
+        # Comparing the index keys first skips the costly equivalence check for most vulnerabilities
+        index_key = self.get_vulnerability_index_key(vulnerability)
         for allowed_vulnerability in self.vulnerability_list[package_name]:
+            if self.get_vulnerability_index_key(allowed_vulnerability) != index_key:
+                continue
             if self.are_vulnerabilities_equivalent(vulnerability, allowed_vulnerability):
                 return True
         return False
@@ -346,14 +411,12 @@ class ScanVulnerabilityList:
             return False
 
         for package_name, package_vulnerabilities in self.vulnerability_list.items():
-            if len(self.vulnerability_list[package_name]) != len(
-                other.vulnerability_list[package_name]
-            ):
+            other_package_vulnerabilities = other.vulnerability_list[package_name]
+            if len(package_vulnerabilities) != len(other_package_vulnerabilities):
                 return False
-            for v1, v2 in zip(
-                self.get_sorted_vulnerability_list()[package_name],
-                other.get_sorted_vulnerability_list()[package_name],
-            ):
+            # The vulnerabilities of a package are in the same order in get_sorted_vulnerability_list, there is no need
+            # to copy the lists to compare them
+            for v1, v2 in zip(package_vulnerabilities, other_package_vulnerabilities):
                 if not self.are_vulnerabilities_equivalent(v1, v2):
                     return False
         return True
@@ -388,11 +451,12 @@ class ScanVulnerabilityList:
         if not other or not other.vulnerability_list:
             return copy.deepcopy(self)
 
+        other_index = other.get_vulnerability_index()
         missing_vulnerabilities = [
             vulnerability
             for package_vulnerabilities in self.vulnerability_list.values()
             for vulnerability in package_vulnerabilities
-            if vulnerability not in other
+            if not other.is_vulnerability_in_index(vulnerability, other_index)
         ]
         if not missing_vulnerabilities:
             return None
@@ -495,6 +559,16 @@ class ECRBasicScanVulnerabilityList(ScanVulnerabilityList):
             ecr_format_vulnerability_list
         )
 
+    def get_vulnerability_index_key(self, vulnerability):
+        """
+        Equivalent vulnerabilities have the same name and severity, see are_vulnerabilities_equivalent.
+
+        :param vulnerability: dict JSON object consisting of information about the vulnerability in the format
+                              presented by the ECR Scan Tool
+        :return: tuple(str, str)
+        """
+        return vulnerability["name"], vulnerability["severity"]
+
     def are_vulnerabilities_equivalent(self, vulnerability_1, vulnerability_2):
         """
         Check if two vulnerability JSON objects are equivalent
@@ -636,6 +710,26 @@ class ECREnhancedScanVulnerabilityList(ScanVulnerabilityList):
         self.vulnerability_list = self.get_sorted_vulnerability_list()
         return self.vulnerability_list
 
+    def get_vulnerability_index_key(self, vulnerability):
+        """
+        Equivalent vulnerabilities have the same values for all the fields used in the key, see
+        AllowListFormatVulnerabilityForEnhancedScan.__eq__.
+
+        :param vulnerability: AllowListFormatVulnerabilityForEnhancedScan
+        :return: tuple
+        """
+        return (
+            vulnerability.vulnerability_id,
+            vulnerability.name,
+            vulnerability.severity,
+            vulnerability.cvss_v3_severity,
+            vulnerability.source,
+            vulnerability.status,
+            vulnerability.package_details.name,
+            vulnerability.package_details.package_manager,
+            vulnerability.package_details.release,
+        )
+
     def are_vulnerabilities_equivalent(self, vulnerability_1, vulnerability_2):
         """
         Check if two vulnerability JSON objects are equivalent
@@ -1005,23 +1099,397 @@ def process_failure_routine_summary_and_store_data_in_s3(failure_routine_summary
     return s3_filename_for_fixable_list, s3_filename_for_non_fixable_list
 
 
+class _ScanWaiter:
+    """
+    An image waited for by ECRScanCoordinator
+    """
+
+    def __init__(self, ecr_client, image_uri, scan_type, timeout_seconds, start_time):
+        self.ecr_client = ecr_client
+        self.image_uri = image_uri
+        self.scan_type = scan_type
+        self.start_time = start_time
+        self.deadline = start_time + timeout_seconds
+        self.status = None
+        self.description = ""
+        self.error = None
+        self.done = threading.Event()
+
+
+class ECRScanStatusCache:
+    """
+    Scan statuses shared by the ECRScanCoordinators of all the test processes of a host (e.g. the
+    pytest-xdist workers), in one JSON file per registry guarded by a file lock. The file holds the
+    images each process waits for and their last known status. The first process to poll once its
+    statuses are older than max_age_seconds queries the status of every image waited for in the
+    registry, so the other processes find theirs in the file on their next poll instead of calling
+    describe_images.
+
+    The lock is only held to read and write the file, not across the describe_images calls: the
+    querying process records a claim in the file, which stops the other processes from querying
+    the same images meanwhile, until query_lease_seconds in case it died.
+    """
+
+    def __init__(
+        self,
+        cache_dir=ECR_SCAN_STATUS_CACHE_DIR,
+        max_age_seconds=5,
+        waited_ttl_seconds=120,
+        query_lease_seconds=60,
+    ):
+        """
+        :param cache_dir: str, directory of the status files
+        :param max_age_seconds: float, age after which a status is queried again
+        :param waited_ttl_seconds: float, time after which an image that is not polled anymore is
+                                   not queried for the other processes
+        :param query_lease_seconds: float, time after which the claim of a process querying the
+                                    statuses expires
+        """
+        self.cache_dir = cache_dir
+        self.max_age_seconds = max_age_seconds
+        self.waited_ttl_seconds = waited_ttl_seconds
+        self.query_lease_seconds = query_lease_seconds
+
+    def get_statuses(self, registry, image_uris, not_before, query, now):
+        """
+        :param registry: str, registry of the images, e.g. <account>.dkr.ecr.<region>.amazonaws.com
+        :param image_uris: list[str], images of the registry waited for by the calling process
+        :param not_before: dict, image uri -> time before which its status is outdated, e.g. the
+                           start of its scan
+        :param query: function, takes a list of image uris and returns their statuses
+        :param now: float, current time
+        :return: dict, image uri -> tuple(scan status, description), the status is None while
+                 another process queries it
+        """
+        os.makedirs(self.cache_dir, exist_ok=True)
+        path = os.path.join(self.cache_dir, f"{registry}.json")
+        claim = {"pid": os.getpid(), "time": now}
+
+        def is_outdated(cache, image_uri):
+            status = cache["statuses"].get(image_uri)
+            return (
+                status is None
+                or now - status[2] >= self.max_age_seconds
+                or status[2] < not_before.get(image_uri, 0)
+            )
+
+        with self._locked_cache(path) as cache:
+            for image_uri in image_uris:
+                cache["waited"][image_uri] = now
+            cache["waited"] = {
+                image_uri: last_polled
+                for image_uri, last_polled in cache["waited"].items()
+                if now - last_polled < self.waited_ttl_seconds
+            }
+            query_image_uris = []
+            current_claim = cache.get("query")
+            is_claimed = (
+                current_claim is not None and now - current_claim["time"] < self.query_lease_seconds
+            )
+            if not is_claimed and any(is_outdated(cache, image_uri) for image_uri in image_uris):
+                query_image_uris = [
+                    image_uri
+                    for image_uri in cache["waited"]
+                    if image_uri in image_uris or is_outdated(cache, image_uri)
+                ]
+                cache["query"] = claim
+            cache["statuses"] = {
+                image_uri: status
+                for image_uri, status in cache["statuses"].items()
+                if image_uri in cache["waited"]
+            }
+
+        statuses = {}
+        try:
+            if query_image_uris:
+                statuses = query(query_image_uris)
+        finally:
+            if query_image_uris:
+                with self._locked_cache(path) as cache:
+                    for image_uri, (status, description) in statuses.items():
+                        cached_status = cache["statuses"].get(image_uri)
+                        if cached_status is None or cached_status[2] <= now:
+                            cache["statuses"][image_uri] = [status, description, now]
+                    if cache.get("query") == claim:
+                        del cache["query"]
+
+        for image_uri in image_uris:
+            if image_uri in statuses:
+                continue
+            cached_status = cache["statuses"].get(image_uri)
+            if cached_status is None or cached_status[2] < not_before.get(image_uri, 0):
+                statuses[image_uri] = (None, "Scan status queried by another process")
+            else:
+                statuses[image_uri] = tuple(cached_status[:2])
+        return {image_uri: tuple(statuses[image_uri]) for image_uri in image_uris}
+
+    @contextlib.contextmanager
+    def _locked_cache(self, path):
+        """
+        Holds the file lock of the status file, and writes back the cache it yields
+        """
+        with open(f"{path}.lock", "a") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                with open(path, "r") as cache_file:
+                    cache = json.load(cache_file)
+            except (OSError, ValueError):
+                cache = {"waited": {}, "statuses": {}}
+            yield cache
+            temporary_path = f"{path}.{os.getpid()}"
+            with open(temporary_path, "w") as cache_file:
+                json.dump(cache, cache_file)
+            os.replace(temporary_path, path)
+
+
+class ECRScanCoordinator:
+    """
+    Waits for the ECR scans of any number of images with a single poller thread per process. Every
+    poll queries the status of all the images waited in the process with one describe_images call
+    per repository (up to DESCRIBE_IMAGES_BATCH_SIZE images per call), and wakes each waiter as
+    soon as its scan is done. With a status_cache, the statuses are shared with the coordinators
+    of the other test processes, and one poll queries the images of all of them.
+
+    Scans are expected to take the median duration of the completed scans of the same type (0
+    until a scan completed). Until then, a scan is polled again when it is expected to end. Past
+    that, the poll interval backs off exponentially: it is BACKOFF_FACTOR times the time since the
+    expected end or since the last completed scan of the same type, whichever is later, bounded by
+    min_poll_seconds and max_poll_seconds. Images scanned together tend to complete together, so
+    the polls speed up again as soon as one of them completes.
+    """
+
+    DESCRIBE_IMAGES_BATCH_SIZE = 100
+    # Scan type -> (status of a completed scan, statuses of a scan in progress or None to keep
+    # waiting on any other status)
+    SCAN_TYPES = {
+        "basic": ("COMPLETE", [None, "IN_PROGRESS"]),
+        "enhanced": ("ACTIVE", None),
+    }
+    MAX_OBSERVED_DURATIONS = 20
+    BACKOFF_FACTOR = 0.5
+
+    def __init__(self, min_poll_seconds=5, max_poll_seconds=60, clock=time, status_cache=None):
+        """
+        :param min_poll_seconds: float, first and shortest interval between polls
+        :param max_poll_seconds: float, longest interval between polls
+        :param clock: function returning the current time in seconds
+        :param status_cache: ECRScanStatusCache shared with the other processes, None to query
+                             every status
+        """
+        self.min_poll_seconds = min_poll_seconds
+        self.max_poll_seconds = max_poll_seconds
+        self.clock = clock
+        self.status_cache = status_cache
+        self.describe_images_calls = 0
+        self._lock = threading.Lock()
+        self._wake_up = threading.Event()
+        self._waiters = {}
+        self._observed_durations = collections.defaultdict(list)
+        self._last_completion_times = {}
+        self._poller = None
+
+    def wait(self, ecr_client, image_uri, scan_type="basic", timeout_seconds=600, start_time=None):
+        """
+        Waits for the scan of an image to be done.
+
+        :param ecr_client: boto3 Client for ECR, used to query the status of the image
+        :param image_uri: str, Image URI for image being scanned
+        :param scan_type: str, "basic" (waits for COMPLETE) or "enhanced" (waits for ACTIVE)
+        :param timeout_seconds: float, time after which a TimeoutError is raised
+        :param start_time: float, time the scan was started at, defaults to now
+        :return: tuple(str, str), scan status and its description
+        """
+        if scan_type not in self.SCAN_TYPES:
+            raise ValueError(
+                f"Unknown scan type {scan_type}, expected one of {list(self.SCAN_TYPES)}"
+            )
+        start_time = self.clock() if start_time is None else start_time
+        waiter = _ScanWaiter(ecr_client, image_uri, scan_type, timeout_seconds, start_time)
+        with self._lock:
+            self._waiters.setdefault(image_uri, []).append(waiter)
+            if self._poller is None:
+                self._poller = threading.Thread(target=self._poll, daemon=True)
+                self._poller.start()
+            else:
+                # Query the new image right away instead of at the end of the current interval
+                self._wake_up.set()
+        waiter.done.wait()
+        if waiter.error:
+            raise waiter.error
+        return waiter.status, waiter.description
+
+    def _poll(self):
+        while True:
+            with self._lock:
+                if not self._waiters:
+                    self._poller = None
+                    return
+                # The most recent client of each image, in case older ones expired
+                ecr_clients = {
+                    image_uri: waiters[-1].ecr_client
+                    for image_uri, waiters in self._waiters.items()
+                }
+                start_times = {
+                    image_uri: min(waiter.start_time for waiter in waiters)
+                    for image_uri, waiters in self._waiters.items()
+                }
+            image_uris = list(ecr_clients)
+            try:
+                statuses = self._get_scan_statuses(ecr_clients, start_times)
+            except Exception as e:
+                # e.g. throttling, the waiters keep waiting until their timeout
+                LOGGER.info(f"Failed to get the ECR scan statuses, retrying: {e}")
+                statuses = {
+                    image_uri: (None, f"Failed to get the scan status: {e}")
+                    for image_uri in image_uris
+                }
+            now = self.clock()
+            with self._lock:
+                for image_uri in image_uris:
+                    status, description = statuses[image_uri]
+                    for waiter in list(self._waiters[image_uri]):
+                        self._update_waiter(waiter, status, description, now)
+                self._waiters = {
+                    image_uri: pending_waiters
+                    for image_uri, pending_waiters in (
+                        (image_uri, [waiter for waiter in waiters if not waiter.done.is_set()])
+                        for image_uri, waiters in self._waiters.items()
+                    )
+                    if pending_waiters
+                }
+                sleep_seconds = self._get_sleep_seconds(now)
+            if sleep_seconds is None:
+                continue
+            self._wake_up.wait(sleep_seconds)
+            self._wake_up.clear()
+
+    def _update_waiter(self, waiter, status, description, now):
+        waiter.status, waiter.description = status, description
+        completed_status, in_progress_statuses = self.SCAN_TYPES[waiter.scan_type]
+        if status == completed_status:
+            durations = self._observed_durations[waiter.scan_type]
+            durations.append(now - waiter.start_time)
+            del durations[: -self.MAX_OBSERVED_DURATIONS]
+            self._last_completion_times[waiter.scan_type] = now
+        elif in_progress_statuses is not None and status not in in_progress_statuses:
+            waiter.error = ECRScanFailureException(
+                f"ECR Scan failed for {waiter.image_uri} with description: {description}"
+            )
+        elif now >= waiter.deadline:
+            waiter.error = TimeoutError(
+                f"ECR Scan is still in {status} state with description: {description}. Exiting."
+            )
+        else:
+            return
+        waiter.done.set()
+
+    def _get_sleep_seconds(self, now):
+        """
+        :return: float, time until the next poll, None if there is nothing left to wait for
+        """
+        if not self._waiters:
+            return None
+        sleep_seconds = self.max_poll_seconds
+        for waiters in self._waiters.values():
+            for waiter in waiters:
+                durations = sorted(self._observed_durations[waiter.scan_type])
+                expected_end = waiter.start_time + (
+                    durations[len(durations) // 2] if durations else 0
+                )
+                if now < expected_end:
+                    waiter_sleep_seconds = expected_end - now
+                else:
+                    backoff_start = max(
+                        expected_end, self._last_completion_times.get(waiter.scan_type, 0)
+                    )
+                    waiter_sleep_seconds = (now - backoff_start) * self.BACKOFF_FACTOR
+                waiter_sleep_seconds = min(
+                    max(waiter_sleep_seconds, self.min_poll_seconds),
+                    self.max_poll_seconds,
+                    waiter.deadline - now,
+                )
+                sleep_seconds = min(sleep_seconds, waiter_sleep_seconds)
+        return max(sleep_seconds, 0)
+
+    def _get_scan_statuses(self, ecr_clients, start_times):
+        """
+        :param ecr_clients: dict, image uri -> boto3 Client for ECR to query its status with
+        :param start_times: dict, image uri -> time its scan was started at
+        :return: dict, image uri -> tuple(scan status, description), the status is None if the
+                 image or its scan cannot be found yet
+        """
+        image_uris_by_registry = collections.defaultdict(list)
+        for image_uri in ecr_clients:
+            image_uris_by_registry[image_uri.split("/")[0]].append(image_uri)
+        statuses = {}
+        for registry, image_uris in image_uris_by_registry.items():
+            # Images of the same registry can be queried with the client of any of them
+            ecr_client = ecr_clients[image_uris[-1]]
+
+            def query(query_image_uris, ecr_client=ecr_client):
+                return self._query_scan_statuses(ecr_client, query_image_uris)
+
+            if self.status_cache is None:
+                statuses.update(query(image_uris))
+            else:
+                statuses.update(
+                    self.status_cache.get_statuses(
+                        registry, image_uris, start_times, query, self.clock()
+                    )
+                )
+        return statuses
+
+    def _query_scan_statuses(self, ecr_client, image_uris):
+        statuses = {image_uri: (None, "Scan not started") for image_uri in image_uris}
+        image_uris_by_repository = collections.defaultdict(dict)
+        for image_uri in image_uris:
+            repository, tag = test_utils.get_repository_and_tag_from_image_uri(image_uri)
+            image_uris_by_repository[repository][tag] = image_uri
+        for repository, image_uris_by_tag in image_uris_by_repository.items():
+            tags = list(image_uris_by_tag)
+            for index in range(0, len(tags), self.DESCRIBE_IMAGES_BATCH_SIZE):
+                batch = tags[index : index + self.DESCRIBE_IMAGES_BATCH_SIZE]
+                for image_detail in self._describe_images(ecr_client, repository, batch):
+                    scan_status = image_detail.get("imageScanStatus")
+                    if not scan_status:
+                        continue
+                    for tag in image_detail.get("imageTags", []):
+                        if tag in image_uris_by_tag:
+                            statuses[image_uris_by_tag[tag]] = (
+                                scan_status["status"],
+                                scan_status.get("description", "NO DESCRIPTION"),
+                            )
+        return statuses
+
+    def _describe_images(self, ecr_client, repository, tags):
+        with self._lock:
+            self.describe_images_calls += 1
+        try:
+            return ecr_client.describe_images(
+                repositoryName=repository, imageIds=[{"imageTag": tag} for tag in tags]
+            )["imageDetails"]
+        except ecr_client.exceptions.ImageNotFoundException as e:
+            # Newly pushed images can take some time to show up, query the images one by one so
+            # that the other images of the batch still get their status
+            if len(tags) == 1:
+                LOGGER.info(e.response)
+                return []
+            return [
+                image_detail
+                for tag in tags
+                for image_detail in self._describe_images(ecr_client, repository, [tag])
+            ]
+
+
+_ECR_SCAN_COORDINATOR = ECRScanCoordinator(status_cache=ECRScanStatusCache())
+
+
 def run_scan(ecr_client, image):
-    scan_status = None
     start_time = time()
     ecr_utils.start_ecr_image_scan(ecr_client, image)
-    while (time() - start_time) <= 600:
-        scan_status, scan_status_description = ecr_utils.get_ecr_image_scan_status(
-            ecr_client, image
-        )
-        if scan_status == "FAILED" or scan_status not in [None, "IN_PROGRESS", "COMPLETE"]:
-            raise ECRScanFailureException(
-                f"ECR Scan failed for {image} with description: {scan_status_description}"
-            )
-        if scan_status == "COMPLETE":
-            break
-        sleep(1)
-    if scan_status != "COMPLETE":
-        raise TimeoutError(f"ECR Scan is still in {scan_status} state. Exiting.")
+    _ECR_SCAN_COORDINATOR.wait(
+        ecr_client, image, scan_type="basic", timeout_seconds=600, start_time=start_time
+    )
 
 
 def wait_for_enhanced_scans_to_complete(ecr_client, image):
@@ -1033,26 +1501,7 @@ def wait_for_enhanced_scans_to_complete(ecr_client, image):
     :param ecr_client: boto3 Client for ECR
     :param image: str, Image URI for image being scanned
     """
-    scan_status = None
-    scan_status_description = ""
-    start_time = time()
-    while (time() - start_time) <= 45 * 60:
-        try:
-            scan_status, scan_status_description = ecr_utils.get_ecr_image_enhanced_scan_status(
-                ecr_client, image
-            )
-        except ecr_client.exceptions.ScanNotFoundException as e:
-            LOGGER.info(e.response)
-            LOGGER.info(
-                "It takes sometime for the newly uploaded image to show its scan status, hence the error handling"
-            )
-        if scan_status == "ACTIVE":
-            break
-        sleep(1 * 60)
-    if scan_status != "ACTIVE":
-        raise TimeoutError(
-            f"ECR Scan is still in {scan_status} state with description: {scan_status_description}. Exiting."
-        )
+    _ECR_SCAN_COORDINATOR.wait(ecr_client, image, scan_type="enhanced", timeout_seconds=45 * 60)
 
 
 def fetch_other_vulnerability_lists(image, ecr_client, minimum_sev_threshold):
@@ -1218,13 +1667,12 @@ def get_os_package_upgradable_status(
 )
 def get_latest_version_of_a_python_package(package_name: str):
     """
-    Get the latest version of a python package. Calls PyPi to extract the same.
+    Get the latest version of a python package. Calls PyPi to extract the same, unless the PyPI
+    metadata of the package is cached.
 
     :return: str, version of the package
     """
-    response = requests.get(f"https://pypi.org/pypi/{package_name}/json")
-    latest_version = response.json()["info"]["version"]
-    return latest_version
+    return PYPI_METADATA_CACHE.get_latest_version(package_name)
 
 
 def check_if_python_vulnerability_is_non_patchable_and_get_ignore_message(